@@ -0,0 +1,35 @@
+"""
+Add teacher_subjects table recording which subjects each teacher may teach
+
+Revision ID: 0009_teacher_subjects
+Revises: 0008_add_system_settings
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_teacher_subjects'
+down_revision = '0008_add_system_settings'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'teacher_subjects',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('teacher_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('subject_id', sa.Integer(), sa.ForeignKey('subjects.id'), nullable=False),
+        sa.UniqueConstraint('teacher_id', 'subject_id', name='u_teacher_subject')
+    )
+    op.create_index(op.f('ix_teacher_subjects_teacher_id'), 'teacher_subjects', ['teacher_id'], unique=False)
+    op.create_index(op.f('ix_teacher_subjects_subject_id'), 'teacher_subjects', ['subject_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_teacher_subjects_subject_id'), table_name='teacher_subjects')
+    op.drop_index(op.f('ix_teacher_subjects_teacher_id'), table_name='teacher_subjects')
+    op.drop_table('teacher_subjects')
@@ -0,0 +1,96 @@
+"""
+Store timetable slot times as integer minutes and index them for overlap probes
+
+Adds generated integer columns start_minute/end_minute (minutes since
+midnight, derived from the 'HH:MM' strings so existing writers keep working)
+and rebuilds time_range and the no_teacher_overlap exclusion constraint on
+top of the same expression. The constraint's GiST index on
+(teacher_id, day_of_week, time_range) is what teacher_has_overlap() probes.
+
+This replaces scripts/add_timetable_no_teacher_overlap.py; databases that
+ran that script are brought in line here as well.
+
+Revision ID: 0010_timetable_minutes
+Revises: 0009_teacher_subjects
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_timetable_minutes'
+down_revision = '0009_teacher_subjects'
+branch_labels = None
+depends_on = None
+
+
+START_MINUTE_SQL = "(CAST(substr(start_time, 1, 2) AS integer) * 60 + CAST(substr(start_time, 4, 2) AS integer))"
+END_MINUTE_SQL = "(CAST(substr(end_time, 1, 2) AS integer) * 60 + CAST(substr(end_time, 4, 2) AS integer))"
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+
+    # Same guard as 0004: generated columns cannot be added over malformed rows
+    op.execute(r"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM timetable_slots
+            WHERE start_time IS NULL OR end_time IS NULL
+               OR start_time !~ '^(?:[01][0-9]|2[0-3]):[0-5][0-9]$'
+               OR end_time   !~ '^(?:[01][0-9]|2[0-3]):[0-5][0-9]$'
+        ) THEN
+            RAISE EXCEPTION 'Found timetable_slots rows with NULL or invalid start_time/end_time. Fix them before running this migration.';
+        END IF;
+    END
+    $$;
+    """)
+
+    # Drop the constraint and range added by 0004 (or by the old standalone script)
+    op.execute("ALTER TABLE timetable_slots DROP CONSTRAINT IF EXISTS no_teacher_overlap;")
+    op.execute("ALTER TABLE timetable_slots DROP COLUMN IF EXISTS time_range;")
+
+    op.execute(f"""
+    ALTER TABLE timetable_slots
+      ADD COLUMN start_minute integer GENERATED ALWAYS AS {START_MINUTE_SQL} STORED,
+      ADD COLUMN end_minute integer GENERATED ALWAYS AS {END_MINUTE_SQL} STORED,
+      ADD COLUMN time_range int4range GENERATED ALWAYS AS (int4range({START_MINUTE_SQL}, {END_MINUTE_SQL})) STORED;
+    """)
+
+    # The exclusion constraint builds the GiST index on (teacher_id, day_of_week, time_range)
+    # and makes the database reject a teacher booked into two overlapping slots.
+    op.execute("""
+    ALTER TABLE timetable_slots ADD CONSTRAINT no_teacher_overlap EXCLUDE USING gist (
+      teacher_id WITH =,
+      day_of_week WITH =,
+      time_range WITH &&
+    );
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE timetable_slots DROP CONSTRAINT IF EXISTS no_teacher_overlap;")
+    op.execute("ALTER TABLE timetable_slots DROP COLUMN IF EXISTS time_range;")
+    op.execute("ALTER TABLE timetable_slots DROP COLUMN IF EXISTS end_minute;")
+    op.execute("ALTER TABLE timetable_slots DROP COLUMN IF EXISTS start_minute;")
+
+    # Restore the 0004 definition
+    op.execute(r"""
+    ALTER TABLE timetable_slots
+      ADD COLUMN time_range int4range GENERATED ALWAYS AS (
+        int4range(
+          (split_part(start_time, ':', 1)::int * 60 + split_part(start_time, ':', 2)::int),
+          (split_part(end_time,   ':', 1)::int * 60 + split_part(end_time,   ':', 2)::int)
+        )
+      ) STORED;
+    """)
+    op.execute("""
+    ALTER TABLE timetable_slots ADD CONSTRAINT no_teacher_overlap EXCLUDE USING gist (
+      teacher_id WITH =,
+      day_of_week WITH =,
+      time_range WITH &&
+    );
+    """)
@@ -0,0 +1,27 @@
+"""
+Add index on timetable_slots (teacher_id, day_of_week, start_time) for the teacher week view
+
+Revision ID: 0011_timetable_teacher_index
+Revises: 0010_timetable_minutes
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_timetable_teacher_index'
+down_revision = '0010_timetable_minutes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves a teacher's whole week in day/time order with one index range scan
+    op.create_index('ix_timetable_slots_teacher_day_start', 'timetable_slots',
+                    ['teacher_id', 'day_of_week', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timetable_slots_teacher_day_start', table_name='timetable_slots')
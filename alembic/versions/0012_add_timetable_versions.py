@@ -0,0 +1,36 @@
+"""
+Add timetable_versions change counters used for timetable ETags
+
+Revision ID: 0012_timetable_versions
+Revises: 0011_timetable_teacher_index
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_timetable_versions'
+down_revision = '0011_timetable_teacher_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'timetable_versions',
+        sa.Column('class_id', sa.Integer(), sa.ForeignKey('classes.id'), primary_key=True),
+        sa.Column('stream_id', sa.Integer(), sa.ForeignKey('streams.id'), primary_key=True),
+        sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    )
+    # Seed a row for every class/stream that already has slots
+    op.execute("""
+        INSERT INTO timetable_versions (class_id, stream_id, version)
+        SELECT DISTINCT class_id, stream_id, 1 FROM timetable_slots
+    """)
+
+
+def downgrade():
+    op.drop_table('timetable_versions')
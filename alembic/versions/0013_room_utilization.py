@@ -0,0 +1,86 @@
+"""
+Enforce classroom non-overlap and add the room utilization grid
+
+Adds no_classroom_overlap, an exclusion constraint on
+(trim(classroom), day_of_week, time_range) built the same way as
+no_teacher_overlap, so two streams can no longer be booked into one room at
+the same time. Slots without a classroom are not constrained.
+
+Creates room_utilization (one row per room x day x period, NULL slot_id
+when free) and fills it from the current timetable; the application
+rebuilds affected rooms on every timetable write.
+
+Revision ID: 0013_room_utilization
+Revises: 0012_timetable_versions
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013_room_utilization'
+down_revision = '0012_timetable_versions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rooms filled in by populate_classroom_data* may already be shared
+    op.execute(r"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM timetable_slots a
+            JOIN timetable_slots b
+              ON btrim(a.classroom) = btrim(b.classroom)
+             AND a.day_of_week = b.day_of_week
+             AND a.time_range && b.time_range
+             AND a.id < b.id
+            WHERE btrim(coalesce(a.classroom, '')) <> ''
+        ) THEN
+            RAISE EXCEPTION 'Found classrooms booked by two slots at overlapping times. Fix them before running this migration.';
+        END IF;
+    END
+    $$;
+    """)
+
+    op.execute("""
+    ALTER TABLE timetable_slots ADD CONSTRAINT no_classroom_overlap EXCLUDE USING gist (
+      btrim(classroom) WITH =,
+      day_of_week WITH =,
+      time_range WITH &&
+    ) WHERE (classroom IS NOT NULL AND btrim(classroom) <> '');
+    """)
+
+    op.create_table(
+        'room_utilization',
+        sa.Column('classroom', sa.String(length=50), nullable=False),
+        sa.Column('day_of_week', sa.String(length=20), nullable=False),
+        sa.Column('start_time', sa.String(length=5), nullable=False),
+        sa.Column('end_time', sa.String(length=5), nullable=False),
+        sa.Column('class_id', sa.Integer(), sa.ForeignKey('classes.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('stream_id', sa.Integer(), sa.ForeignKey('streams.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('slot_id', sa.Integer(), sa.ForeignKey('timetable_slots.id', ondelete='SET NULL'), nullable=True),
+        sa.PrimaryKeyConstraint('classroom', 'day_of_week', 'start_time'),
+    )
+    op.create_index('ix_room_utilization_day_start', 'room_utilization', ['day_of_week', 'start_time', 'slot_id'])
+
+    op.execute("""
+    INSERT INTO room_utilization (classroom, day_of_week, start_time, end_time, class_id, stream_id, slot_id)
+    SELECT r.classroom, p.day_of_week, p.start_time, p.end_time, s.class_id, s.stream_id, s.id
+    FROM (SELECT DISTINCT btrim(classroom) AS classroom FROM timetable_slots
+          WHERE classroom IS NOT NULL AND btrim(classroom) <> '') r
+    CROSS JOIN (SELECT DISTINCT day_of_week, start_time, end_time FROM timetable_slots) p
+    LEFT JOIN timetable_slots s
+      ON btrim(s.classroom) = r.classroom
+     AND s.day_of_week = p.day_of_week
+     AND s.start_time = p.start_time;
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_room_utilization_day_start', table_name='room_utilization')
+    op.drop_table('room_utilization')
+    op.execute("ALTER TABLE timetable_slots DROP CONSTRAINT IF EXISTS no_classroom_overlap;")
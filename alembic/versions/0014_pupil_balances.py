@@ -0,0 +1,61 @@
+"""
+Add pupil_balances, materialized fee totals per pupil and period
+
+Revision ID: 0014_pupil_balances
+Revises: 0013_room_utilization
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014_pupil_balances'
+down_revision = '0013_room_utilization'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'pupil_balances',
+        sa.Column('pupil_id', sa.Integer(), sa.ForeignKey('pupils.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('year', sa.Integer(), primary_key=True, server_default='0'),
+        sa.Column('term', sa.String(length=20), primary_key=True, server_default=''),
+        sa.Column('required', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('paid', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('balance', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    )
+    # Same rows as utils.pupil_balances.refresh_pupil_balances(): year 0 / term ''
+    # stand for "all", and payments without a year or term only count there.
+    op.execute("""
+        INSERT INTO pupil_balances (pupil_id, year, term, required, paid, balance, updated_at)
+        SELECT pu.id,
+               COALESCE(pd.year, 0),
+               COALESCE(pd.term, ''),
+               COALESCE(rq.required, 0),
+               COALESCE(pd.paid, 0),
+               COALESCE(rq.required, 0) - COALESCE(pd.paid, 0),
+               now()
+        FROM pupils pu
+        LEFT JOIN (
+            SELECT class_id, SUM(amount) AS required
+            FROM class_fees_structure GROUP BY class_id
+        ) rq ON rq.class_id = pu.class_id
+        LEFT JOIN (
+            SELECT pupil_id,
+                   CASE WHEN GROUPING(year) = 0 THEN year ELSE 0 END AS year,
+                   CASE WHEN GROUPING(term) = 0 THEN term ELSE '' END AS term,
+                   SUM(CASE WHEN status = 'completed' THEN amount_paid ELSE 0 END) AS paid
+            FROM payments
+            GROUP BY GROUPING SETS ((pupil_id), (pupil_id, year), (pupil_id, term), (pupil_id, year, term))
+            HAVING (GROUPING(year) = 1 OR year IS NOT NULL)
+               AND (GROUPING(term) = 1 OR (term IS NOT NULL AND term <> ''))
+        ) pd ON pd.pupil_id = pu.id
+    """)
+
+
+def downgrade():
+    op.drop_table('pupil_balances')
@@ -0,0 +1,27 @@
+"""
+Add payments.idempotency_key so retried payment submits are not posted twice
+
+Revision ID: 0015_payment_idempotency_key
+Revises: 0014_pupil_balances
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0015_payment_idempotency_key'
+down_revision = '0014_pupil_balances'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('payments', sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+    op.create_unique_constraint('uq_payments_idempotency_key', 'payments', ['idempotency_key'])
+
+
+def downgrade():
+    op.drop_constraint('uq_payments_idempotency_key', 'payments', type_='unique')
+    op.drop_column('payments', 'idempotency_key')
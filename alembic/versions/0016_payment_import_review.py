@@ -0,0 +1,47 @@
+"""
+Add payment_import_review, the queue of statement lines the importer could not post
+
+Revision ID: 0016_payment_import_review
+Revises: 0015_payment_idempotency_key
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0016_payment_import_review'
+down_revision = '0015_payment_idempotency_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payment_import_review',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('batch_id', sa.String(length=36), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('row_number', sa.Integer(), nullable=False),
+        sa.Column('transaction_date', sa.DateTime(), nullable=True),
+        sa.Column('reference', sa.String(length=100), nullable=True),
+        sa.Column('narration', sa.String(length=255), nullable=True),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('reason', sa.String(length=255), nullable=False),
+        sa.Column('pupil_id', sa.Integer(), sa.ForeignKey('pupils.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('payment_method', sa.String(length=50), nullable=True),
+        sa.Column('year', sa.Integer(), nullable=True),
+        sa.Column('term', sa.String(length=20), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('resolved_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_payment_import_review_batch_id', 'payment_import_review', ['batch_id'])
+    op.create_index('ix_payment_import_review_status', 'payment_import_review', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_payment_import_review_status', table_name='payment_import_review')
+    op.drop_index('ix_payment_import_review_batch_id', table_name='payment_import_review')
+    op.drop_table('payment_import_review')
@@ -0,0 +1,77 @@
+"""
+Add receipts (one per payment) and sequences for receipt numbers
+
+Revision ID: 0017_receipts
+Revises: 0016_payment_import_review
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0017_receipts'
+down_revision = '0016_payment_import_review'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Pupil registration numbers (RCT-001) continue after the highest one in use
+    op.execute("CREATE SEQUENCE IF NOT EXISTS pupil_receipt_number_seq")
+    op.execute("""
+        SELECT setval('pupil_receipt_number_seq', GREATEST(COALESCE(MAX(CAST(substring(receipt_number FROM 5) AS integer)), 0), 1),
+                      MAX(CAST(substring(receipt_number FROM 5) AS integer)) IS NOT NULL)
+        FROM pupils WHERE receipt_number ~ '^RCT-[0-9]+$'
+    """)
+    op.execute("CREATE SEQUENCE IF NOT EXISTS receipt_number_seq")
+
+    op.create_table(
+        'receipts',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('receipt_number', sa.String(length=20), nullable=False,
+                  server_default=sa.text("'RCP-' || lpad(nextval('receipt_number_seq')::text, 6, '0')")),
+        sa.Column('payment_id', sa.Integer(), sa.ForeignKey('payments.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('pupil_id', sa.Integer(), sa.ForeignKey('pupils.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('fee_item_name', sa.String(length=255), nullable=True),
+        sa.Column('payment_method', sa.String(length=50), nullable=True),
+        sa.Column('reference', sa.String(length=100), nullable=True),
+        sa.Column('year', sa.Integer(), nullable=True),
+        sa.Column('term', sa.String(length=20), nullable=True),
+        sa.Column('total_required', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('total_paid', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('balance', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('cashier_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('cashier_name', sa.String(length=200), nullable=True),
+        sa.Column('cashier_role', sa.String(length=100), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='issued'),
+        sa.Column('version', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('issued_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.UniqueConstraint('receipt_number', name='uq_receipts_receipt_number'),
+        sa.UniqueConstraint('payment_id', name='uq_receipts_payment_id'),
+    )
+    op.create_index('ix_receipts_pupil_issued', 'receipts', ['pupil_id', 'issued_at'])
+
+    # Receipts for existing payments, numbered in payment order. The totals
+    # are today's balances (0014), not the historical ones.
+    op.execute("""
+        INSERT INTO receipts (payment_id, pupil_id, amount, fee_item_name, payment_method, reference, year, term,
+                              total_required, total_paid, balance, issued_at, updated_at)
+        SELECT p.id, p.pupil_id, p.amount_paid, f.item_name, p.payment_method, p.reference, p.year, p.term,
+               COALESCE(b.required, 0), COALESCE(b.paid, 0), COALESCE(b.balance, 0),
+               COALESCE(p.payment_date, now()), now()
+        FROM payments p
+        LEFT JOIN class_fees_structure f ON f.id = p.fee_id
+        LEFT JOIN pupil_balances b ON b.pupil_id = p.pupil_id AND b.year = 0 AND b.term = ''
+        ORDER BY p.payment_date, p.id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_receipts_pupil_issued', table_name='receipts')
+    op.drop_table('receipts')
+    op.execute("DROP SEQUENCE IF EXISTS receipt_number_seq")
+    op.execute("DROP SEQUENCE IF EXISTS pupil_receipt_number_seq")
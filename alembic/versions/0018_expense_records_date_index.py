@@ -0,0 +1,39 @@
+"""
+Add index on expense_records (payment_date, item_id) for date-range expense totals
+
+payment_date becomes NOT NULL so keyset pages (which order and compare on
+it) list every record the totals count. Undated rows are backfilled with
+1 January of their year, or the migration time when they have no year.
+
+Revision ID: 0018_expense_records_date_index
+Revises: 0017_receipts
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0018_expense_records_date_index'
+down_revision = '0017_receipts'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    UPDATE expense_records
+       SET payment_date = CASE WHEN year BETWEEN 1900 AND 2999 THEN make_timestamp(year, 1, 1, 0, 0, 0)
+                               ELSE now() END
+     WHERE payment_date IS NULL
+    """)
+    op.alter_column('expense_records', 'payment_date', existing_type=sa.DateTime(), nullable=False)
+    # Half-open payment_date ranges, grouped by item, newest-first keyset pages
+    op.create_index('ix_expense_records_date_item', 'expense_records',
+                    ['payment_date', 'item_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_expense_records_date_item', table_name='expense_records')
+    op.alter_column('expense_records', 'payment_date', existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,86 @@
+"""
+Add finance_rollup, fee income / expenses / salaries per month and per term
+
+Revision ID: 0019_finance_rollup
+Revises: 0018_expense_records_date_index
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0019_finance_rollup'
+down_revision = '0018_expense_records_date_index'
+branch_labels = None
+depends_on = None
+
+
+# One source's contribution to both period types, in the rollup's column
+# order. Same rules as utils.finance_rollup.rebuild_finance_rollup().
+SOURCE = """
+    SELECT 'month' AS period_type,
+           EXTRACT(YEAR FROM s.payment_date)::int AS year,
+           to_char(s.payment_date, 'MM') AS period,
+           {columns}
+    FROM {table} s
+    WHERE {counted} AND s.payment_date IS NOT NULL
+    GROUP BY 2, 3
+    UNION ALL
+    SELECT 'term',
+           CASE WHEN s.year IS NOT NULL AND COALESCE(s.term, '') <> '' THEN s.year ELSE r.year END,
+           CASE WHEN s.year IS NOT NULL AND COALESCE(s.term, '') <> '' THEN s.term ELSE r.name END,
+           {columns}
+    FROM {table} s
+    LEFT JOIN LATERAL (
+        SELECT t.year, t.name FROM terms t
+        WHERE t.start_date <= s.payment_date::date
+        ORDER BY t.start_date DESC LIMIT 1
+    ) r ON true
+    WHERE {counted}
+      AND CASE WHEN s.year IS NOT NULL AND COALESCE(s.term, '') <> '' THEN s.term ELSE r.name END IS NOT NULL
+    GROUP BY 2, 3
+"""
+
+
+def _columns(amount, kind):
+    values = []
+    for name in ('fee', 'expense', 'salary'):
+        if name == kind:
+            values += [f'SUM(s.{amount})', 'COUNT(*)']
+        else:
+            values += ['0', '0']
+    return ', '.join(values)
+
+
+def upgrade():
+    op.create_table(
+        'finance_rollup',
+        sa.Column('period_type', sa.String(length=10), primary_key=True),
+        sa.Column('year', sa.Integer(), primary_key=True),
+        sa.Column('period', sa.String(length=20), primary_key=True),
+        sa.Column('fee_income', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('fee_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('expenses', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('expense_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('salaries', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('salary_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+    )
+    sources = '\nUNION ALL\n'.join([
+        SOURCE.format(table='payments', counted="s.status = 'completed'", columns=_columns('amount_paid', 'fee')),
+        SOURCE.format(table='expense_records', counted='true', columns=_columns('amount', 'expense')),
+        SOURCE.format(table='salary_payments', counted="s.status = 'paid'", columns=_columns('amount', 'salary')),
+    ])
+    op.execute(f"""
+        INSERT INTO finance_rollup (period_type, year, period, fee_income, fee_count,
+                                    expenses, expense_count, salaries, salary_count, updated_at)
+        SELECT period_type, year, period, SUM(c1), SUM(c2), SUM(c3), SUM(c4), SUM(c5), SUM(c6), now()
+        FROM ({sources}) AS combined (period_type, year, period, c1, c2, c3, c4, c5, c6)
+        GROUP BY period_type, year, period
+    """)
+
+
+def downgrade():
+    op.drop_table('finance_rollup')
@@ -0,0 +1,27 @@
+"""
+Add index on salary_payments (user_id, period_year, period_month) for the salary status page
+
+Revision ID: 0020_salary_payments_user_period
+Revises: 0019_finance_rollup
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0020_salary_payments_user_period'
+down_revision = '0019_finance_rollup'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One probe per user for the LATERAL current-period payment lookup
+    op.create_index('ix_salary_payments_user_period', 'salary_payments',
+                    ['user_id', 'period_year', 'period_month'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_salary_payments_user_period', table_name='salary_payments')
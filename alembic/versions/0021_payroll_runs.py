@@ -0,0 +1,69 @@
+"""
+Add payroll_runs and one paid salary payment per user and month
+
+Revision ID: 0021_payroll_runs
+Revises: 0020_salary_payments_user_period
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0021_payroll_runs'
+down_revision = '0020_salary_payments_user_period'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payroll_runs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('period_month', sa.Integer(), nullable=False),
+        sa.Column('period_year', sa.Integer(), nullable=False),
+        sa.Column('role_id', sa.Integer(), sa.ForeignKey('roles.id'), nullable=True),
+        sa.Column('run_by_user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('eligible_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('paid_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('skipped_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('no_salary_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_amount', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+    )
+    op.add_column('salary_payments', sa.Column('payroll_run_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_salary_payments_payroll_run_id', 'salary_payments', 'payroll_runs',
+                          ['payroll_run_id'], ['id'], ondelete='SET NULL')
+    op.create_index('ix_salary_payments_payroll_run_id', 'salary_payments', ['payroll_run_id'])
+
+    # The old duplicate check was not atomic, so a user may already have two
+    # paid rows for a month. Keep the first and reverse the rest (with a note)
+    # so the unique index can be built. finance_rollup still counts any rows
+    # reversed here; run `flask rebuild-finance-rollup` afterwards.
+    op.execute("""
+        UPDATE salary_payments sp
+        SET status = 'reversed',
+            notes = COALESCE(sp.notes || E'\\n', '') || '[Reversed by migration 0021: duplicate of payment ' || d.keep_id || ']',
+            updated_at = now()
+        FROM (
+            SELECT id,
+                   first_value(id) OVER w AS keep_id,
+                   row_number() OVER w AS n
+            FROM salary_payments
+            WHERE status = 'paid' AND period_month IS NOT NULL
+            WINDOW w AS (PARTITION BY user_id, period_year, period_month ORDER BY payment_date, id)
+        ) d
+        WHERE sp.id = d.id AND d.n > 1
+    """)
+    op.create_index('uq_salary_payments_user_period_paid', 'salary_payments',
+                    ['user_id', 'period_year', 'period_month'], unique=True,
+                    postgresql_where=sa.text("status = 'paid' AND period_month IS NOT NULL"))
+
+
+def downgrade():
+    op.drop_index('uq_salary_payments_user_period_paid', table_name='salary_payments')
+    op.drop_index('ix_salary_payments_payroll_run_id', table_name='salary_payments')
+    op.drop_constraint('fk_salary_payments_payroll_run_id', 'salary_payments', type_='foreignkey')
+    op.drop_column('salary_payments', 'payroll_run_id')
+    op.drop_table('payroll_runs')
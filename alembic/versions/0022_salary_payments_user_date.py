@@ -0,0 +1,27 @@
+"""
+Add index on salary_payments (user_id, payment_date) for the headteacher staff list
+
+Revision ID: 0022_salary_payments_user_date
+Revises: 0021_payroll_runs
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0022_salary_payments_user_date'
+down_revision = '0021_payroll_runs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Backward scan per user for the LATERAL latest-payment lookup
+    op.create_index('ix_salary_payments_user_date', 'salary_payments',
+                    ['user_id', 'payment_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_salary_payments_user_date', table_name='salary_payments')
@@ -0,0 +1,33 @@
+"""
+Add index on salary_payments (payment_date, id) for keyset-paged payment listing
+
+payment_date becomes NOT NULL so keyset pages list every payment the full
+export does. Undated rows are backfilled from created_at, or the migration
+time.
+
+Revision ID: 0023_salary_payments_date
+Revises: 0022_salary_payments_user_date
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0023_salary_payments_date'
+down_revision = '0022_salary_payments_user_date'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE salary_payments SET payment_date = COALESCE(created_at, now()) WHERE payment_date IS NULL")
+    op.alter_column('salary_payments', 'payment_date', existing_type=sa.DateTime(), nullable=False)
+    # Pages continue from (payment_date, id) < cursor, newest first
+    op.create_index('ix_salary_payments_date', 'salary_payments', ['payment_date', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_salary_payments_date', table_name='salary_payments')
+    op.alter_column('salary_payments', 'payment_date', existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,34 @@
+"""
+Allow a single system_settings row
+
+Revision ID: 0024_system_settings_singleton
+Revises: 0023_salary_payments_date
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0024_system_settings_singleton'
+down_revision = '0023_salary_payments_date'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # get_settings() used to delete duplicates on read; keep the most recently updated row, as it did
+    op.execute("""
+        DELETE FROM system_settings
+        WHERE id <> (
+            SELECT id FROM system_settings
+            ORDER BY updated_at DESC NULLS LAST, id DESC
+            LIMIT 1
+        )
+    """)
+    op.execute("CREATE UNIQUE INDEX uq_system_settings_singleton ON system_settings ((true))")
+
+
+def downgrade():
+    op.drop_index('uq_system_settings_singleton', table_name='system_settings')
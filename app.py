@@ -1,8 +1,9 @@
 import os
 import logging
-from datetime import datetime, timedelta
+import click
+from datetime import timedelta
 from flask import Flask, render_template, session, redirect, url_for, flash, request, send_from_directory
-from models.user_models import db, AdminSession
+from models.user_models import db
 from models import marks_model   # ✅ Import marks_model to include new tables
 from routes.user_routes import user_routes
 from routes.admin_routes import admin_routes
@@ -62,6 +63,18 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 # ✅ Initialize DB
 db.init_app(app)
 
+# ✅ Keep the finance_rollup table and the cached staff, settings and teacher scope data in step with writes
+from utils.finance_rollup import track_finance_writes
+track_finance_writes()
+from utils.staff_directory import track_staff_writes
+track_staff_writes()
+from utils.settings_cache import track_settings_writes, current_settings
+track_settings_writes()
+from utils.teacher_scope import track_assignment_writes
+track_assignment_writes()
+
+from utils.admin_sessions import check_admin_session, touch_admin_session, USER_MISSING, MULTI_DEVICE_LOGIN, SESSION_INACTIVE
+
 # ✅ Register Blueprints
 app.register_blueprint(user_routes)
 app.register_blueprint(admin_routes)
@@ -78,8 +91,7 @@ app.register_blueprint(headteacher_routes)        # ✅ Register headteacher_rou
 @app.context_processor
 def inject_system_settings():
     try:
-        from models.system_settings import SystemSettings
-        settings = SystemSettings.get_settings()
+        settings = current_settings()
         last = settings.last_backup_time.strftime('%d/%m/%Y %I:%M:%S %p') if settings.last_backup_time else None
         nxt = settings.next_scheduled_backup.strftime('%d/%m/%Y %I:%M:%S %p') if settings.next_scheduled_backup else None
         # Pop any transient 'welcome back' flag from session so it only appears once
@@ -144,8 +156,6 @@ def validate_admin_session():
 
         # Only check for admin sessions
         if role and role.lower() == "admin" and user_id:
-            from models.user_models import User
-
             # If client doesn't have a session ID, they must log in again
             if not client_session_id:
                 print("[DEBUG] Admin has no active_session_id in Flask session, forcing re-login")
@@ -153,37 +163,29 @@ def validate_admin_session():
                 flash("Your admin session expired. Please log in again.", "danger")
                 return redirect(url_for("user_routes.login"))
 
-            # Get user from DB
-            user = User.query.get(user_id)
-            if not user:
+            # ✅ Cached for a few seconds after each successful check; one query otherwise
+            reason = check_admin_session(user_id, client_session_id)
+            if reason == USER_MISSING:
                 session.clear()
                 flash("Your account was deleted or is no longer available.", "danger")
                 return redirect(url_for("user_routes.login"))
 
-            # ✅ KEY CHECK: Compare client's session ID with DB's active session ID
-            # If they don't match, this device is no longer the active session
-            if user.active_session_id != client_session_id:
-                print(f"[SESSION CONFLICT] User {user_id}: Client has {client_session_id[:15]}..., DB has {user.active_session_id[:15] if user.active_session_id else 'None'}...")
+            # ✅ KEY CHECK: the client's session ID must still be the user's active one.
+            # If not, this device is no longer the active session
+            if reason == MULTI_DEVICE_LOGIN:
+                print(f"[SESSION CONFLICT] User {user_id}: Client has {client_session_id[:15]}..., no longer the active session")
                 session.clear()
                 flash("Your admin session was invalidated. You logged in from another device.", "danger")
                 return redirect(url_for("user_routes.login"))
 
-            # ✅ Session IDs match, check if the session is still marked active in DB
-            admin_session = AdminSession.query.filter_by(
-                session_id=client_session_id,
-                user_id=user_id
-            ).first()
-
-            if not admin_session or not admin_session.is_active:
+            if reason == SESSION_INACTIVE:
                 print(f"[SESSION INACTIVE] User {user_id} session is inactive in DB")
                 session.clear()
                 flash("Your admin session was invalidated. Please log in again.", "danger")
                 return redirect(url_for("user_routes.login"))
 
-            # Update last activity timestamp
-            admin_session.last_activity = datetime.utcnow()
-            db.session.commit()
-            print(f"[SESSION VALID] User {user_id} session is active, updated last_activity")
+            # Update last activity timestamp (coalesced: at most one write per session per interval)
+            touch_admin_session(client_session_id)
     except Exception as e:
         # Log the error but don't break the request - fail gracefully for Vercel
         logger.error(f"[SESSION VALIDATION ERROR] {str(e)}")
@@ -205,8 +207,7 @@ def enforce_maintenance_mode():
         if path.startswith('/admin'):
             return
 
-        from models.system_settings import SystemSettings
-        settings = SystemSettings.get_settings()
+        settings = current_settings()
         if not settings or not settings.maintenance_mode:
             return
 
@@ -311,6 +312,28 @@ def health():
         logger.error(f"Database connection failed: {str(e)}")
         return f"Database connection failed: {str(e)}"
 
+# ✅ Rebuild materialized pupil balances: `flask rebuild-pupil-balances [--class-id N]`
+# Run after editing class_fees_structure outside the app (it has no fee editor).
+@app.cli.command("rebuild-pupil-balances")
+@click.option("--class-id", type=int, multiple=True, help="Only pupils in these classes")
+def rebuild_pupil_balances(class_id):
+    from utils.pupil_balances import refresh_pupil_balances
+    if class_id:
+        refresh_pupil_balances(class_ids=class_id)
+    else:
+        refresh_pupil_balances()
+    db.session.commit()
+    click.echo("pupil_balances rebuilt" + (f" for classes {', '.join(map(str, class_id))}" if class_id else ""))
+
+# ✅ Rebuild the income/expense/salary rollup: `flask rebuild-finance-rollup`
+# Writes through the app keep it current; run after editing those tables directly.
+@app.cli.command("rebuild-finance-rollup")
+def rebuild_finance_rollup():
+    from utils.finance_rollup import rebuild_finance_rollup as rebuild
+    rebuild()
+    db.session.commit()
+    click.echo("finance_rollup rebuilt")
+
 # ✅ Auto-create tables if missing (generation moved to admin routes)
 # NOTE: db.create_all() is commented out due to Neon DB connection pool congestion
 # Tables are created by seed scripts or manual migration. Uncomment to enable.
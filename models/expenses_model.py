@@ -14,6 +14,10 @@ class ExpenseItem(db.Model):
 
 class ExpenseRecord(db.Model):
     __tablename__ = 'expense_records'
+    __table_args__ = (
+        # Date-range filters and per-category totals (utils.expense_totals)
+        db.Index('ix_expense_records_date_item', 'payment_date', 'item_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey('expense_items.id'), nullable=True)
     item = db.relationship('ExpenseItem', backref='expenses')
@@ -21,7 +25,7 @@ class ExpenseRecord(db.Model):
     quantity = db.Column(db.Integer, nullable=True)
     description = db.Column(db.Text, nullable=True)
     spent_by = db.Column(db.String(150), nullable=True)  # name of staff who recorded or paid
-    payment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    payment_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     term = db.Column(db.String(50), nullable=True)
     year = db.Column(db.Integer, nullable=True)
 
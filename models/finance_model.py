@@ -0,0 +1,33 @@
+from datetime import datetime
+from models.user_models import db
+
+
+class FinanceRollup(db.Model):
+    """
+    Fee income, expenses and salaries summed per period (see utils.finance_rollup).
+
+    period_type 'month': period is '01'..'12' of `year`, by the date money moved.
+    period_type 'term':  period is the term name ('Term 1'), by the record's
+                         own term/year, else the term its date falls in.
+    """
+    __tablename__ = 'finance_rollup'
+
+    period_type = db.Column(db.String(10), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(20), primary_key=True)
+
+    fee_income = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    fee_count = db.Column(db.Integer, nullable=False, default=0)
+    expenses = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    salaries = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    salary_count = db.Column(db.Integer, nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def net(self):
+        return (self.fee_income or 0) - (self.expenses or 0) - (self.salaries or 0)
+
+    def __repr__(self):
+        return f"<FinanceRollup {self.period_type} {self.year} {self.period}>"
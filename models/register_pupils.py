@@ -1,6 +1,11 @@
 from models.user_models import db
 from datetime import datetime
 
+# Number sources (see alembic 0017): pupil registration receipts (RCT-001)
+# and payment receipts (RCP-000001)
+PUPIL_RECEIPT_NUMBER_SEQ = db.Sequence('pupil_receipt_number_seq', metadata=db.metadata)
+RECEIPT_NUMBER_SEQ = db.Sequence('receipt_number_seq', metadata=db.metadata)
+
 # ============================================================
 # 1. PUPIL MODEL
 # ============================================================
@@ -122,9 +127,13 @@ class Payment(db.Model):
     year = db.Column(db.Integer, nullable=True)
     term = db.Column(db.String(20), nullable=True)
 
+    # Client-supplied key; a retried submit returns the payment already recorded
+    idempotency_key = db.Column(db.String(64), unique=True, nullable=True)
+
     # Relationships
     pupil = db.relationship("Pupil", back_populates="payments")
     fee_item = db.relationship("ClassFeeStructure")
+    receipt = db.relationship("Receipt", back_populates="payment", uselist=False)
 
     # Alias properties for template compatibility
     @property
@@ -146,3 +155,114 @@ class Payment(db.Model):
 
     def __repr__(self):
         return f"<Payment {self.amount_paid} for Pupil {self.pupil_id}, Fee {self.fee_id}>"
+
+
+# ============================================================
+# 4. PUPIL BALANCES (materialized from payments + fee structure)
+# ============================================================
+class PupilBalance(db.Model):
+    """Per-pupil fee totals kept in step with payments (utils.pupil_balances).
+
+    year 0 means "any year" and term '' means "any term", so (0, '') is the
+    pupil's overall balance and (2025, 'Term 1') one period.
+    """
+    __tablename__ = "pupil_balances"
+
+    pupil_id = db.Column(db.Integer, db.ForeignKey('pupils.id', ondelete='CASCADE'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True, default=0)
+    term = db.Column(db.String(20), primary_key=True, default='')
+    required = db.Column(db.Float, nullable=False, default=0)
+    paid = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<PupilBalance pupil={self.pupil_id} {self.term or 'all'} {self.year or ''}: {self.balance}>"
+
+
+# ============================================================
+# 5. STATEMENT IMPORT REVIEW QUEUE
+# ============================================================
+class PaymentImportReview(db.Model):
+    """A bank / mobile-money statement line the importer could not post.
+
+    The bursar either assigns it to a pupil (which posts it) or dismisses it.
+    """
+    __tablename__ = "payment_import_review"
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=True)
+    row_number = db.Column(db.Integer, nullable=False)
+
+    transaction_date = db.Column(db.DateTime, nullable=True)
+    reference = db.Column(db.String(100), nullable=True)
+    narration = db.Column(db.String(255), nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(255), nullable=False)
+
+    # Pupil the line seemed to belong to, when one was found
+    pupil_id = db.Column(db.Integer, db.ForeignKey('pupils.id', ondelete='SET NULL'), nullable=True)
+
+    # Posting details chosen at import time, reused when the line is resolved
+    payment_method = db.Column(db.String(50), nullable=True)
+    year = db.Column(db.Integer, nullable=True)
+    term = db.Column(db.String(20), nullable=True)
+
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # 'pending', 'resolved', 'dismissed'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    pupil = db.relationship("Pupil")
+
+    def __repr__(self):
+        return f"<PaymentImportReview row {self.row_number} {self.amount} ({self.status})>"
+
+
+# ============================================================
+# 6. PAYMENT RECEIPTS
+# ============================================================
+class Receipt(db.Model):
+    """One receipt per payment, written when the payment is posted (utils.receipts).
+
+    Amounts and the pupil's totals are a snapshot taken at posting time, so
+    a rendered receipt only changes when `version` is bumped (payment edited
+    or deleted).
+    """
+    __tablename__ = "receipts"
+    __table_args__ = (
+        db.Index('ix_receipts_pupil_issued', 'pupil_id', 'issued_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    receipt_number = db.Column(db.String(20), unique=True, nullable=False,
+                               server_default=db.text("'RCP-' || lpad(nextval('receipt_number_seq')::text, 6, '0')"))
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id', ondelete='SET NULL'), unique=True, nullable=True)
+    pupil_id = db.Column(db.Integer, db.ForeignKey('pupils.id', ondelete='CASCADE'), nullable=False)
+
+    amount = db.Column(db.Float, nullable=False)
+    fee_item_name = db.Column(db.String(255), nullable=True)
+    payment_method = db.Column(db.String(50), nullable=True)
+    reference = db.Column(db.String(100), nullable=True)
+    year = db.Column(db.Integer, nullable=True)
+    term = db.Column(db.String(20), nullable=True)
+
+    # Pupil totals right after the payment
+    total_required = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)
+
+    cashier_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    cashier_name = db.Column(db.String(200), nullable=True)
+    cashier_role = db.Column(db.String(100), nullable=True)
+
+    status = db.Column(db.String(20), default='issued', nullable=False)  # 'issued' or 'void'
+    version = db.Column(db.Integer, default=1, nullable=False)
+    issued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    payment = db.relationship("Payment", back_populates="receipt")
+    pupil = db.relationship("Pupil")
+
+    def __repr__(self):
+        return f"<Receipt {self.receipt_number} v{self.version} ({self.status})>"
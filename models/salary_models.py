@@ -42,6 +42,18 @@ class SalaryPayment(db.Model):
     Supports partial payments, reversals, and audit trail.
     """
     __tablename__ = 'salary_payments'
+    __table_args__ = (
+        # "Is this user paid for month/year?" (utils.salary_status)
+        db.Index('ix_salary_payments_user_period', 'user_id', 'period_year', 'period_month'),
+        # Latest payment per user (utils.staff_directory)
+        db.Index('ix_salary_payments_user_date', 'user_id', 'payment_date'),
+        # Newest-first keyset pages of all payments (utils.salary_ledger)
+        db.Index('ix_salary_payments_date', 'payment_date', 'id'),
+        # At most one paid payment per user and month; reversed rows stay as audit trail.
+        # Payroll runs insert with ON CONFLICT DO NOTHING against it (utils.payroll).
+        db.Index('uq_salary_payments_user_period_paid', 'user_id', 'period_year', 'period_month', unique=True,
+                 postgresql_where=db.text("status = 'paid' AND period_month IS NOT NULL")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -58,7 +70,7 @@ class SalaryPayment(db.Model):
     paid_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
     # When the payment was recorded (server timestamp)
-    payment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    payment_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # Period tracking - choose one: monthly (month+year) OR term-based (term+year)
     # Monthly: period_month is 1-12
@@ -87,6 +99,9 @@ class SalaryPayment(db.Model):
     # Bank name (only used if payment_method='BANK'): 'Centenary', 'Stanbic', 'ABSA', etc.
     bank_name = db.Column(db.String(100), nullable=True)
 
+    # Set when the payment was created by a payroll run
+    payroll_run_id = db.Column(db.Integer, db.ForeignKey('payroll_runs.id', ondelete='SET NULL'), nullable=True, index=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -110,3 +125,33 @@ class SalaryPayment(db.Model):
             ][self.period_month - 1]
             return f"{month_name} {self.period_year}"
         return "N/A"
+
+
+class PayrollRun(db.Model):
+    """
+    One batch payment of every eligible staff member for a month.
+    Re-running a period is safe: staff already paid are counted as skipped.
+    """
+    __tablename__ = 'payroll_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_month = db.Column(db.Integer, nullable=False)
+    period_year = db.Column(db.Integer, nullable=False)
+    # Optional: run limited to one role
+    role_id = db.Column(db.Integer, db.ForeignKey('roles.id'), nullable=True)
+    run_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+
+    eligible_count = db.Column(db.Integer, nullable=False, default=0)    # staff in scope
+    paid_count = db.Column(db.Integer, nullable=False, default=0)        # payments created by this run
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)     # already paid for the period
+    no_salary_count = db.Column(db.Integer, nullable=False, default=0)   # no salary configured
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=Decimal('0.00'))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    role = db.relationship('Role', foreign_keys=[role_id])
+    run_by = db.relationship('User', foreign_keys=[run_by_user_id])
+    payments = db.relationship('SalaryPayment', backref='payroll_run', lazy=True)
+
+    def __repr__(self):
+        return f"<PayrollRun {self.period_month}/{self.period_year} paid={self.paid_count} skipped={self.skipped_count}>"
@@ -1,4 +1,5 @@
 from models.user_models import db
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime
 import logging
 
@@ -10,6 +11,10 @@ class SystemSettings(db.Model):
     Only one record should exist in the database.
     """
     __tablename__ = 'system_settings'
+    __table_args__ = (
+        # Unique index on a constant: a second row can never be inserted
+        db.Index('uq_system_settings_singleton', db.text('(true)'), unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     
@@ -36,43 +41,25 @@ class SystemSettings(db.Model):
 
     @staticmethod
     def get_settings():
-        """Fetch the single system settings record; create default if none exists."""
+        """Fetch the single system settings record; create default if none exists.
+
+        uq_system_settings_singleton allows only one row, so concurrent first
+        calls cannot create duplicates. Read-only callers on the request path
+        should use utils.settings_cache.current_settings() instead.
+        """
         try:
-            # Prefer the most recently updated settings row if multiple exist
-            rows = SystemSettings.query.order_by(SystemSettings.updated_at.desc()).all()
-            if not rows:
-                settings = SystemSettings()
-                db.session.add(settings)
+            settings = SystemSettings.query.first()
+            if settings is None:
+                db.session.execute(pg_insert(SystemSettings.__table__).on_conflict_do_nothing())
                 db.session.commit()
-                return settings
-
-            # If there are multiple rows, keep the most recently updated and remove others
-            if len(rows) > 1:
-                keeper = rows[0]
-                to_remove = rows[1:]
-                try:
-                    for r in to_remove:
-                        db.session.delete(r)
-                    db.session.commit()
-                    logger.info(f"[SystemSettings] Removed {len(to_remove)} duplicate settings rows, kept id={keeper.id}")
-                except Exception as e:
-                    db.session.rollback()
-                    logger.exception(f"[SystemSettings] Error removing duplicate rows: {e}")
-                return keeper
-
-            return rows[0]
+                settings = SystemSettings.query.first()
+            return settings
         except Exception as e:
             # If the transaction is aborted, rollback and retry
             db.session.rollback()
+            logger.warning(f"[SystemSettings] Could not load settings, retrying: {e}")
             try:
-                rows = SystemSettings.query.order_by(SystemSettings.updated_at.desc()).all()
-                if not rows:
-                    settings = SystemSettings()
-                    db.session.add(settings)
-                    db.session.commit()
-                    return settings
-                return rows[0]
+                return SystemSettings.query.first() or SystemSettings()
             except Exception:
                 # If still failing, create a default in-memory object
-                settings = SystemSettings()
-                return settings
+                return SystemSettings()
@@ -14,4 +14,25 @@ class TeacherAssignment(db.Model):
     stream = db.relationship("Stream", backref="teacher_assignments", lazy=True)
 
     def __repr__(self):
-        return f"<TeacherAssignment Teacher={self.teacher_id} Class={self.class_id} Stream={self.stream_id}>"
\ No newline at end of file
+        return f"<TeacherAssignment Teacher={self.teacher_id} Class={self.class_id} Stream={self.stream_id}>"
+
+class TeacherSubject(db.Model):
+    """Subjects a teacher is qualified to teach.
+
+    Used by the whole-school timetable solver. A subject with no rows here can
+    be taught by any teacher.
+    """
+    __tablename__ = "teacher_subjects"
+    id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey("subjects.id"), nullable=False, index=True)
+
+    teacher = db.relationship("User", backref="teacher_subjects", lazy=True)
+    subject = db.relationship("Subject", backref="teacher_subjects", lazy=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('teacher_id', 'subject_id', name='u_teacher_subject'),
+    )
+
+    def __repr__(self):
+        return f"<TeacherSubject Teacher={self.teacher_id} Subject={self.subject_id}>"
@@ -26,6 +26,14 @@ class TimeTableSlot(db.Model):
     start_time = db.Column(db.String(5), nullable=False)    # HH:MM format (e.g., "08:00")
     end_time = db.Column(db.String(5), nullable=False)      # HH:MM format (e.g., "09:00")
 
+    # Minutes since midnight, generated by the database from start_time/end_time
+    # (migration 0010). A generated int4range `time_range` built from the same
+    # values backs the no_teacher_overlap exclusion constraint and its GiST index.
+    start_minute = db.Column(db.Integer, db.Computed(
+        "CAST(substr(start_time, 1, 2) AS integer) * 60 + CAST(substr(start_time, 4, 2) AS integer)", persisted=True))
+    end_minute = db.Column(db.Integer, db.Computed(
+        "CAST(substr(end_time, 1, 2) AS integer) * 60 + CAST(substr(end_time, 4, 2) AS integer)", persisted=True))
+
     # Classroom/Room assignment
     classroom = db.Column(db.String(50), nullable=True)     # e.g., "Room 101", "Lab A", "Hall 2"
 
@@ -45,6 +53,8 @@ class TimeTableSlot(db.Model):
     __table_args__ = (
         db.UniqueConstraint('teacher_id', 'class_id', 'stream_id', 'day_of_week', 'start_time', name='unique_teacher_class_slot'),
         db.UniqueConstraint('class_id', 'stream_id', 'day_of_week', 'start_time', name='unique_class_slot'),
+        # A teacher's whole week across every stream (teacher timetable view)
+        db.Index('ix_timetable_slots_teacher_day_start', 'teacher_id', 'day_of_week', 'start_time'),
     )
 
     def __repr__(self):
@@ -65,3 +75,47 @@ class TimeTableSlot(db.Model):
     def get_days():
         """Returns available days for timetable"""
         return ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+
+class TimeTableVersion(db.Model):
+    """
+    Change counter per class/stream timetable.
+    Bumped in the same transaction as every generate or slot edit so readers
+    can build an ETag from one primary-key lookup instead of reading slots.
+    """
+    __tablename__ = "timetable_versions"
+
+    class_id = db.Column(db.Integer, db.ForeignKey("classes.id"), primary_key=True)
+    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id"), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TimeTableVersion Class={self.class_id} Stream={self.stream_id} v{self.version}>"
+
+
+class RoomUtilization(db.Model):
+    """
+    Precomputed room x day x period grid.
+    One row per classroom in use and per teaching period of the week; the
+    class/stream/slot columns are NULL when the room is free. Rebuilt for the
+    affected rooms in the same transaction as every timetable write
+    (utils/room_utilization.py), so free rooms are a single indexed read.
+    """
+    __tablename__ = "room_utilization"
+
+    classroom = db.Column(db.String(50), primary_key=True)
+    day_of_week = db.Column(db.String(20), primary_key=True)
+    start_time = db.Column(db.String(5), primary_key=True)
+    end_time = db.Column(db.String(5), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="SET NULL"), nullable=True)
+    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id", ondelete="SET NULL"), nullable=True)
+    slot_id = db.Column(db.Integer, db.ForeignKey("timetable_slots.id", ondelete="SET NULL"), nullable=True)
+
+    __table_args__ = (
+        # "Which rooms are free on Tuesday at 08:40?"
+        db.Index('ix_room_utilization_day_start', 'day_of_week', 'start_time', 'slot_id'),
+    )
+
+    def __repr__(self):
+        return f"<RoomUtilization {self.classroom} {self.day_of_week} {self.start_time} slot={self.slot_id}>"
@@ -1,12 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, stream_with_context
 from models.user_models import db, User, Role
 from models.system_settings import SystemSettings
-from sqlalchemy import func
+from sqlalchemy import func, tuple_, literal_column
+from sqlalchemy.exc import IntegrityError
 from models.class_model import Class
 from models.stream_model import Stream
 from models.marks_model import Subject
-from models.teacher_assignment_models import TeacherAssignment
+from models.teacher_assignment_models import TeacherAssignment, TeacherSubject
 from models.timetable_model import TimeTableSlot
+from utils.timetable_occupancy import OccupancyIndex, time_to_minutes, minutes_to_time, find_conflicts, room_key
+from utils.room_utilization import refresh_room_utilization, room_grid
+from utils.cache_utils import get_cache_redis
+from utils.timetable_export import export_timetables_xlsx, export_teacher_ics_zip, teacher_ics, stream_file
+from utils.timetable_solver import solve_timetable
+from utils.timetable_cache import invalidate_teacher_timetables, bump_timetable_versions, timetable_etag, timetables_etag
+from sqlalchemy.orm import joinedload
+from collections import defaultdict
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 import threading
@@ -27,14 +36,39 @@ def teacher_has_overlap(teacher_id, day_of_week, start_time, end_time,
     """Return True if the teacher has any timetable slot on the given day that overlaps
     the interval [start_time, end_time). Times are 'HH:MM' strings.
 
+    On Postgres this is a single probe of the no_teacher_overlap GiST index on
+    (teacher_id, day_of_week, time_range); elsewhere it compares the integer
+    start_minute/end_minute columns.
+
     Optional excludes:
       - exclude_slot_id: ignore a specific slot (useful during updates).
       - exclude_class_id / exclude_stream_id: ignore all slots belonging to a
         particular class+stream (useful during generation when we are replacing
         slots for the same class/stream).
     """
-    query = TimeTableSlot.query.filter(
-        TimeTableSlot.teacher_id == teacher_id,
+    return _slot_overlaps(TimeTableSlot.teacher_id == teacher_id, day_of_week, start_time, end_time,
+                          exclude_slot_id, exclude_class_id, exclude_stream_id)
+
+
+def classroom_has_overlap(classroom, day_of_week, start_time, end_time,
+                          exclude_slot_id=None, exclude_class_id=None, exclude_stream_id=None):
+    """Room counterpart of teacher_has_overlap(), probing the no_classroom_overlap
+    GiST index on (trim(classroom), day_of_week, time_range). A blank classroom
+    never overlaps."""
+    room = room_key(classroom)
+    if room is None:
+        return False
+    return _slot_overlaps(func.trim(TimeTableSlot.classroom) == room, day_of_week, start_time, end_time,
+                          exclude_slot_id, exclude_class_id, exclude_stream_id)
+
+
+def _slot_overlaps(resource_filter, day_of_week, start_time, end_time,
+                   exclude_slot_id=None, exclude_class_id=None, exclude_stream_id=None):
+    start_minute = time_to_minutes(start_time)
+    end_minute = time_to_minutes(end_time)
+
+    query = db.session.query(TimeTableSlot.id).filter(
+        resource_filter,
         TimeTableSlot.day_of_week == day_of_week,
     )
 
@@ -46,13 +80,19 @@ def teacher_has_overlap(teacher_id, day_of_week, start_time, end_time,
         # regenerate them and they shouldn't block availability checks)
         query = query.filter(~((TimeTableSlot.class_id == exclude_class_id) & (TimeTableSlot.stream_id == exclude_stream_id)))
 
-    # Overlap condition: existing.start_time < end_time AND existing.end_time > start_time
-    conflict = query.filter(
-        TimeTableSlot.start_time < end_time,
-        TimeTableSlot.end_time > start_time
-    ).first()
+    if db.engine.dialect.name == 'postgresql':
+        # Range overlap operator matches the exclusion constraints' indexes
+        query = query.filter(
+            literal_column('timetable_slots.time_range').op('&&')(func.int4range(start_minute, end_minute))
+        )
+    else:
+        # Overlap condition: existing.start < end AND existing.end > start
+        query = query.filter(
+            TimeTableSlot.start_minute < end_minute,
+            TimeTableSlot.end_minute > start_minute
+        )
 
-    return conflict is not None
+    return query.first() is not None
 
 admin_routes = Blueprint("admin_routes", __name__)
 
@@ -61,6 +101,10 @@ logger = logging.getLogger(__name__)
 # In-memory store for backup job progress. Keyed by job_id.
 BACKUP_PROGRESS = {}
 
+# Same idea for whole-school timetable generation jobs
+TIMETABLE_JOBS = {}
+TIMETABLE_JOBS_LOCK = threading.Lock()
+
 def get_redis_client():
     """Return a redis client or None if redis is not configured/installed."""
     if redis is None:
@@ -363,8 +407,16 @@ def list_teacher_names():
 
 @admin_routes.route("/admin/timetable/get/<int:class_id>/<int:stream_id>")
 def get_timetable(class_id, stream_id):
-    """Retrieve timetable slots for a specific class and stream"""
-    slots = TimeTableSlot.query.filter_by(class_id=class_id, stream_id=stream_id)\
+    """Retrieve timetable slots for a specific class and stream.
+    Answers 304 from the timetable_versions counter when the client's ETag is current."""
+    etag = timetable_etag(class_id, stream_id)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    slots = TimeTableSlot.query.options(
+        joinedload(TimeTableSlot.teacher),
+        joinedload(TimeTableSlot.subject)
+    ).filter_by(class_id=class_id, stream_id=stream_id)\
         .order_by(TimeTableSlot.day_of_week, TimeTableSlot.start_time).all()
 
     slot_data = []
@@ -382,7 +434,18 @@ def get_timetable(class_id, stream_id):
             'end_time': slot.end_time,
         })
 
-    return jsonify({'slots': slot_data})
+    response = jsonify({'slots': slot_data})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified(etag):
+    """Empty 304 response carrying the current ETag."""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @admin_routes.route("/admin/timetable/assigned-teachers/<int:class_id>/<int:stream_id>")
@@ -421,73 +484,439 @@ def generate_timetable(class_id, stream_id):
 
 @admin_routes.route("/admin/timetable/generate-all", methods=["POST"])
 def generate_all_timetables():
-    """Generate timetables for all classes and streams. Returns a summary per stream."""
-    classes = Class.query.all()
-    streams = Stream.query.all()
-    results = []
+    """Generate timetables for all classes and streams in one pass with the
+    whole-school solver, as a background job.
+
+    Returns 202 with a job id; poll /admin/timetable/jobs/<job_id> or stream
+    /admin/timetable/jobs/<job_id>/events for progress and the final summary
+    per stream (or the list of constraints that cannot be satisfied). Only
+    one generation job runs at a time.
+
+    Optional JSON body: {"max_lessons_per_teacher": int}
+    """
+    data = request.get_json(silent=True) or {}
+    max_lessons = data.get('max_lessons_per_teacher')
+    try:
+        max_lessons = int(max_lessons) if max_lessons not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_lessons_per_teacher must be an integer'}), 400
+
+    with TIMETABLE_JOBS_LOCK:
+        for jid, job in TIMETABLE_JOBS.items():
+            if job['status'] in ('queued', 'running'):
+                return jsonify({'error': 'A timetable generation job is already running', 'job_id': jid}), 409
+        job_id = str(uuid.uuid4())
+        TIMETABLE_JOBS[job_id] = {
+            'job_id': job_id,
+            'percent': 0,
+            'status': 'queued',
+            'message': 'Queued',
+            'result': None,
+            'started_at': None,
+            'finished_at': None,
+        }
+    _publish_timetable_job(job_id)
+    logger.info(f"[TIMETABLE-JOB] Enqueued generation job {job_id} by user {session.get('user_id')}")
+
+    app = current_app._get_current_object()
+    t = threading.Thread(target=_run_timetable_job, args=(app, job_id, max_lessons), daemon=True)
+    t.start()
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('admin_routes.timetable_job_status', job_id=job_id),
+        'events_url': url_for('admin_routes.timetable_job_events', job_id=job_id),
+    }), 202
+
+
+def _publish_timetable_job(job_id):
+    """Mirror a job's state to Redis (when REDIS_URL is set) so any worker can report it."""
+    r = get_cache_redis()
+    if not r:
+        return
+    try:
+        r.set(f'timetable:job:{job_id}', json.dumps(TIMETABLE_JOBS[job_id], default=str), ex=3600)
+    except Exception:
+        logger.debug('[TIMETABLE-JOB] Redis publish failed')
+
+
+def _update_timetable_job(job_id, **fields):
+    with TIMETABLE_JOBS_LOCK:
+        TIMETABLE_JOBS[job_id].update(fields)
+    _publish_timetable_job(job_id)
+
+
+def _run_timetable_job(app, job_id, max_lessons):
+    """Thread body: solve and persist the whole school inside its own app context."""
+    with app.app_context():
+        _update_timetable_job(job_id, status='running', message='Starting',
+                              started_at=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            success, payload = _solve_whole_school(
+                max_lessons_per_teacher=max_lessons,
+                progress_callback=lambda percent, message: _update_timetable_job(job_id, percent=percent, message=message)
+            )
+        except Exception as e:
+            logger.exception(f'[TIMETABLE-JOB] Job {job_id} crashed')
+            db.session.rollback()
+            success, payload = False, {'error': str(e), 'conflicts': []}
+        finally:
+            db.session.remove()
+
+        finished_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        if success:
+            _update_timetable_job(job_id, status='finished', percent=100, message='Timetables generated',
+                                  result=payload, finished_at=finished_at)
+        else:
+            _update_timetable_job(job_id, status='error', message=payload.get('error', 'Generation failed'),
+                                  result=payload, finished_at=finished_at)
+        logger.info(f'[TIMETABLE-JOB] Job {job_id} {"finished" if success else "failed"}')
+
+
+def _get_timetable_job(job_id):
+    """Job state from this process, or from Redis if another worker ran it."""
+    job = TIMETABLE_JOBS.get(job_id)
+    if job is not None:
+        return dict(job)
+    r = get_cache_redis()
+    if r:
+        try:
+            raw = r.get(f'timetable:job:{job_id}')
+            return json.loads(raw) if raw else None
+        except Exception:
+            logger.debug('[TIMETABLE-JOB] Redis read failed')
+    return None
+
+
+@admin_routes.route("/admin/timetable/jobs/<job_id>")
+def timetable_job_status(job_id):
+    """Current state of a timetable generation job."""
+    job = _get_timetable_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
+
+@admin_routes.route("/admin/timetable/jobs/<job_id>/events")
+def timetable_job_events(job_id):
+    """SSE stream of a timetable generation job's state until it finishes."""
+    def gen():
+        last_snapshot = None
+        timeout = time.time() + 600
+        while time.time() < timeout:
+            job = _get_timetable_job(job_id)
+            if job is None:
+                yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            snapshot = json.dumps(job, sort_keys=True, default=str)
+            if snapshot != last_snapshot:
+                yield f'data: {snapshot}\n\n'
+                last_snapshot = snapshot
+            if job['status'] in ('finished', 'error'):
+                return
+            time.sleep(0.25)
+
+    response = current_app.response_class(gen(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _solve_whole_school(max_lessons_per_teacher=None, progress_callback=None):
+    """Solve and persist the timetable for every class/stream that has a class teacher.
+
+    Returns (True, {'results': [...], 'stats': {...}}) or
+    (False, {'error': ..., 'conflicts': [...]}). Those streams are replaced in
+    a single transaction, so a failure leaves every existing timetable intact.
+    Slots of streams without a class teacher are kept, and the solver keeps
+    their teachers and rooms free at those times.
 
+    `progress_callback(percent, message)` is called as each stream is written.
+    """
+    def progress(percent, message):
+        if progress_callback:
+            progress_callback(percent, message)
+
+    progress(5, 'Loading teachers, subjects and assignments')
+    classes = Class.query.order_by(Class.name.asc()).all()
+    streams = Stream.query.order_by(Stream.name.asc()).all()
+    # Streams in the run are rebuilt from scratch; the slots of every other
+    # stream stay and are handed to the solver as bookings below
+    context = _load_generation_context(with_occupancy=False)
+
+    if not context['teacher_role_exists']:
+        return False, {'error': 'Teacher role not found in database', 'conflicts': []}
+
+    qualifications = defaultdict(set)
+    for teacher_id, subject_id in db.session.query(TeacherSubject.teacher_id, TeacherSubject.subject_id).all():
+        qualifications[subject_id].add(teacher_id)
+
+    owners = []
+    class_teachers = {}
+    results = []
     for class_obj in classes:
         for stream in streams:
-            success, payload = _generate_timetable_core(class_obj.id, stream.id)
+            owner = (class_obj.id, stream.id)
+            assignment = context['class_teachers'].get(owner)
+            if assignment:
+                owners.append(owner)
+                class_teachers[owner] = assignment.teacher_id
             results.append({
                 'class_id': class_obj.id,
                 'class_name': class_obj.name,
                 'stream_id': stream.id,
                 'stream_name': stream.name,
-                'success': success,
-                'payload': payload
+                'success': assignment is not None,
+                'payload': None if assignment else 'No class teacher assigned to this class/stream'
             })
 
-    return jsonify({'results': results}), 200
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+    periods = []
+    for day in days:
+        for time_obj in context['times']:
+            end_dt = datetime.strptime(time_obj['start'], '%H:%M') + timedelta(minutes=time_obj['duration'])
+            periods.append((day, time_obj['start'], end_dt.strftime('%H:%M')))
+
+    booked = []
+    if owners and len(owners) < len(results):
+        # Some streams have no class teacher and keep their slots
+        booked = db.session.query(
+            TimeTableSlot.teacher_id, TimeTableSlot.classroom, TimeTableSlot.day_of_week,
+            TimeTableSlot.start_time, TimeTableSlot.end_time,
+        ).filter(~tuple_(TimeTableSlot.class_id, TimeTableSlot.stream_id).in_(owners)).all()
+
+    progress(15, f'Solving {len(owners)} class/streams')
+    ok, solution = solve_timetable(
+        owners,
+        [t.id for t in context['teachers']],
+        [s.id for s in context['subjects']],
+        periods,
+        class_teachers=class_teachers,
+        qualifications=qualifications,
+        max_lessons_per_teacher=max_lessons_per_teacher,
+        home_rooms=context['home_rooms'],
+        booked=booked,
+    )
+    if not ok:
+        return False, {'error': 'Timetable constraints cannot be satisfied', 'conflicts': solution['conflicts']}
+
+    try:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        in_owners = tuple_(TimeTableSlot.class_id, TimeTableSlot.stream_id).in_(owners)
+        replaced_teacher_ids = [r[0] for r in db.session.query(TimeTableSlot.teacher_id).filter(in_owners).distinct().all()]
+        TimeTableSlot.query.filter(in_owners).delete(synchronize_session=False)
+        slots_by_owner = defaultdict(list)
+        for slot in solution['slots']:
+            slots_by_owner[(slot['class_id'], slot['stream_id'])].append(slot)
+        # Nothing is visible to readers until the single commit below
+        for i, owner in enumerate(owners, start=1):
+            db.session.bulk_insert_mappings(TimeTableSlot, slots_by_owner[owner])
+            progress(20 + int(75 * i / len(owners)), f'Wrote class/stream {i} of {len(owners)}')
+        bump_timetable_versions(owners)
+        refresh_room_utilization()
+        db.session.commit()
+    except Exception as e:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        return False, {'error': f'Database error while saving slots: {str(e)}', 'conflicts': []}
+
+    invalidate_teacher_timetables(replaced_teacher_ids + [slot['teacher_id'] for slot in solution['slots']])
+
+    per_owner = defaultdict(int)
+    for slot in solution['slots']:
+        per_owner[(slot['class_id'], slot['stream_id'])] += 1
+    for result in results:
+        if result['success']:
+            created = per_owner[(result['class_id'], result['stream_id'])]
+            result['payload'] = {
+                'message': f'✓ Timetable generated! {created} lessons scheduled',
+                'slots_created': created,
+            }
+
+    return True, {'results': results, 'stats': solution['stats']}
+
+
+@admin_routes.route("/admin/timetable/qualifications/<int:teacher_id>", methods=["GET", "PUT"])
+def teacher_qualifications(teacher_id):
+    """Get or replace the subjects a teacher is qualified to teach.
+    PUT body: {"subject_ids": [1, 2, ...]}"""
+    User.query.get_or_404(teacher_id)
+
+    if request.method == "PUT":
+        data = request.get_json(silent=True) or {}
+        try:
+            subject_ids = sorted({int(s) for s in data.get('subject_ids', [])})
+        except (TypeError, ValueError):
+            return jsonify({'error': 'subject_ids must be a list of integers'}), 400
+        try:
+            TeacherSubject.query.filter_by(teacher_id=teacher_id).delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(TeacherSubject, [
+                {'teacher_id': teacher_id, 'subject_id': subject_id} for subject_id in subject_ids
+            ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+
+    rows = db.session.query(Subject.id, Subject.name).join(
+        TeacherSubject, TeacherSubject.subject_id == Subject.id
+    ).filter(TeacherSubject.teacher_id == teacher_id).order_by(Subject.name.asc()).all()
+    return jsonify({
+        'teacher_id': teacher_id,
+        'subjects': [{'id': r[0], 'name': r[1]} for r in rows]
+    }), 200
 
 
 @admin_routes.route("/admin/timetable/counts")
 def timetable_counts():
     """Return counts of timetable slots grouped by class and stream."""
-    rows = db.session.query(TimeTableSlot.class_id, TimeTableSlot.stream_id, func.count().label('slots'))\
-        .group_by(TimeTableSlot.class_id, TimeTableSlot.stream_id)\
+    etag = timetables_etag()
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    # Names are joined into the grouped query rather than looked up per row
+    rows = db.session.query(
+        TimeTableSlot.class_id, Class.name, TimeTableSlot.stream_id, Stream.name, func.count().label('slots')
+    ).outerjoin(Class, Class.id == TimeTableSlot.class_id)\
+        .outerjoin(Stream, Stream.id == TimeTableSlot.stream_id)\
+        .group_by(TimeTableSlot.class_id, Class.name, TimeTableSlot.stream_id, Stream.name)\
         .order_by(TimeTableSlot.class_id, TimeTableSlot.stream_id).all()
 
     data = []
     for r in rows:
-        # resolve names
-        cls = Class.query.get(r[0])
-        strm = Stream.query.get(r[1])
         data.append({
             'class_id': r[0],
-            'class_name': cls.name if cls else None,
-            'stream_id': r[1],
-            'stream_name': strm.name if strm else None,
-            'slots': int(r[2])
+            'class_name': r[1],
+            'stream_id': r[2],
+            'stream_name': r[3],
+            'slots': int(r[4])
         })
 
-    return jsonify({'counts': data}), 200
+    response = jsonify({'counts': data})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response, 200
+
+
+def _lesson_times():
+    """Return the day's 40-minute lesson slots from 8:00 AM to 5:00 PM as
+    [{'start': 'HH:MM', 'duration': minutes}], skipping the 20-minute break at
+    10:00 AM and the 40-minute lunch at 1:00 PM."""
+    times = []
+    current_time = datetime.strptime('08:00', '%H:%M')
+    end_time = datetime.strptime('17:00', '%H:%M')  # 5:00 PM
+
+    while current_time < end_time:
+        time_str = current_time.strftime('%H:%M')
+
+        # Skip 20-minute break at 10:00 AM
+        if time_str == '10:00':
+            current_time += timedelta(minutes=20)  # Skip break duration
+        # Skip 40-minute lunch at 1:00 PM (13:00)
+        elif time_str == '13:00':
+            current_time += timedelta(minutes=40)  # Skip lunch duration
+        else:
+            # Calculate remaining time until 5:00 PM
+            remaining_minutes = (end_time - current_time).total_seconds() / 60
+
+            # If remaining time <= 40 min, use all remaining time; otherwise use 40 min
+            lesson_duration = int(remaining_minutes) if remaining_minutes <= 40 else 40
+
+            if lesson_duration > 0:
+                times.append({
+                    'start': time_str,
+                    'duration': lesson_duration
+                })
+                current_time += timedelta(minutes=lesson_duration)
+            else:
+                break
+
+    return times
+
 
+def _load_generation_context(with_occupancy=True):
+    """Load everything the generator reads, once.
 
-def _generate_timetable_core(class_id, stream_id):
+    Returns a dict with the teacher pool, subjects, the first class-teacher
+    assignment per (class_id, stream_id), each stream's home room (the
+    classroom most of its current slots use), the lesson times and (unless
+    `with_occupancy` is False) teacher and classroom OccupancyIndexes of all
+    existing slots.
+    Sharing one context across a whole-school run keeps generation to a
+    handful of queries in total.
+    """
+    all_teachers = User.query.join(Role).filter(
+        Role.role_name.ilike('teacher')
+    ).order_by(User.first_name.asc(), User.last_name.asc()).all()
+
+    class_teachers = {}
+    assignments = TeacherAssignment.query.options(
+        joinedload(TeacherAssignment.teacher)
+    ).order_by(TeacherAssignment.id.asc()).all()
+    for assignment in assignments:
+        class_teachers.setdefault((assignment.class_id, assignment.stream_id), assignment)
+
+    room_counts = db.session.query(
+        TimeTableSlot.class_id, TimeTableSlot.stream_id, func.trim(TimeTableSlot.classroom), func.count()
+    ).filter(
+        TimeTableSlot.classroom.isnot(None), func.trim(TimeTableSlot.classroom) != ''
+    ).group_by(TimeTableSlot.class_id, TimeTableSlot.stream_id, func.trim(TimeTableSlot.classroom)).all()
+    home_rooms = {}
+    best = {}
+    for class_id, stream_id, room, count in room_counts:
+        owner = (class_id, stream_id)
+        if count > best.get(owner, 0):
+            best[owner] = count
+            home_rooms[owner] = room
+
+    return {
+        'teacher_role_exists': Role.query.filter(Role.role_name.ilike('teacher')).first() is not None,
+        'teachers': all_teachers,
+        'class_teachers': class_teachers,
+        'subjects': Subject.query.all(),
+        'times': _lesson_times(),
+        'home_rooms': home_rooms,
+        'occupancy': OccupancyIndex.load() if with_occupancy else None,
+        'room_occupancy': OccupancyIndex.load('classroom') if with_occupancy else None,
+    }
+
+
+def _generate_timetable_core(class_id, stream_id, context=None):
     """Core routine to generate timetable for a single class_id and stream_id.
     Returns (True, dict) on success or (False, error_message) on failure.
+
+    `context` is the dict returned by `_load_generation_context()`; pass the
+    same one for every stream of a whole-school run. Teacher availability is
+    answered from its in-memory OccupancyIndex, which is updated after each
+    successful save so later streams see the new bookings.
     """
+    if context is None:
+        context = _load_generation_context()
+
+    owner = (class_id, stream_id)
+    occupancy = context['occupancy']
+    room_occupancy = context['room_occupancy']
+    classroom = context['home_rooms'].get(owner)
+
     # Get the assigned class teacher (must be included)
-    class_teacher_assignment = TeacherAssignment.query.filter_by(
-        class_id=class_id,
-        stream_id=stream_id
-    ).first()
+    class_teacher_assignment = context['class_teachers'].get(owner)
 
     if not class_teacher_assignment:
         return False, 'No class teacher assigned to this class/stream'
 
     # Get ALL teachers with role "Teacher" (case-insensitive), excluding auto-created placeholders
-    teacher_role = Role.query.filter(Role.role_name.ilike('teacher')).first()
-    if not teacher_role:
+    if not context['teacher_role_exists']:
         return False, 'Teacher role not found in database'
 
     # Get ALL teachers (use the entire teachers table; do not limit to those
     # assigned to this class/stream). This ensures the generator can distribute
     # work across the whole teacher pool.
-    all_teachers = User.query.join(Role).filter(
-        Role.role_name.ilike('teacher')
-    ).order_by(User.first_name.asc(), User.last_name.asc()).all()
+    all_teachers = list(context['teachers'])
     if not all_teachers:
         return False, 'No real teachers found (only auto-created placeholders exist)'
 
@@ -502,41 +931,14 @@ def _generate_timetable_core(class_id, stream_id):
     # fails part-way through.
 
     # Get all subjects
-    subjects = Subject.query.all()
+    subjects = context['subjects']
     if not subjects:
         return False, 'No subjects available in the database'
 
     days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
-    # Generate 40-minute time slots from 8:00 AM to 5:00 PM with breaks
-    times = []
-    current_time = datetime.strptime('08:00', '%H:%M')
-    end_time = datetime.strptime('17:00', '%H:%M')  # 5:00 PM
-
-    while current_time < end_time:
-        time_str = current_time.strftime('%H:%M')
-
-        # Skip 20-minute break at 10:00 AM
-        if time_str == '10:00':
-            current_time += timedelta(minutes=20)  # Skip break duration
-        # Skip 40-minute lunch at 1:00 PM (13:00)
-        elif time_str == '13:00':
-            current_time += timedelta(minutes=40)  # Skip lunch duration
-        else:
-            # Calculate remaining time until 5:00 PM
-            remaining_minutes = (end_time - current_time).total_seconds() / 60
-
-            # If remaining time <= 40 min, use all remaining time; otherwise use 40 min
-            lesson_duration = int(remaining_minutes) if remaining_minutes <= 40 else 40
-
-            if lesson_duration > 0:
-                times.append({
-                    'start': time_str,
-                    'duration': lesson_duration
-                })
-                current_time += timedelta(minutes=lesson_duration)
-            else:
-                break
+    # 40-minute time slots from 8:00 AM to 5:00 PM with breaks
+    times = context['times']
 
     slots_created = 0
     subject_idx = 0
@@ -551,6 +953,11 @@ def _generate_timetable_core(class_id, stream_id):
             time_str = time_obj['start']
             duration = time_obj['duration']
 
+            # Calculate end time
+            start_dt = datetime.strptime(time_str, '%H:%M')
+            end_dt = start_dt + timedelta(minutes=duration)
+            end_time_str = end_dt.strftime('%H:%M')
+
             # Get next teacher (round-robin distribution from ALL available teachers)
             # Attempt to find a teacher who is NOT already booked at this time (across any stream).
             teacher = None
@@ -563,8 +970,7 @@ def _generate_timetable_core(class_id, stream_id):
                 # When checking availability for generation we should ignore any
                 # existing slots that belong to the same class+stream since those
                 # are the ones we're about to replace.
-                if not teacher_has_overlap(candidate.id, day, time_str, (datetime.strptime(time_str, '%H:%M') + timedelta(minutes=duration)).strftime('%H:%M'),
-                                            exclude_class_id=class_id, exclude_stream_id=stream_id):
+                if occupancy.is_free(candidate.id, day, time_str, end_time_str, exclude_owner=owner):
                     teacher = candidate
                     # set teacher_idx so next iteration continues after this one
                     teacher_idx = idx + 1
@@ -577,14 +983,13 @@ def _generate_timetable_core(class_id, stream_id):
                 # No available teacher found for this slot/time - fail with a clear message
                 return False, f'No available teacher found for {day} at {time_str} (all teachers are already booked)'
 
+            # The stream keeps its home room; another stream may have been given the same room
+            if classroom and not room_occupancy.is_free(classroom, day, time_str, end_time_str, exclude_owner=owner):
+                return False, f'Classroom {classroom} is already booked by another stream on {day} at {time_str}'
+
             # Get subject (cycle through available subjects)
             subject = subjects[subject_idx % len(subjects)]
 
-            # Calculate end time
-            start_dt = datetime.strptime(time_str, '%H:%M')
-            end_dt = start_dt + timedelta(minutes=duration)
-            end_time_str = end_dt.strftime('%H:%M')
-
             # Create slot (collect)
             new_slot = TimeTableSlot(
                 teacher_id=teacher.id,
@@ -593,7 +998,8 @@ def _generate_timetable_core(class_id, stream_id):
                 subject_id=subject.id,
                 day_of_week=day,
                 start_time=time_str,
-                end_time=end_time_str
+                end_time=end_time_str,
+                classroom=classroom
             )
             slots_to_save.append(new_slot)
             slots_created += 1
@@ -614,6 +1020,12 @@ def _generate_timetable_core(class_id, stream_id):
                 # ignore rollback errors; we'll proceed to do the replace
                 pass
 
+            # Teachers losing slots here need their cached weeks dropped too
+            replaced_teacher_ids = [r[0] for r in db.session.query(TimeTableSlot.teacher_id).filter_by(
+                class_id=class_id,
+                stream_id=stream_id
+            ).distinct().all()]
+
             # Remove existing slots and insert new ones, then commit.
             # Use explicit commit/rollback to avoid nested-transaction errors
             TimeTableSlot.query.filter_by(
@@ -621,6 +1033,8 @@ def _generate_timetable_core(class_id, stream_id):
                 stream_id=stream_id
             ).delete(synchronize_session=False)
             db.session.bulk_save_objects(slots_to_save)
+            bump_timetable_versions([owner])
+            refresh_room_utilization([classroom] + list(room_occupancy.resources_of(owner)))
             db.session.commit()
         else:
             # Nothing to save (shouldn't happen) -- treat as failure
@@ -633,6 +1047,11 @@ def _generate_timetable_core(class_id, stream_id):
             pass
         return False, f'Database error while saving slots: {str(e)}'
 
+    # Saved: later streams in the same run must see these bookings
+    occupancy.replace_owner(owner, slots_to_save)
+    room_occupancy.replace_owner(owner, slots_to_save, resource='classroom')
+    invalidate_teacher_timetables(replaced_teacher_ids + [s.teacher_id for s in slots_to_save])
+
     return True, {
         'message': f'✓ Timetable generated! {slots_created} lessons scheduled for {len(all_teachers)} teachers!',
         'slots_created': slots_created,
@@ -643,26 +1062,259 @@ def _generate_timetable_core(class_id, stream_id):
 
 @admin_routes.route("/admin/timetable/edit/<int:slot_id>", methods=["PUT"])
 def edit_timetable_slot(slot_id):
-    """Edit an existing timetable slot - ONLY teacher_id and subject_id can be changed"""
+    """Edit an existing timetable slot - ONLY teacher_id, subject_id and (optionally) classroom can be changed"""
     slot = TimeTableSlot.query.get_or_404(slot_id)
     data = request.json
 
     teacher_id = data.get('teacher_id')
     subject_id = data.get('subject_id')
+    classroom = data.get('classroom', slot.classroom)
 
     # ✅ Check teacher double-booking across ANY stream for overlapping times (excluding current slot)
     if teacher_has_overlap(teacher_id, slot.day_of_week, slot.start_time, slot.end_time, exclude_slot_id=slot_id):
         return jsonify({'error': f'Teacher is already assigned to another stream at {slot.start_time} on {slot.day_of_week}'}), 409
 
+    # ✅ Same check for the room
+    if classroom_has_overlap(classroom, slot.day_of_week, slot.start_time, slot.end_time, exclude_slot_id=slot_id):
+        return jsonify({'error': f'Classroom {classroom} is already in use at {slot.start_time} on {slot.day_of_week}'}), 409
+
     try:
+        previous_teacher_id = slot.teacher_id
+        previous_classroom = slot.classroom
         slot.teacher_id = teacher_id
         slot.subject_id = subject_id
+        slot.classroom = room_key(classroom)
+        bump_timetable_versions([(slot.class_id, slot.stream_id)])
+        db.session.flush()
+        refresh_room_utilization([previous_classroom, slot.classroom])
         db.session.commit()
+        invalidate_teacher_timetables([previous_teacher_id, slot.teacher_id])
         return jsonify({'message': 'Timetable slot updated successfully!'}), 200
+    except IntegrityError as e:
+        # A constraint rejected the write, e.g. a booking made concurrently by another edit
+        db.session.rollback()
+        message, status = _slot_integrity_error(e, slot)
+        return jsonify({'error': message}), status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+def _slot_integrity_error(error, slot):
+    """(message, status) for an IntegrityError raised while saving a timetable slot."""
+    diag = getattr(error.orig, 'diag', None)
+    constraint = getattr(diag, 'constraint_name', None)
+    when = f'at {slot.start_time} on {slot.day_of_week}'
+    if constraint in ('no_teacher_overlap', 'unique_teacher_class_slot'):
+        return f'Teacher is already booked {when}', 409
+    if constraint == 'no_classroom_overlap':
+        return f'Classroom is already in use {when}', 409
+    if constraint == 'unique_class_slot':
+        return f'This class/stream already has a lesson {when}', 409
+    if getattr(error.orig, 'pgcode', None) == '23503':
+        return 'Unknown teacher or subject', 400
+    return f'Database rejected the change: {error.orig}', 409
+
+
+@admin_routes.route("/admin/timetable/rooms")
+def room_utilization():
+    """Room x day x period grid from the precomputed room_utilization table.
+    Query params: day, start_time, free=1 (only free rooms)."""
+    cells = room_grid(
+        day_of_week=request.args.get('day'),
+        start_time=request.args.get('start_time'),
+        free_only=request.args.get('free') in ('1', 'true', 'yes'),
+    )
+    return jsonify({'rooms': sorted({c['classroom'] for c in cells}), 'cells': cells}), 200
+
+
+def _export_dates():
+    """Parse optional ?start=YYYY-MM-DD&until=YYYY-MM-DD for calendar exports."""
+    bounds = []
+    for name in ('start', 'until'):
+        value = request.args.get(name)
+        bounds.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+    return bounds
+
+
+@admin_routes.route("/admin/timetable/export.xlsx")
+def export_timetables_excel():
+    """Download every stream's and every teacher's timetable as one workbook."""
+    try:
+        path = export_timetables_xlsx()
+    except Exception as e:
+        logger.exception("[TIMETABLE-EXPORT] XLSX export failed")
+        return jsonify({'error': str(e)}), 500
+    filename = f"timetables_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return current_app.response_class(
+        stream_file(path),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment;filename={filename}",
+                 "Content-Length": str(os.path.getsize(path))}
+    )
+
+
+@admin_routes.route("/admin/timetable/export/ics")
+def export_teacher_calendars():
+    """Download a zip with one weekly-recurring .ics calendar per teacher."""
+    try:
+        start, until = _export_dates()
+    except ValueError:
+        return jsonify({'error': 'start/until must be YYYY-MM-DD'}), 400
+    try:
+        path = export_teacher_ics_zip(start, until)
+    except Exception as e:
+        logger.exception("[TIMETABLE-EXPORT] Calendar export failed")
+        return jsonify({'error': str(e)}), 500
+    return current_app.response_class(
+        stream_file(path),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment;filename=teacher_timetables_ics.zip",
+                 "Content-Length": str(os.path.getsize(path))}
+    )
+
+
+@admin_routes.route("/admin/timetable/export/ics/<int:teacher_id>")
+def export_teacher_calendar(teacher_id):
+    """Download one teacher's timetable as a weekly-recurring .ics calendar."""
+    teacher = User.query.get_or_404(teacher_id)
+    try:
+        start, until = _export_dates()
+    except ValueError:
+        return jsonify({'error': 'start/until must be YYYY-MM-DD'}), 400
+    name = f"{teacher.first_name} {teacher.last_name}"
+    return current_app.response_class(
+        stream_with_context(teacher_ics(teacher_id, name, start, until)),
+        mimetype="text/calendar",
+        headers={"Content-Disposition": f"attachment;filename=timetable_{teacher_id}.ics"}
+    )
+
+
+@admin_routes.route("/admin/timetable/bulk-edit", methods=["POST"])
+def bulk_edit_timetable():
+    """Apply many slot moves and swaps at once, for one stream or the whole school.
+
+    JSON body:
+      {
+        "class_id": 1, "stream_id": 2,          # optional, each; limits edits to a class and/or stream
+        "moves": [{"slot_id": 10, "day_of_week": "Tuesday", "start_time": "08:00",
+                   "end_time": "08:40", "teacher_id": 5, "subject_id": 3, "classroom": "Room 4"}],
+        "swaps": [{"slot_a": 10, "slot_b": 11}],  # exchange day and times of two slots
+        "dry_run": false
+      }
+    Every field of a move except slot_id is optional. Moves are applied
+    first, then swaps, to an in-memory snapshot of the whole timetable; the
+    final state is checked for teacher, stream and classroom double-booking
+    and only then written in one transaction.
+    """
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves') or []
+    swaps = data.get('swaps') or []
+    try:
+        scope_class_id = int(data['class_id']) if data.get('class_id') not in (None, '') else None
+        scope_stream_id = int(data['stream_id']) if data.get('stream_id') not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'class_id and stream_id must be integers'}), 400
+    if not moves and not swaps:
+        return jsonify({'error': 'No moves or swaps supplied'}), 400
+
+    # Snapshot of every slot in the school (teacher and room conflicts cross streams)
+    columns = ('id', 'teacher_id', 'class_id', 'stream_id', 'subject_id',
+               'day_of_week', 'start_time', 'end_time', 'classroom')
+    rows = db.session.query(*[getattr(TimeTableSlot, c) for c in columns]).all()
+    state = {r[0]: dict(zip(columns, r)) for r in rows}
+    original = {slot_id: dict(slot) for slot_id, slot in state.items()}
+
+    def load(slot_id):
+        slot = state.get(slot_id)
+        if slot is None:
+            raise ValueError(f'Slot {slot_id} not found')
+        if scope_class_id is not None and slot['class_id'] != scope_class_id:
+            raise ValueError(f'Slot {slot_id} is not in class {scope_class_id}')
+        if scope_stream_id is not None and slot['stream_id'] != scope_stream_id:
+            raise ValueError(f'Slot {slot_id} is not in stream {scope_stream_id}')
+        return slot
+
+    days = TimeTableSlot.get_days()
+    try:
+        for move in moves:
+            slot = load(move.get('slot_id'))
+            for field in ('day_of_week', 'start_time', 'end_time', 'teacher_id', 'subject_id', 'classroom'):
+                if field in move:
+                    slot[field] = move[field]
+            slot['classroom'] = room_key(slot['classroom'])
+            if slot['day_of_week'] not in days:
+                raise ValueError(f"Invalid day_of_week for slot {slot['id']}: {slot['day_of_week']}")
+            try:
+                for field in ('teacher_id', 'subject_id'):
+                    slot[field] = int(slot[field])
+            except (TypeError, ValueError):
+                raise ValueError(f"teacher_id and subject_id must be integers for slot {slot['id']}")
+            try:
+                # Store zero-padded HH:MM: the minute columns are computed from fixed positions
+                for field in ('start_time', 'end_time'):
+                    slot[field] = minutes_to_time(time_to_minutes(slot[field]))
+                    datetime.strptime(slot[field], '%H:%M')
+                if slot['start_time'] >= slot['end_time']:
+                    raise ValueError
+            except (TypeError, ValueError, AttributeError):
+                raise ValueError(f"Invalid start_time/end_time for slot {slot['id']}")
+        for swap in swaps:
+            a = load(swap.get('slot_a'))
+            b = load(swap.get('slot_b'))
+            for field in ('day_of_week', 'start_time', 'end_time'):
+                a[field], b[field] = b[field], a[field]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    changed = {slot_id for slot_id, slot in state.items() if slot != original[slot_id]}
+    if not changed:
+        return jsonify({'message': 'Nothing to change', 'updated': 0}), 200
+
+    teacher_ids = {state[i]['teacher_id'] for i in changed}
+    subject_ids = {state[i]['subject_id'] for i in changed}
+    known_teachers = {r[0] for r in db.session.query(User.id).filter(User.id.in_(teacher_ids)).all()}
+    known_subjects = {r[0] for r in db.session.query(Subject.id).filter(Subject.id.in_(subject_ids)).all()}
+    if teacher_ids - known_teachers or subject_ids - known_subjects:
+        return jsonify({
+            'error': 'Unknown teacher or subject',
+            'teacher_ids': sorted(teacher_ids - known_teachers),
+            'subject_ids': sorted(subject_ids - known_subjects)
+        }), 400
+
+    conflicts = find_conflicts(state.values(), changed_ids=changed)
+    if conflicts:
+        return jsonify({'error': 'The edited timetable has conflicts', 'conflicts': conflicts}), 409
+    if data.get('dry_run'):
+        return jsonify({'message': 'Valid', 'updated': len(changed)}), 200
+
+    fields = ('teacher_id', 'subject_id', 'day_of_week', 'start_time', 'end_time', 'classroom')
+    try:
+        # Unique and exclusion constraints are checked row by row, so a swap
+        # written directly would collide with itself halfway through. Park the
+        # changed rows on a placeholder day first, then write final values.
+        db.session.bulk_update_mappings(TimeTableSlot, [
+            {'id': slot_id, 'day_of_week': f'~{slot_id}'} for slot_id in changed
+        ])
+        db.session.bulk_update_mappings(TimeTableSlot, [
+            dict({'id': slot_id, 'updated_at': datetime.utcnow()}, **{f: state[slot_id][f] for f in fields})
+            for slot_id in changed
+        ])
+        bump_timetable_versions({(state[i]['class_id'], state[i]['stream_id']) for i in changed})
+        refresh_room_utilization([original[i]['classroom'] for i in changed] + [state[i]['classroom'] for i in changed])
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({'error': f'Database rejected the edit: {str(e.orig)}'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+    invalidate_teacher_timetables(
+        [original[i]['teacher_id'] for i in changed] + [state[i]['teacher_id'] for i in changed]
+    )
+    return jsonify({'message': f'{len(changed)} timetable slot(s) updated', 'updated': len(changed)}), 200
+
 
 @admin_routes.route("/admin/backup-maintenance", methods=["GET", "POST"])
 def backup_maintenance():
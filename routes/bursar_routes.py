@@ -1,17 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-import json
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app
 import os
-from pathlib import Path
 from datetime import datetime
 from decimal import Decimal
 import uuid
-from models.register_pupils import db, Pupil, ClassFeeStructure, Payment
+from models.register_pupils import db, Pupil, ClassFeeStructure, Payment, PaymentImportReview, Receipt
 from models.class_model import Class
 from models.stream_model import Stream
 from models.user_models import User, Role
 from models.expenses_model import ExpenseItem, ExpenseRecord
-from models.salary_models import RoleSalary, SalaryPayment
-from sqlalchemy import func, and_, desc
+from models.salary_models import RoleSalary, SalaryPayment, PayrollRun
+from sqlalchemy import func, and_
+from sqlalchemy.exc import IntegrityError
+from utils.fee_balances import fee_balance_query, paginate_balances, fee_item_breakdown, SORTS, DEFAULT_PER_PAGE
+from utils.pupil_balances import refresh_pupil_balances, pupil_balance
+from utils.fee_payments import post_payment, idempotency_key_from, KEY_REUSED
+from utils.statement_import import import_statement, resolve_review_item
+from utils.receipts import revise_receipt, render_receipt
+from utils.fee_aging import aging_by_class, export_aging_xlsx, totals as aging_totals, BUCKETS as AGING_BUCKETS
+from utils.timetable_export import stream_file
+from utils.salary_status import salary_status, salary_counts, staff_roles, salary_history
+from utils.payroll import run_payroll, run_summary
+from utils.finance_rollup import finance_summary as rollup_summary, summary_json, PERIOD_TYPES, MONTH
+from utils.expense_totals import expense_filters, expense_totals, expenses_by_category, expenses_by_month, expense_page, DEFAULT_PER_PAGE as EXPENSES_PER_PAGE
 
 bursar_routes = Blueprint("bursar_routes", __name__, template_folder="templates/bursar")
 
@@ -29,35 +39,57 @@ def dashboard():
 # -------------------------------------------------------------
 @bursar_routes.route("/student-fees")
 def student_fees():
-    pupils = Pupil.query.options(
-        db.joinedload(Pupil.class_),
-        db.joinedload(Pupil.stream),
-        db.joinedload(Pupil.payments)
-    ).order_by(Pupil.first_name).all()
+    """Fee overview, one page at a time. Balances come from one grouped query
+    (utils.fee_balances); the per-item columns need two more for the page."""
+    filters = _fee_listing_filters()
+    query = fee_balance_query(**filters)
+    rows, total, page, per_page = paginate_balances(
+        query, request.args.get("page", 1, type=int), request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    )
+    fees_by_class, paid_by_fee = fee_item_breakdown(rows, filters["year"], filters["term"])
 
     pupil_data = []
-
-    for pupil in pupils:
-        fees_for_class = pupil.class_fees
-        total_required = sum(f.amount for f in fees_for_class)
-        total_paid = sum(p.amount_paid for p in pupil.payments)
-        balance = total_required - total_paid
-
+    for row in rows:
+        fees_for_class = fees_by_class.get(row.class_id, [])
         pupil_data.append({
-            "id": pupil.id,
-            "first_name": pupil.first_name,
-            "last_name": pupil.last_name,
-            "admission_number": pupil.admission_number,
-            "class_name": pupil.class_.name if pupil.class_ else "N/A",
-            "stream_name": pupil.stream.name if pupil.stream else "N/A",
-            "total_required": total_required,
-            "total_paid": total_paid,
-            "balance": balance,
-            "payments": pupil.payments,
+            "id": row.id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "admission_number": row.admission_number,
+            "class_name": row.class_name or "N/A",
+            "stream_name": row.stream_name or "N/A",
+            "total_required": float(row.total_required or 0),
+            "total_paid": float(row.total_paid or 0),
+            "balance": float(row.balance or 0),
+            "paid_by_fee": {f.id: paid_by_fee.get((row.id, f.id), 0) for f in fees_for_class},
             "fees": fees_for_class,
         })
 
-    return render_template("bursar/student_fees.html", pupils=pupil_data)
+    return render_template("bursar/student_fees.html", pupils=pupil_data,
+                           pagination=_pagination(total, page, per_page), filters=filters,
+                           classes=Class.query.order_by(Class.name).all())
+
+
+def _fee_listing_filters():
+    """Query-string filters shared by the fee listing pages."""
+    year = request.args.get("year", type=int)
+    sort = request.args.get("sort", "name")
+    status = request.args.get("status")
+    return {
+        "year": year,
+        "term": request.args.get("term") or None,
+        "search": (request.args.get("q") or "").strip() or None,
+        "class_id": request.args.get("class_id", type=int),
+        "stream_id": request.args.get("stream_id", type=int),
+        "status": status if status in ("owing", "cleared") else None,
+        "sort": sort if sort in SORTS else "name",
+    }
+
+
+def _pagination(total, page, per_page):
+    pages = max(1, -(-total // per_page))
+    return {"total": total, "page": page, "per_page": per_page, "pages": pages,
+            "offset": (page - 1) * per_page}
 
 
 # -------------------------------------------------------------
@@ -86,32 +118,18 @@ def add_payment(pupil_id):
         # Check if fee item exists
         fee_item = ClassFeeStructure.query.get_or_404(fee_id)
 
-        # Calculate total already paid for this fee item
-        already_paid = sum(p.amount_paid for p in pupil.payments if p.fee_id == fee_id)
-
-        # Prevent adding payment if fully paid
-        if already_paid >= fee_item.amount:
-            flash(f"The fee item '{fee_item.item_name}' is already fully paid.", "warning")
+        # Locked, aggregate-checked insert; a resubmitted form returns the first payment
+        ok, result = post_payment(pupil, fee_item, amount_paid, payment_method, year, term,
+                                  idempotency_key=idempotency_key_from(request, request.form),
+                                  cashier_id=session.get("user_id"))
+        if not ok:
+            flash(result, "danger")
             return redirect(url_for("bursar_routes.view_pupil_fees_structure", pupil_id=pupil.id))
-
-        # Prevent overpayment
-        if already_paid + amount_paid > fee_item.amount:
-            flash(f"Payment exceeds required amount for '{fee_item.item_name}'.", "danger")
+        payment = result["payment"]
+        if result["duplicate"]:
+            flash(f"This payment was already recorded (UGX {payment.amount_paid:,.0f} for {fee_item.item_name}).", "info")
             return redirect(url_for("bursar_routes.view_pupil_fees_structure", pupil_id=pupil.id))
 
-        payment = Payment(
-            pupil_id=pupil.id,
-            fee_id=fee_id,
-            amount_paid=amount_paid,
-            payment_method=payment_method,
-            reference=str(fee_id),
-            year=int(year) if year else None,
-            term=term if term else None
-        )
-
-        db.session.add(payment)
-        db.session.commit()
-
         # Debug log the saved payment for easier traceability in server logs
         try:
             from flask import current_app
@@ -142,6 +160,9 @@ def edit_payment(payment_id):
         try:
             payment.amount_paid = float(request.form.get("amount_paid"))
             payment.payment_method = request.form.get("payment_method")
+            db.session.flush()
+            refresh_pupil_balances(pupil_ids=[pupil.id])
+            revise_receipt(payment.id)
 
             db.session.commit()
             flash("Payment updated successfully.", "success")
@@ -165,7 +186,10 @@ def delete_payment(payment_id):
     pupil = payment.pupil
 
     try:
+        revise_receipt(payment.id, void=True)
         db.session.delete(payment)
+        db.session.flush()
+        refresh_pupil_balances(pupil_ids=[pupil.id])
         db.session.commit()
         flash("Payment deleted.", "success")
 
@@ -192,9 +216,10 @@ def view_pupil_fees_structure(pupil_id):
         for fee in fees_for_class
     }
 
-    total_required = sum(f.amount for f in fees_for_class)
-    total_paid = sum(paid_lookup.values())
-    balance = total_required - total_paid
+    totals = pupil_balance(pupil.id)
+    total_required = totals.required if totals else 0
+    total_paid = totals.paid if totals else 0
+    balance = totals.balance if totals else 0
 
     return render_template(
         "bursar/edit_pupil_fees.html",
@@ -226,46 +251,35 @@ def api_add_payment(pupil_id):
         # Check if fee item exists
         fee_item = ClassFeeStructure.query.get_or_404(fee_id)
 
-        # Calculate total already paid for this fee item
-        already_paid = sum(p.amount_paid for p in pupil.payments if p.fee_id == fee_id)
-
-        # Prevent adding payment if fully paid
-        if already_paid >= fee_item.amount:
-            return jsonify({"success": False, "error": f"The fee item '{fee_item.item_name}' is already fully paid."}), 400
-
-        # Prevent overpayment
-        if already_paid + amount_paid > fee_item.amount:
-            return jsonify({"success": False, "error": f"Payment exceeds required amount for '{fee_item.item_name}'."}), 400
-
-        payment = Payment(
-            pupil_id=pupil.id,
-            fee_id=fee_id,
-            amount_paid=amount_paid,
-            payment_method=payment_method,
-            reference=str(fee_id),
-            year=int(year) if year else None,
-            term=term if term else None
-        )
-
-        db.session.add(payment)
-        db.session.commit()
+        # Locked, aggregate-checked insert; a retried request returns the first payment
+        ok, result = post_payment(pupil, fee_item, amount_paid, payment_method, year, term,
+                                  idempotency_key=idempotency_key_from(request, data),
+                                  cashier_id=session.get("user_id"))
+        if not ok:
+            return jsonify({"success": False, "error": result}), 422 if result == KEY_REUSED else 400
+        payment = result["payment"]
+        totals = pupil_balance(pupil.id)
 
         # Return updated totals for live refresh
         return jsonify({
             "success": True,
-            "message": f"Payment of UGX {amount_paid:,.0f} added successfully",
+            "message": (f"Payment of UGX {payment.amount_paid:,.0f} was already recorded" if result["duplicate"]
+                        else f"Payment of UGX {amount_paid:,.0f} added successfully"),
+            "duplicate": result["duplicate"],
             "payment": {
                 "id": payment.id,
                 "fee_name": fee_item.item_name,
-                "amount_paid": amount_paid,
-                "payment_method": payment_method,
+                "amount_paid": payment.amount_paid,
+                "payment_method": payment.payment_method,
                 "payment_date": payment.payment_date.strftime('%Y-%m-%d'),
                 "year": payment.year,
-                "term": payment.term
+                "term": payment.term,
+                "receipt_number": payment.receipt.receipt_number if payment.receipt else None,
+                "receipt_url": url_for("bursar_routes.view_receipt", receipt_id=payment.receipt.id) if payment.receipt else None
             },
             "pupil_totals": {
-                "total_paid": sum(p.amount_paid for p in pupil.payments),
-                "balance": sum(f.amount for f in pupil.class_fees) - sum(p.amount_paid for p in pupil.payments)
+                "total_paid": totals.paid if totals else 0,
+                "balance": totals.balance if totals else 0
             }
         })
 
@@ -274,43 +288,202 @@ def api_add_payment(pupil_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# ---------------------------------------------------------
+# 8️⃣b BANK STATEMENT IMPORT + REVIEW QUEUE
+# ---------------------------------------------------------
+@bursar_routes.route("/payments/import", methods=["GET", "POST"])
+def import_statement_payments():
+    """Upload a bank / mobile-money statement CSV; unmatched lines are queued for review."""
+    wants_json = request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
+
+    if request.method == "POST":
+        upload = request.files.get("statement")
+        if not upload or not upload.filename:
+            if wants_json:
+                return jsonify({"success": False, "error": "Choose a statement CSV to upload."}), 400
+            flash("Choose a statement CSV to upload.", "warning")
+            return redirect(url_for("bursar_routes.import_statement_payments"))
+        try:
+            summary = import_statement(
+                upload.stream,
+                filename=upload.filename,
+                payment_method=request.form.get("payment_method") or "Bank",
+                year=request.form.get("year", type=int),
+                term=request.form.get("term") or None,
+                cashier_id=session.get("user_id"),
+            )
+        except ValueError as e:
+            if wants_json:
+                return jsonify({"success": False, "error": str(e)}), 400
+            flash(str(e), "danger")
+            return redirect(url_for("bursar_routes.import_statement_payments"))
+        except Exception as e:
+            if wants_json:
+                return jsonify({"success": False, "error": str(e)}), 500
+            flash(f"Error importing statement: {e}", "danger")
+            return redirect(url_for("bursar_routes.import_statement_payments"))
+
+        if wants_json:
+            return jsonify({"success": True, **summary})
+        flash(f"{summary['posted']} of {summary['rows']} lines posted (UGX {summary['posted_amount']:,.0f}); "
+              f"{summary['review']} sent to review, {summary['duplicates']} already imported, "
+              f"{summary['skipped']} debits skipped.", "success")
+        return redirect(url_for("bursar_routes.import_statement_payments"))
+
+    pending = PaymentImportReview.query.options(joinedload(PaymentImportReview.pupil))\
+        .filter_by(status="pending").order_by(PaymentImportReview.created_at.desc(), PaymentImportReview.row_number)\
+        .limit(500).all()
+    if wants_json:
+        return jsonify({"success": True, "review": [{
+            "id": r.id,
+            "batch_id": r.batch_id,
+            "row_number": r.row_number,
+            "transaction_date": r.transaction_date.isoformat() if r.transaction_date else None,
+            "reference": r.reference,
+            "narration": r.narration,
+            "amount": r.amount,
+            "reason": r.reason,
+            "pupil_id": r.pupil_id,
+        } for r in pending]})
+    return render_template("bursar/import_statement.html", pending=pending)
+
+
+@bursar_routes.route("/payments/review/<int:item_id>/resolve", methods=["POST"])
+def resolve_statement_line(item_id):
+    """Post a queued statement line to the pupil with the given admission/receipt number."""
+    item = PaymentImportReview.query.get_or_404(item_id)
+    number = (request.form.get("number") or "").strip()
+    pupil = Pupil.query.filter((Pupil.admission_number == number) | (Pupil.receipt_number == number)).first() if number else item.pupil
+    if item.status != "pending":
+        flash("That line has already been dealt with.", "info")
+    elif pupil is None:
+        flash(f"No pupil with admission or receipt number '{number}'.", "warning")
+    else:
+        try:
+            ok, message = resolve_review_item(item, pupil, cashier_id=session.get("user_id"))
+            flash(message, "success" if ok else "danger")
+        except Exception as e:
+            flash(f"Error posting payment: {e}", "danger")
+    return redirect(url_for("bursar_routes.import_statement_payments"))
+
+
+@bursar_routes.route("/payments/review/<int:item_id>/dismiss", methods=["POST"])
+def dismiss_statement_line(item_id):
+    item = PaymentImportReview.query.get_or_404(item_id)
+    try:
+        item.status = "dismissed"
+        item.resolved_at = datetime.utcnow()
+        db.session.commit()
+        flash("Statement line dismissed.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Error dismissing line: {e}", "danger")
+    return redirect(url_for("bursar_routes.import_statement_payments"))
+
+
 # ---------------------------------------------------------
 # 9️⃣ INVOICES / BILLING (View all payments for receipts)
 # ---------------------------------------------------------
 @bursar_routes.route("/invoices")
 def invoices():
-    """Display all students with payments for receipt generation"""
-    # Get all pupils that have made at least one payment
-    pupils_with_payments = db.session.query(Pupil).join(
-        Payment, Pupil.id == Payment.pupil_id
-    ).distinct().options(
-        db.joinedload(Pupil.class_),
-        db.joinedload(Pupil.stream),
-        db.joinedload(Pupil.payments)
-    ).order_by(Pupil.first_name).all()
-
-    # Build invoice data
-    invoice_data = []
-    for pupil in pupils_with_payments:
-        total_required = sum(f.amount for f in pupil.class_fees)
-        total_paid = sum(p.amount_paid for p in pupil.payments)
-        balance = total_required - total_paid
+    """Display students with payments for receipt generation (one grouped query per page)"""
+    filters = _fee_listing_filters()
+    query = fee_balance_query(with_payments_only=True, **filters)
+    rows, total, page, per_page = paginate_balances(
+        query, request.args.get("page", 1, type=int), request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    )
 
+    invoice_data = []
+    for row in rows:
         invoice_data.append({
-            "pupil_id": pupil.id,
-            "first_name": pupil.first_name,
-            "last_name": pupil.last_name,
-            "admission_number": pupil.admission_number,
-            "class_name": pupil.class_.name if pupil.class_ else "N/A",
-            "stream_name": pupil.stream.name if pupil.stream else "N/A",
-            "total_required": total_required,
-            "total_paid": total_paid,
-            "balance": balance,
-            "payments": pupil.payments,
-            "fees": pupil.class_fees,
+            "pupil_id": row.id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "admission_number": row.admission_number,
+            "class_name": row.class_name or "N/A",
+            "stream_name": row.stream_name or "N/A",
+            "total_required": float(row.total_required or 0),
+            "total_paid": float(row.total_paid or 0),
+            "balance": float(row.balance or 0),
+            "payment_count": row.payment_count,
         })
 
-    return render_template("bursar/invoices.html", invoices=invoice_data)
+    return render_template("bursar/invoices.html", invoices=invoice_data,
+                           pagination=_pagination(total, page, per_page), filters=filters,
+                           classes=Class.query.order_by(Class.name).all())
+
+
+# ---------------------------------------------------------
+# 9️⃣b ARREARS AGING (terms overdue, per class / stream)
+# ---------------------------------------------------------
+def _aging_filters():
+    as_of = request.args.get("as_of")
+    try:
+        as_of = datetime.strptime(as_of, "%Y-%m-%d").date() if as_of else None
+    except ValueError:
+        as_of = None
+    return {
+        "as_of": as_of,
+        "class_id": request.args.get("class_id", type=int),
+        "stream_id": request.args.get("stream_id", type=int),
+    }
+
+
+@bursar_routes.route("/arrears-aging")
+def arrears_aging():
+    """Outstanding fees bucketed by terms overdue (utils.fee_aging, one query)."""
+    filters = _aging_filters()
+    rows = aging_by_class(**filters).all()
+    if request.args.get("format") == "json":
+        return jsonify({"success": True, "rows": [{
+            "class_id": r.class_id,
+            "class_name": r.class_name,
+            "stream_id": r.stream_id,
+            "stream_name": r.stream_name,
+            "pupils": r.pupils,
+            **{key: float(getattr(r, key)) for key, _ in AGING_BUCKETS},
+            "total": float(r.total),
+        } for r in rows]})
+    return render_template("bursar/arrears_aging.html", rows=rows, totals=aging_totals(rows),
+                           buckets=AGING_BUCKETS, filters=filters,
+                           classes=Class.query.order_by(Class.name).all(),
+                           streams=Stream.query.order_by(Stream.name).all())
+
+
+@bursar_routes.route("/arrears-aging/export")
+def export_arrears_aging():
+    """Download the aging report (summary + one row per owing pupil) as XLSX."""
+    try:
+        path = export_aging_xlsx(**_aging_filters())
+    except Exception as e:
+        current_app.logger.exception("[ARREARS-EXPORT] XLSX export failed")
+        flash(f"Error exporting arrears report: {e}", "danger")
+        return redirect(url_for("bursar_routes.arrears_aging"))
+    filename = f"fee_arrears_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return current_app.response_class(
+        stream_file(path),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment;filename={filename}",
+                 "Content-Length": str(os.path.getsize(path))}
+    )
+
+
+# ---------------------------------------------------------
+# 9️⃣c FINANCE SUMMARY (income vs expenses vs salaries)
+# ---------------------------------------------------------
+@bursar_routes.route("/finance-summary")
+def finance_summary():
+    """Cash flow per month or term, read from the finance_rollup table."""
+    period_type = request.args.get("period", MONTH)
+    if period_type not in PERIOD_TYPES:
+        period_type = MONTH
+    year_from = request.args.get("year_from", type=int)
+    year_to = request.args.get("year_to", type=int)
+    rows = rollup_summary(period_type, year_from, year_to)
+    if request.args.get("format") == "json":
+        return jsonify({"success": True, "period": period_type, "rows": summary_json(rows)})
+    return render_template("bursar/finance_summary.html", rows=rows, period_type=period_type,
+                           year_from=year_from, year_to=year_to)
 
 
 # ---------------------------------------------------------
@@ -444,7 +617,15 @@ def mark_staff_paid_bursar(user_id):
         )
 
         db.session.add(payment)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request (or a payroll run) paid this period first
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': f'This staff member has already been marked as paid for {period_month}/{period_year}. Cannot process duplicate payment.'
+            }), 400
 
         # Fetch the user to get their updated status
         user = User.query.get(user_id)
@@ -496,6 +677,45 @@ def mark_staff_paid_bursar(user_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@bursar_routes.route('/payroll/run', methods=['POST'])
+def run_payroll_bursar():
+    """Pay every unpaid staff member with a configured salary for a month.
+
+    JSON: period_month, period_year, optional role_id. Staff already paid for
+    the month are skipped, so a repeated run pays nobody twice.
+    """
+    data = request.get_json(force=True, silent=True) or request.form
+    try:
+        run = run_payroll(
+            data.get('period_month') or datetime.utcnow().month,
+            data.get('period_year') or datetime.utcnow().year,
+            run_by_user_id=session.get('user_id'),
+            role_id=data.get('role_id') or None,
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.exception('[PAYROLL] run failed')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    summary = run_summary(run)
+    current_app.logger.info(f"[PAYROLL] run #{run.id} {run.period_month}/{run.period_year}: "
+                            f"{run.paid_count} paid, {run.skipped_count} skipped, {run.no_salary_count} without salary")
+    return jsonify({
+        'success': True,
+        'message': f"Paid {run.paid_count} staff ({summary['total_amount']:,.0f}); "
+                   f"{run.skipped_count} already paid, {run.no_salary_count} without a salary set",
+        'run': summary,
+    }), 200
+
+
+@bursar_routes.route('/payroll/runs')
+def payroll_runs():
+    """Recent payroll runs, newest first."""
+    runs = PayrollRun.query.order_by(PayrollRun.created_at.desc(), PayrollRun.id.desc()).limit(50).all()
+    return jsonify({'success': True, 'runs': [run_summary(r) for r in runs]})
+
+
 # ---------------------------------------------------------
 # 🔟 RECEIPT (Print individual student receipt)
 # ---------------------------------------------------------
@@ -515,9 +735,10 @@ def student_receipt(pupil_id):
         for fee in fees_for_class
     }
 
-    total_required = sum(f.amount for f in fees_for_class)
-    total_paid = sum(paid_lookup.values())
-    balance = total_required - total_paid
+    totals = pupil_balance(pupil.id)
+    total_required = totals.required if totals else 0
+    total_paid = totals.paid if totals else 0
+    balance = totals.balance if totals else 0
     receipt_date = datetime.now().strftime('%d/%m/%Y %H:%M')
     # Determine cashier name from current_user if available (Flask-Login), otherwise fallback
     cashier_name = 'generated by........'
@@ -580,48 +801,15 @@ def student_receipt(pupil_id):
         # Logging should never break receipt generation; ignore errors
         pass
 
-    # Attempt to recover cashier info from the most recent saved receipt metadata for this pupil
-    try:
-        receipts_dir = Path(__file__).resolve().parents[1] / 'receipts'
-        receipts_dir.mkdir(parents=True, exist_ok=True)
-
-        # If cashier_name is the placeholder or empty, try to read the latest saved meta for this pupil
-        if (not cashier_name) or (cashier_name.strip() == 'generated by........') or (not bursar_role_name):
-            # find files matching receipt_{pupil.id}_*.json
-            pattern = f"receipt_{pupil.id}_*.json"
-            candidates = sorted(receipts_dir.glob(pattern), key=lambda p: p.stat().st_mtime, reverse=True)
-            if candidates:
-                try:
-                    with open(candidates[0], 'r', encoding='utf-8') as f:
-                        prev = json.load(f)
-                        prev_cashier = prev.get('cashier_name')
-                        prev_role = prev.get('bursar_role_name')
-                        if prev_cashier and prev_cashier.strip():
-                            cashier_name = prev_cashier
-                        if prev_role and prev_role.strip():
-                            bursar_role_name = prev_role
-                except Exception:
-                    # ignore malformed files
-                    pass
-
-        # Now persist the (possibly updated) metadata for this render
-        receipt_meta = {
-            'pupil_id': pupil.id,
-            'pupil_name': f"{pupil.first_name} {pupil.last_name}",
-            'receipt_date': receipt_date,
-            'cashier_name': cashier_name,
-            'bursar_role_name': bursar_role_name,
-            'total_required': total_required,
-            'total_paid': total_paid,
-            'balance': balance
-        }
-        safe_ts = receipt_date.replace('/', '-').replace(':', '-')
-        meta_path = receipts_dir / f"receipt_{pupil.id}_{safe_ts}.json"
-        with open(meta_path, 'w', encoding='utf-8') as f:
-            json.dump(receipt_meta, f, ensure_ascii=False, indent=2)
-    except Exception:
-        # Do not let persistence errors prevent rendering the receipt
-        pass
+    # Otherwise reuse the cashier recorded on the pupil's latest payment receipt
+    if (not cashier_name) or (cashier_name.strip() == 'generated by........') or (not bursar_role_name):
+        latest = Receipt.query.filter(Receipt.pupil_id == pupil.id, Receipt.cashier_name.isnot(None))\
+            .order_by(Receipt.issued_at.desc()).first()
+        if latest is not None:
+            if (not cashier_name) or (cashier_name.strip() == 'generated by........'):
+                cashier_name = latest.cashier_name
+            if not bursar_role_name and latest.cashier_role:
+                bursar_role_name = latest.cashier_role
     # If still missing cashier info, try to pick a bursar from the DB as a reasonable fallback
     try:
         if (not cashier_name) or (cashier_name.strip() == 'generated by........'):
@@ -649,6 +837,13 @@ def student_receipt(pupil_id):
     )
 
 
+@bursar_routes.route("/receipts/<int:receipt_id>")
+def view_receipt(receipt_id):
+    """Printable receipt for one payment (rendered once per receipt version)."""
+    receipt = Receipt.query.get_or_404(receipt_id)
+    return render_receipt(receipt)
+
+
 # ---------------------------------------------------------
 # Expenses / Disbursements
 # ---------------------------------------------------------
@@ -657,39 +852,25 @@ from sqlalchemy.orm import joinedload
 
 @bursar_routes.route('/expenses')
 def expenses():
-    """List all expenses and show totals for a selected term/year."""
+    """List expenses newest first (keyset pages) with totals for the selected term/year/date.
+
+    Totals and the category / month breakdowns are grouped queries over the
+    whole filter (utils.expense_totals), not sums of the page on screen.
+    """
     term = request.args.get('term')
     year = request.args.get('year')
     date_str = request.args.get('date')
+    month = request.args.get('month')
 
-    query = db.session.query(ExpenseRecord).options(joinedload(ExpenseRecord.item)).order_by(ExpenseRecord.payment_date.desc())
-    if term:
-        query = query.filter(ExpenseRecord.term == term)
-    if year:
-        try:
-            y = int(year)
-            query = query.filter(ExpenseRecord.year == y)
-        except Exception:
-            pass
-    # optional exact date filter (YYYY-MM-DD)
-    if date_str:
-        try:
-            from datetime import datetime
-            dt = datetime.fromisoformat(date_str).date()
-            query = query.filter(func.date(ExpenseRecord.payment_date) == dt)
-        except Exception:
-            # ignore parse errors
-            pass
-
-    records = query.all()
-
-    # Totals: total money spent and number of expense records, and count of unique items
-    total_spent = sum(float(r.amount) for r in records) if records else 0.0
-    total_count = len(records)
-    unique_items = len({r.item_id for r in records if r.item_id})
+    conditions = expense_filters(term=term, year=year, day=date_str, month=month)
+    records, next_cursor = expense_page(conditions, before=request.args.get('before'),
+                                        per_page=request.args.get('per_page', EXPENSES_PER_PAGE, type=int))
+    total_spent, total_count, unique_items = expense_totals(conditions)
 
     items = ExpenseItem.query.order_by(ExpenseItem.name).all()
-    return render_template('bursar/expenses.html', records=records, items=items, total_spent=total_spent, total_count=total_count, unique_items=unique_items, selected_term=term, selected_year=year, selected_date=date_str)
+    return render_template('bursar/expenses.html', records=records, items=items, total_spent=total_spent, total_count=total_count, unique_items=unique_items,
+                           by_category=expenses_by_category(conditions), by_month=expenses_by_month(conditions),
+                           next_cursor=next_cursor, selected_term=term, selected_year=year, selected_date=date_str, selected_month=month)
 
 
 @bursar_routes.route('/expenses/add', methods=['GET', 'POST'])
@@ -830,14 +1011,7 @@ def update_expense(expense_id):
         db.session.commit()
 
         # calculate quick totals so client can refresh authoritative totals
-        try:
-            total_spent = float(db.session.query(func.coalesce(func.sum(ExpenseRecord.amount), 0)).scalar() or 0)
-        except Exception:
-            total_spent = float(sum(r.amount for r in ExpenseRecord.query.all()))
-        try:
-            total_count = db.session.query(func.count(ExpenseRecord.id)).scalar() or 0
-        except Exception:
-            total_count = len(ExpenseRecord.query.all())
+        total_spent, total_count, _ = expense_totals([])
 
         return jsonify({
             'success': True,
@@ -877,14 +1051,7 @@ def delete_expense(expense_id):
         db.session.commit()
 
         # Calculate updated totals for client to display
-        try:
-            total_spent = float(db.session.query(func.coalesce(func.sum(ExpenseRecord.amount), 0)).scalar() or 0)
-        except Exception:
-            total_spent = float(sum(r.amount for r in ExpenseRecord.query.all()))
-        try:
-            total_count = db.session.query(func.count(ExpenseRecord.id)).scalar() or 0
-        except Exception:
-            total_count = len(ExpenseRecord.query.all())
+        total_spent, total_count, _ = expense_totals([])
 
         return jsonify({
             'success': True,
@@ -913,10 +1080,8 @@ def manage_staff_salaries():
     Display all staff grouped by role with salary information and payment status.
     Allows filtering by role and period (month/year or term/year).
     """
-    # Get all roles that have users (non-empty staff) — EXCLUDE 'Parent' role
-    roles = db.session.query(Role).join(User, Role.id == User.role_id).filter(
-        Role.role_name != 'Parent'
-    ).distinct().order_by(Role.role_name).all()
+    # Roles that have staff users — EXCLUDE 'Parent' role
+    roles = staff_roles()
 
     # Get current month/year as default period
     today = datetime.utcnow()
@@ -925,69 +1090,25 @@ def manage_staff_salaries():
     selected_role_id = request.args.get('role_id', None, type=int)
     filter_status = request.args.get('status', 'all')  # 'all', 'paid', 'unpaid'
 
-    # Base query: all staff users with salary-eligible roles — EXCLUDE 'Parent' role
-    query = db.session.query(User).join(Role, User.role_id == Role.id).filter(
-        Role.role_name != 'Parent'
-    )
-
-    if selected_role_id:
-        query = query.filter(User.role_id == selected_role_id)
-
-    staff_users = query.order_by(User.first_name, User.last_name).all()
-
-    # Build staff with payment status for the selected period
+    # One query: users + role salary + this period's paid payment (utils.salary_status)
     staff_data = []
-    for user in staff_users:
-        # Get salary amount (per-user override or role default)
-        salary_amount = user.salary_amount
-        if salary_amount is None and user.role and user.role.salary_config:
-            salary_amount = user.role.salary_config.amount
-
-        # Check if paid for this period
-        payment = SalaryPayment.query.filter(
-            SalaryPayment.user_id == user.id,
-            SalaryPayment.period_month == current_month,
-            SalaryPayment.period_year == current_year,
-            SalaryPayment.status == 'paid'
-        ).first()
-
-        is_paid = bool(payment)
-
-        # Apply status filter
-        if filter_status == 'paid' and not is_paid:
-            continue
-        elif filter_status == 'unpaid' and is_paid:
-            continue
-
+    for user, role_name, salary_amount, payment in salary_status(current_month, current_year, selected_role_id, filter_status):
         staff_data.append({
             'id': user.id,
             'first_name': user.first_name,
             'last_name': user.last_name,
             'email': user.email,
-            'role': user.role.role_name,
+            'role': role_name,
             'salary_amount': float(salary_amount) if salary_amount else 0.0,
-            'is_paid': is_paid,
+            'is_paid': payment is not None,
             'last_payment': payment,
             'last_payment_reference': (payment.reference if payment and getattr(payment, 'reference', None) else (f"PAY-{payment.payment_date.strftime('%Y%m%d%H%M%S')}-{payment.id}" if payment and getattr(payment, 'payment_date', None) and getattr(payment, 'id', None) else None)),
             'payment_method': payment.payment_method if payment else None,
             'bank_name': payment.bank_name if payment else None,
         })
 
-    # Compute overall stats for the selected period (ignore filters) — EXCLUDE 'Parent' role
-    all_staff = db.session.query(User).join(Role, User.role_id == Role.id).filter(
-        Role.role_name != 'Parent'
-    ).order_by(User.first_name, User.last_name).all()
-    total_staff_all = len(all_staff)
-    paid_count_all = 0
-    for u in all_staff:
-        p = SalaryPayment.query.filter(
-            SalaryPayment.user_id == u.id,
-            SalaryPayment.period_month == current_month,
-            SalaryPayment.period_year == current_year,
-            SalaryPayment.status == 'paid'
-        ).first()
-        if p:
-            paid_count_all += 1
+    # Overall stats for the selected period (ignore filters) — EXCLUDE 'Parent' role
+    total_staff_all, paid_count_all = salary_counts(current_month, current_year)
     unpaid_count_all = total_staff_all - paid_count_all
 
     # Also update the session-based resolver in the manage_staff_salaries endpoint for consistency
@@ -1021,20 +1142,13 @@ def manage_staff_salaries():
 @bursar_routes.route('/staff/<int:user_id>/salary-history')
 def staff_salary_history(user_id):
     """Get payment history for a specific staff member."""
-    user = User.query.get_or_404(user_id)
-    payments = SalaryPayment.query.filter_by(user_id=user_id).order_by(desc(SalaryPayment.payment_date)).all()
+    user = User.query.options(joinedload(User.role)).get_or_404(user_id)
+    payments = salary_history(user_id)
 
     history = []
     for p in payments:
-        # resolve payer name if possible
-        paid_by_name = None
-        try:
-            if getattr(p, 'paid_by_user_id', None):
-                pb = User.query.get(p.paid_by_user_id)
-                if pb:
-                    paid_by_name = f"{pb.first_name} {pb.last_name}".strip()
-        except Exception:
-            paid_by_name = None
+        # recorder is eager-loaded with the payment
+        paid_by_name = f"{p.paid_by.first_name} {p.paid_by.last_name}".strip() if p.paid_by else None
 
         # Provide display values when DB fields are missing (non-destructive)
         display_ref = p.reference if p.reference else (f"PAY-{p.payment_date.strftime('%Y%m%d%H%M%S')}-{p.id}" if p.payment_date and p.id else None)
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, current_app, stream_with_context
 from datetime import date, datetime, timezone, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from sqlalchemy import func, text
@@ -9,7 +9,11 @@ from models.register_pupils import Pupil
 from models.class_model import Class
 from models.stream_model import Stream
 from models.salary_models import SalaryPayment, RoleSalary
-from models.staff_models import StaffAttendance, StaffProfile, SalaryHistory
+from models.staff_models import StaffAttendance, SalaryHistory
+from utils.finance_rollup import finance_summary, summary_json, PERIOD_TYPES, MONTH
+from utils.staff_directory import staff_directory, staff_cache_key, CACHE_TTL as STAFF_CACHE_TTL, MAX_PER_PAGE as MAX_STAFF_PER_PAGE
+from utils.cache_utils import cache_get, cache_set
+from utils.salary_ledger import salary_payment_filters, salary_payment_page, iter_salary_payments, ndjson_lines, csv_lines
 
 
 headteacher_routes = Blueprint("headteacher_routes", __name__)
@@ -160,147 +164,145 @@ def api_summary():
     })
 
 
+@headteacher_routes.route('/headteacher/api/finance_summary')
+def api_finance_summary():
+    """Fee income, expenses and salaries per month (default) or term, from finance_rollup."""
+    period_type = request.args.get('period', MONTH)
+    if period_type not in PERIOD_TYPES:
+        return jsonify({'error': f"period must be one of {', '.join(PERIOD_TYPES)}"}), 400
+    rows = finance_summary(period_type, request.args.get('year_from', type=int), request.args.get('year_to', type=int))
+    return jsonify({'period': period_type, 'rows': summary_json(rows)})
+
+
 @headteacher_routes.route('/headteacher/api/staff')
 def api_staff():
-    # Return all users with role name and staff profile (if any)
-    # Return only staff users (exclude pupils if the Pupil role exists)
-    # Exclude non-staff roles from the staff listing (Pupil and Parent)
-    pupil_role = Role.query.filter_by(role_name='Pupil').first()
-    parent_role = Role.query.filter_by(role_name='Parent').first()
-    excluded = []
-    if pupil_role: excluded.append(pupil_role.id)
-    if parent_role: excluded.append(parent_role.id)
-    users_q = db.session.query(User, Role).outerjoin(Role, User.role_id == Role.id)
-    if excluded:
-        users_q = users_q.filter(~User.role_id.in_(excluded))
-    users = users_q.all()
-
-    out = []
-    for user, role in users:
-        profile = StaffProfile.query.filter_by(staff_id=user.id).first()
-        latest_payment = (
-            SalaryPayment.query.filter_by(user_id=user.id)
-            .order_by(SalaryPayment.payment_date.desc())
-            .first()
-        )
-        # compute expected salary for this user: per-user override or role default
-        expected_salary = None
-        try:
-            if user.salary_amount is not None:
-                expected_salary = user.salary_amount
-            else:
-                # try to find role default
-                rs = RoleSalary.query.filter_by(role_id=user.role_id).first()
-                if rs and rs.amount is not None:
-                    expected_salary = rs.amount
-        except Exception:
-            expected_salary = None
+    """Staff (all roles except Pupil and Parent) with profile and latest salary payment.
 
-        # compute balance if we have both expected salary and a latest payment
-        latest_payment_obj = None
-        if latest_payment:
-            try:
-                balance_val = None
-                if expected_salary is not None and latest_payment.amount is not None:
-                    # Decimal arithmetic: compute expected - paid and round to integer
-                    balance_val = Decimal(expected_salary) - Decimal(latest_payment.amount)
-                    try:
-                        balance_int = int(balance_val.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
-                    except Exception:
-                        balance_int = int(balance_val)
-                else:
-                    balance_int = None
+    Returns the full list as a JSON array. With ?page= (and ?per_page=, max
+    200) returns {'items', 'page', 'per_page', 'total', 'pages'} instead.
+    ?q= filters by name, email or role either way.
+    """
+    q = (request.args.get('q') or '').strip() or None
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', type=int)
+    if per_page and not page:
+        page = 1
+    if page:
+        per_page = max(1, min(per_page or 50, MAX_STAFF_PER_PAGE))
+
+    key = staff_cache_key('directory', q or '', page or '', per_page or '')
+    cached = cache_get(key)
+    if cached is not None:
+        return jsonify(cached)
+
+    rows, total = staff_directory(q, page, per_page)
+    out = [_staff_json(r) for r in rows]
+    if page:
+        out = {
+            'items': out,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page,
+        }
+    cache_set(key, out, ttl=STAFF_CACHE_TTL)
+    return jsonify(out)
 
-                # normalize amount to integer (no decimals)
-                try:
-                    amount_int = int(Decimal(latest_payment.amount).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
-                except Exception:
-                    try:
-                        amount_int = int(latest_payment.amount)
-                    except Exception:
-                        amount_int = None
 
-                latest_payment_obj = {
-                    'id': latest_payment.id,
-                    'amount': amount_int,
-                    'balance': balance_int,
-                    'date_utc': _to_utc_iso(latest_payment.payment_date),
-                    'date_eat': _to_eat_iso(latest_payment.payment_date),
-                    'date_display': _to_eat_display(latest_payment.payment_date),
-                    'status': latest_payment.status if latest_payment.status else None,
-                }
-            except Exception:
-                # fallback to a minimal latest_payment representation with integer normalization
-                try:
-                    amount_int = int(Decimal(getattr(latest_payment, 'amount', 0)).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
-                except Exception:
-                    try:
-                        amount_int = int(getattr(latest_payment, 'amount', None))
-                    except Exception:
-                        amount_int = None
-                latest_payment_obj = {
-                    'id': latest_payment.id,
-                    'amount': amount_int,
-                    'balance': None,
-                    'date_utc': _to_utc_iso(getattr(latest_payment, 'payment_date', None)),
-                    'date_eat': _to_eat_iso(getattr(latest_payment, 'payment_date', None)),
-                    'date_display': _to_eat_display(getattr(latest_payment, 'payment_date', None)),
-                    'status': latest_payment.status if getattr(latest_payment, 'status', None) else None,
-                }
-
-        out.append({
-            'id': user.id,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'email': user.email,
-            'role': role.role_name if role else None,
-            'salary_override': str(user.salary_amount) if user.salary_amount is not None else None,
-            'profile': {
-                'bank_name': profile.bank_name if profile else None,
-                'bank_account': profile.bank_account if profile else None,
-                'tax_id': profile.tax_id if profile else None,
-                'pay_grade': profile.pay_grade if profile else None,
-            },
-            'latest_payment': latest_payment_obj
-        })
+def _whole_amount(value):
+    """Round a money value half-up to an int (the API has no decimals)."""
+    if value is None:
+        return None
+    try:
+        return int(Decimal(value).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except Exception:
+        return None
 
-    return jsonify(out)
+
+def _staff_json(r):
+    latest_payment = None
+    if r.payment_id is not None:
+        balance = None
+        if r.expected_salary is not None and r.payment_amount is not None:
+            balance = _whole_amount(Decimal(r.expected_salary) - Decimal(r.payment_amount))
+        latest_payment = {
+            'id': r.payment_id,
+            'amount': _whole_amount(r.payment_amount),
+            'balance': balance,
+            'date_utc': _to_utc_iso(r.payment_date),
+            'date_eat': _to_eat_iso(r.payment_date),
+            'date_display': _to_eat_display(r.payment_date),
+            'status': r.payment_status or None,
+        }
+    return {
+        'id': r.id,
+        'first_name': r.first_name,
+        'last_name': r.last_name,
+        'email': r.email,
+        'role': r.role_name,
+        'salary_override': str(r.salary_amount) if r.salary_amount is not None else None,
+        'profile': {
+            'bank_name': r.bank_name,
+            'bank_account': r.bank_account,
+            'tax_id': r.tax_id,
+            'pay_grade': r.pay_grade,
+        },
+        'latest_payment': latest_payment,
+    }
+
+
+def _salary_payment_json(p):
+    """API shape of a salary payment (ORM object or plain row)."""
+    return {
+        'id': p.id,
+        'user_id': p.user_id,
+        'role_id': p.role_id,
+        'amount': _whole_amount(p.amount),
+        'paid_by_user_id': p.paid_by_user_id,
+        'payment_date_utc': _to_utc_iso(p.payment_date),
+        'payment_date_eat': _to_eat_iso(p.payment_date),
+        'payment_date_display': _to_eat_display(p.payment_date),
+        'period_month': p.period_month,
+        'period_year': p.period_year,
+        'term': p.term,
+        'year': p.year,
+        'status': p.status,
+        'reference': p.reference,
+        'notes': p.notes,
+        'payment_method': p.payment_method,
+        'bank_name': p.bank_name,
+    }
 
 
 @headteacher_routes.route('/headteacher/api/salary_payments', methods=['GET', 'POST'])
 def api_salary_payments():
     if request.method == 'GET':
-        payments = SalaryPayment.query.order_by(SalaryPayment.payment_date.desc()).all()
-        out = []
-        for p in payments:
-            # normalize amount to integer (no decimals)
-            try:
-                amount_int = int(Decimal(p.amount).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
-            except Exception:
-                try:
-                    amount_int = int(p.amount)
-                except Exception:
-                    amount_int = None
-            out.append({
-                'id': p.id,
-                'user_id': p.user_id,
-                'role_id': p.role_id,
-                'amount': amount_int,
-                'paid_by_user_id': p.paid_by_user_id,
-                'payment_date_utc': _to_utc_iso(p.payment_date),
-                'payment_date_eat': _to_eat_iso(p.payment_date),
-                'payment_date_display': _to_eat_display(p.payment_date),
-                'period_month': p.period_month,
-                'period_year': p.period_year,
-                'term': p.term,
-                'year': p.year,
-                'status': p.status,
-                'reference': p.reference,
-                'notes': p.notes,
-                'payment_method': p.payment_method,
-                'bank_name': p.bank_name,
-            })
-        return jsonify(out)
+        # Filters: period_month, period_year, term, year, role_id, user_id, status.
+        # Paged newest first by ?before=<next_cursor>&per_page=; ?format=ndjson|csv
+        # streams every matching payment instead.
+        args = request.args
+        conditions = salary_payment_filters(
+            args.get('period_month'), args.get('period_year'), args.get('term'), args.get('year'),
+            args.get('role_id'), args.get('user_id') or args.get('staff_id'), args.get('status'),
+        )
+        export = (args.get('format') or '').lower()
+        if export in ('ndjson', 'csv'):
+            rows = iter_salary_payments(conditions)
+            if export == 'ndjson':
+                body, mimetype = ndjson_lines(rows, _salary_payment_json), 'application/x-ndjson'
+            else:
+                body, mimetype = csv_lines(rows), 'text/csv'
+            return current_app.response_class(
+                stream_with_context(body),
+                mimetype=mimetype,
+                headers={'Content-Disposition': f'attachment;filename=salary_payments.{export}'}
+            )
+
+        payments, next_cursor = salary_payment_page(conditions, args.get('before'), args.get('per_page', type=int))
+        return jsonify({
+            'items': [_salary_payment_json(p) for p in payments],
+            'next_cursor': next_cursor,
+        })
 
     # POST - create a salary payment
     data = request.json or {}
@@ -1,14 +1,18 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash, make_response
 from models.user_models import db, User, Role
 from models.term_model import Term
-from models.register_pupils import Pupil, Payment, ClassFeeStructure
+from models.register_pupils import Pupil, Payment, ClassFeeStructure, Receipt
 from models.timetable_model import TimeTableSlot
 from models.attendance_model import Attendance
 from models.marks_model import Mark, Subject, Report, Exam
 from models.class_model import Class
 from models.stream_model import Stream
 from models.teacher_assignment_models import TeacherAssignment
-from sqlalchemy import or_
+from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload
+from utils.timetable_cache import timetable_etag
+from utils.pupil_balances import pupil_balance
+from utils.receipts import render_receipt
 
 parent_routes = Blueprint("parent_routes", __name__)
 
@@ -241,7 +245,23 @@ def view_timetable(pupil_id):
         flash('Access denied. You can only view timetables for your own child.', 'danger')
         return redirect(url_for('parent_routes.dashboard'))
 
-    timetable = TimeTableSlot.query.filter_by(class_id=pupil.class_id, stream_id=pupil.stream_id).all()
+    assignment = TeacherAssignment.query.options(joinedload(TeacherAssignment.teacher))\
+        .filter_by(class_id=pupil.class_id, stream_id=pupil.stream_id).first()
+    class_teacher = f"{assignment.teacher.first_name} {assignment.teacher.last_name}".strip() if assignment and getattr(assignment, 'teacher', None) else None
+
+    # The page only depends on the pupil's class/stream timetable version and
+    # class teacher, so an unchanged page is answered with 304 before reading slots.
+    etag = f"{timetable_etag(pupil.class_id, pupil.stream_id)}-p{pupil.id}-t{assignment.teacher_id if assignment else 0}"
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    timetable = TimeTableSlot.query.options(
+        joinedload(TimeTableSlot.teacher),
+        joinedload(TimeTableSlot.subject)
+    ).filter_by(class_id=pupil.class_id, stream_id=pupil.stream_id).all()
     schedule = {}
     for slot in timetable:
         if not getattr(slot, 'teacher', None) or not getattr(slot, 'subject', None):
@@ -255,10 +275,10 @@ def view_timetable(pupil_id):
             'classroom': getattr(slot, 'classroom', None)
         })
 
-    assignment = TeacherAssignment.query.filter_by(class_id=pupil.class_id, stream_id=pupil.stream_id).first()
-    class_teacher = f"{assignment.teacher.first_name} {assignment.teacher.last_name}".strip() if assignment and getattr(assignment, 'teacher', None) else None
-
-    return render_template('parent/timetable.html', pupil=pupil, schedule=schedule, class_teacher=class_teacher)
+    response = make_response(render_template('parent/timetable.html', pupil=pupil, schedule=schedule, class_teacher=class_teacher))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @parent_routes.route("/parent/pupil/<int:pupil_id>/attendance")
@@ -660,7 +680,7 @@ def view_payments_summary(pupil_id):
         flash('Access denied.', 'danger')
         return redirect(url_for('parent_routes.dashboard'))
 
-    # Fetch all payments for the pupil
+    # Every payment is listed on the page (history table and receipts)
     payments = Payment.query.filter_by(pupil_id=pupil_id).all()
 
     # Build fee items from the DB table for this pupil's class. We explicitly
@@ -669,11 +689,15 @@ def view_payments_summary(pupil_id):
     fee_items = []
     try:
         class_fee_items = ClassFeeStructure.query.filter_by(class_id=pupil.class_id).all() or []
+        # Completed payments per fee item, summed by the database
+        paid_by_fee = dict(db.session.query(Payment.fee_id, func.sum(Payment.amount_paid)).filter(
+            Payment.pupil_id == pupil_id, Payment.status == 'completed', Payment.fee_id.isnot(None)
+        ).group_by(Payment.fee_id).all())
         for fi in class_fee_items:
             # total required for this item (from class fee structure table)
             required = getattr(fi, 'amount', 0) or 0
             # sum of payments made toward this fee item (only completed payments)
-            paid_for_item = sum(p.amount_paid for p in payments if getattr(p, 'fee_id', None) == fi.id and getattr(p, 'status', None) == 'completed')
+            paid_for_item = paid_by_fee.get(fi.id, 0)
             outstanding = max(required - paid_for_item, 0)
             fee_items.append({
                 'fee_id': fi.id,
@@ -685,27 +709,12 @@ def view_payments_summary(pupil_id):
     except Exception:
         fee_items = []
 
-    # Calculate payment aggregates
-    total_pending = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'pending')
-    total_paid = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'completed')
-
-    # Determine selected term (if provided via querystring) and use it to
-    # filter payments when computing what has been paid for that term. If no
-    # term is supplied we consider all recorded payments.
+    # Totals come from the pupil_balances row for the selected term (if
+    # provided via querystring), or the pupil's overall row otherwise.
     selected_term = request.args.get('term')
-
-    if selected_term:
-        try:
-            # payments.term stored as string (e.g., 'Term 1') — compare directly
-            total_paid = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'completed' and str(getattr(p, 'term', '')) == str(selected_term))
-            total_pending = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'pending' and str(getattr(p, 'term', '')) == str(selected_term))
-        except Exception:
-            # fallback to previous totals if anything goes wrong
-            total_paid = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'completed')
-            total_pending = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'pending')
-
-    # Totals from class fee items (authoritative DB source)
-    total_required = sum(fi['required'] for fi in fee_items) if fee_items else sum(getattr(p.fee_item, 'amount', 0) for p in payments)
+    totals = pupil_balance(pupil.id, term=selected_term)
+    total_paid = totals.paid if totals else 0
+    total_required = totals.required if totals else 0
 
     balance_status = 'Credit' if total_paid > total_required else 'Debit'
     balance_amount = abs(total_required - total_paid)
@@ -784,13 +793,13 @@ def view_payments(pupil_id):
         })
 
     total_pending = sum(p['amount_paid'] for p in payments_data if p['status'] == 'pending')
-    total_paid = sum(p['amount_paid'] for p in payments_data if p['status'] == 'completed')
-    # Compute total required from DB fee items for this pupil's class
+    totals = pupil_balance(pupil.id)
+    total_paid = totals.paid if totals else 0
+    total_required = totals.required if totals else 0
     try:
         class_fee_items = ClassFeeStructure.query.filter_by(class_id=pupil.class_id).all() or []
-        total_required = sum(getattr(fi, 'amount', 0) or 0 for fi in class_fee_items)
     except Exception:
-        total_required = 0
+        class_fee_items = []
 
     summary = {
         'outstanding': max(total_required - total_paid, 0),
@@ -809,24 +818,12 @@ def view_balance(pupil_id):
     if not user_id:
         return redirect(url_for('user_routes.login'))
     pupil = Pupil.query.get_or_404(pupil_id)
-    payments = Payment.query.filter_by(pupil_id=pupil_id).all()
 
-    # Compute totals from the authoritative class fees table for this pupil's
-    # class. Also allow filtering by term via querystring (so the balance can
-    # be viewed per-term).
+    # One pupil_balances lookup, optionally for a single term (querystring)
     selected_term = request.args.get('term')
-    try:
-        class_fee_items = ClassFeeStructure.query.filter_by(class_id=pupil.class_id).all() or []
-        total_required = sum(getattr(fi, 'amount', 0) or 0 for fi in class_fee_items)
-    except Exception:
-        total_required = 0
-
-    if selected_term:
-        total_paid = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'completed' and str(getattr(p, 'term', '')) == str(selected_term))
-        total_pending = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'pending' and str(getattr(p, 'term', '')) == str(selected_term))
-    else:
-        total_paid = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'completed')
-        total_pending = sum(p.amount_paid for p in payments if getattr(p, 'status', None) == 'pending')
+    totals = pupil_balance(pupil.id, term=selected_term)
+    total_required = totals.required if totals else 0
+    total_paid = totals.paid if totals else 0
 
     balance_status = 'Credit' if total_paid > total_required else 'Debit'
     balance_amount = abs(total_required - total_paid)
@@ -848,18 +845,25 @@ def view_receipts(pupil_id):
     if not user_id:
         return redirect(url_for('user_routes.login'))
     pupil = Pupil.query.get_or_404(pupil_id)
-    receipts = Payment.query.filter_by(pupil_id=pupil_id).all()
+    receipts = Payment.query.options(joinedload(Payment.receipt)).filter_by(pupil_id=pupil_id)\
+        .order_by(Payment.payment_date.desc()).all()
     return render_template('parent/receipts.html', pupil=pupil, receipts=receipts)
 
 
 @parent_routes.route("/parent/receipt/<int:receipt_id>/download")
 def download_receipt(receipt_id):
+    """Printable receipt for a payment (receipt_id is the payment id listed on the receipts page)."""
     user_id = session.get('user_id')
     if not user_id:
         return redirect(url_for('user_routes.login'))
-    receipt = Payment.query.get_or_404(receipt_id)
-    flash('Receipt download not implemented yet.', 'info')
-    return redirect(request.referrer or url_for('parent_routes.dashboard'))
+    receipt = Receipt.query.filter_by(payment_id=receipt_id).first()
+    if receipt is None:
+        flash('No receipt has been issued for this payment yet.', 'info')
+        return redirect(request.referrer or url_for('parent_routes.dashboard'))
+    if not _parent_authorized_for_pupil(User.query.get(user_id), receipt.pupil):
+        flash('Access denied.', 'danger')
+        return redirect(url_for('parent_routes.dashboard'))
+    return render_receipt(receipt)
 """
 NOTE: The rest of this file (below) previously contained a duplicated blueprint and duplicated route definitions.
 That duplication caused some routes to be registered on a different blueprint object, leading to 404 for
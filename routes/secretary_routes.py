@@ -6,6 +6,8 @@ from sqlalchemy import extract, func
 from collections import Counter
 from models.user_models import db
 from models.register_pupils import Pupil
+from utils.pupil_balances import refresh_pupil_balances
+from utils.receipts import next_pupil_receipt_number
 from models.class_model import Class
 from models.stream_model import Stream
 
@@ -24,18 +26,9 @@ def generate_admission_number():
         next_num = 1
     return f"HPF{str(next_num).zfill(3)}"
 
-# Utility: Generate next receipt number (RCT-001, RCT-002, ...)
+# Utility: Generate next receipt number (RCT-001, RCT-002, ...) from pupil_receipt_number_seq
 def generate_receipt_number():
-    last_pupil = Pupil.query.order_by(Pupil.id.desc()).first()
-    if last_pupil and last_pupil.receipt_number and last_pupil.receipt_number.startswith("RCT-"):
-        try:
-            last_num = int(last_pupil.receipt_number.replace("RCT-", ""))
-            next_num = last_num + 1
-        except ValueError:
-            next_num = 1
-    else:
-        next_num = 1
-    return f"RCT-{str(next_num).zfill(3)}"
+    return next_pupil_receipt_number()
 
 # Utility: Generate next pupil_id (ID001, ID002, ...)
 def generate_pupil_id():
@@ -150,6 +143,8 @@ def submit_pupil():
     )
 
     db.session.add(pupil)
+    db.session.flush()
+    refresh_pupil_balances(pupil_ids=[pupil.id])
     db.session.commit()
     return redirect(url_for("secretary_routes.manage_pupils"))
 
@@ -222,6 +217,9 @@ def update_pupil(pupil_id):
     if photo_path:
         pupil.photo = photo_path
 
+    # The class decides the required fees
+    db.session.flush()
+    refresh_pupil_balances(pupil_ids=[pupil.id])
     db.session.commit()
     return redirect(url_for("secretary_routes.manage_pupils"))
 
@@ -10,7 +10,7 @@ The implementation favors clarity and correctness and avoids N+1 queries by batc
 important database fetches.
 """
 
-from flask import Blueprint, render_template, session, redirect, url_for, flash, request
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, g
 import datetime
 from sqlalchemy import or_, and_
 
@@ -22,10 +22,12 @@ from models.teacher_assignment_models import TeacherAssignment
 from models.marks_model import Subject, Exam, Mark, Report
 
 from routes.teacher_routes import _require_teacher
+from utils.teacher_scope import load_teacher_scope
 from utils.grades import calculate_grade, calculate_general_remark
 
 # Blueprint
 teacher_manage_reports = Blueprint("teacher_manage_reports", __name__, url_prefix="/teacher")
+teacher_manage_reports.before_request(load_teacher_scope)
 
 
 # grading helpers are imported from utils.grades
@@ -42,7 +44,7 @@ def manage_pupils_reports():
         return redirect_resp
 
     # fetch teacher assignments and assigned pupils
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     assigned_pupils = []
     if assignments:
         filters = [and_(Pupil.class_id == a.class_id, Pupil.stream_id == a.stream_id) for a in assignments]
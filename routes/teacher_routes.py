@@ -1,11 +1,12 @@
-from flask import Blueprint, render_template, session, flash, redirect, url_for, request, jsonify
-from models.user_models import User, Role, db
+from flask import Blueprint, render_template, session, flash, redirect, url_for, request, jsonify, g, abort
+from models.user_models import User, db
 from models.class_model import Class
 from models.stream_model import Stream
-from models.teacher_assignment_models import TeacherAssignment
 from models.register_pupils import Pupil
 from models.marks_model import Subject, Exam, Mark, Report
 from utils.grades import calculate_grade, calculate_general_remark
+from utils.timetable_cache import teacher_timetable
+from utils.teacher_scope import load_teacher_scope
 from models.attendance_model import Attendance
 from models.attendance_log import AttendanceLog
 from models.period_confirmation import PeriodConfirmation
@@ -20,16 +21,25 @@ import json
 teacher_routes = Blueprint("teacher_routes", __name__, url_prefix="/teacher")
 
 
+# Resolve the user, role and assignment scope once per request (g.current_user, g.teacher_scope)
+teacher_routes.before_request(load_teacher_scope)
+
+
 def _require_teacher():
-    """Return (teacher, redirect_response) where redirect_response is None when OK."""
-    user_id = session.get("user_id")
-    if not user_id:
+    """Return (teacher, redirect_response) where redirect_response is None when OK.
+
+    The teacher's assignments are in g.teacher_scope.
+    """
+    if not session.get("user_id"):
         flash("You must be logged in to access this page.", "danger")
         return None, redirect(url_for("user_routes.login"))
 
-    teacher = User.query.get_or_404(user_id)
-    role = Role.query.get(teacher.role_id)
-    if not role or role.role_name != "Teacher":
+    if 'teacher_scope' not in g:
+        load_teacher_scope()
+    teacher = g.current_user
+    if teacher is None:
+        abort(404)
+    if g.teacher_scope is None:
         flash("Access denied. Only teachers can view this page.", "danger")
         return None, redirect(url_for("user_routes.login"))
 
@@ -42,7 +52,7 @@ def dashboard():
     if redirect_resp:
         return redirect_resp
 
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
 
     if not assignments:
         return render_template("teacher/no_assignment.html", teacher=teacher)
@@ -80,7 +90,7 @@ def view_timetable():
     if redirect_resp:
         return redirect_resp
 
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     if not assignments:
         flash('You have no class/stream assignment. Contact admin.', 'warning')
         return redirect(url_for('teacher_routes.dashboard'))
@@ -95,14 +105,12 @@ def view_timetable():
     # Each choice links to the admin timetable manager with query params (view-only for teachers).
     choices = []
     for a in assignments:
-        class_obj = Class.query.get(a.class_id)
-        stream_obj = Stream.query.get(a.stream_id)
         choices.append({
             'assignment_id': a.id,
             'class_id': a.class_id,
             'stream_id': a.stream_id,
-            'class_name': class_obj.name if class_obj else f'Class {a.class_id}',
-            'stream_name': stream_obj.name if stream_obj else f'Stream {a.stream_id}'
+            'class_name': a.class_name or f'Class {a.class_id}',
+            'stream_name': a.stream_name or f'Stream {a.stream_id}'
         })
 
     return render_template('teacher/select_assignment.html', teacher=teacher, choices=choices)
@@ -119,27 +127,33 @@ def view_timetable_view(class_id, stream_id):
         return redirect_resp
 
     # Verify assignment exists for this teacher
-    assignment = TeacherAssignment.query.filter_by(teacher_id=teacher.id, class_id=class_id, stream_id=stream_id).first()
-    if not assignment:
+    if not g.teacher_scope.covers(class_id, stream_id):
         flash('Access denied. You are not assigned to the selected class/stream.', 'danger')
         return redirect(url_for('teacher_routes.dashboard'))
 
-    class_obj = Class.query.get(class_id)
-    stream_obj = Stream.query.get(stream_id)
-
-    class_name = class_obj.name if class_obj else f'Class {class_id}'
-    stream_name = stream_obj.name if stream_obj else f'Stream {stream_id}'
+    class_name = g.teacher_scope.class_name(class_id) or f'Class {class_id}'
+    stream_name = g.teacher_scope.stream_name(stream_id) or f'Stream {stream_id}'
 
     return render_template('teacher/view_timetable.html', teacher=teacher, class_id=class_id, stream_id=stream_id, class_name=class_name, stream_name=stream_name)
 
 
+@teacher_routes.route('/timetable/my-week')
+def my_week_timetable():
+    """Return the logged-in teacher's slots across every class and stream as JSON."""
+    teacher, redirect_resp = _require_teacher()
+    if redirect_resp:
+        return redirect_resp
+
+    return jsonify(teacher_timetable(teacher.id))
+
+
 @teacher_routes.route("/pupils_details")
 def pupils_details():
     teacher, redirect_resp = _require_teacher()
     if redirect_resp:
         return redirect_resp
 
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     records = []
     for assignment in assignments:
         pupils = Pupil.query.filter_by(
@@ -210,7 +224,7 @@ def manage_marks():
                 # Otherwise render the template with an error message flashed/returned
                 flash(message, 'danger')
                 # Re-render the page with the form and error message
-                assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+                assignments = g.teacher_scope.assignments
                 records = []
                 for assignment in assignments:
                     pupils = Pupil.query.filter_by(
@@ -306,7 +320,7 @@ def manage_marks():
             "message": "✅ Marks saved successfully!"
         })
 
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     records = []
     for assignment in assignments:
         pupils = Pupil.query.filter_by(
@@ -341,7 +355,7 @@ def generate_report(pupil_id, term, year, exam_name):
     if redirect_resp:
         return redirect_resp
 
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     allowed_pupil_ids = []
     for assignment in assignments:
         pupils = Pupil.query.filter_by(
@@ -570,8 +584,8 @@ def attendance_view():
 
     # GET: render new attendance marking page with all teacher assignments auto-loaded
     if request.method == 'GET':
-        # Fetch teacher assignments with relationships eager-loaded
-        assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+        # Teacher assignments with class/stream names (resolved once per request)
+        assignments = g.teacher_scope.assignments
 
         if not assignments:
             flash('You have no class assignments. Contact admin.', 'warning')
@@ -601,12 +615,8 @@ def attendance_view():
                 stream_id=assignment.stream_id
             ).order_by(Pupil.last_name, Pupil.first_name).all()
 
-            # Get class and stream info once
-            class_obj = Class.query.get(assignment.class_id)
-            stream_obj = Stream.query.get(assignment.stream_id)
-
-            class_name = class_obj.name if class_obj else f"Class {assignment.class_id}"
-            stream_name = stream_obj.name if stream_obj else f"Stream {assignment.stream_id}"
+            class_name = assignment.class_name or f"Class {assignment.class_id}"
+            stream_name = assignment.stream_name or f"Stream {assignment.stream_id}"
 
             # Store stream info
             if assignment.stream_id and assignment.stream_id not in streams_data:
@@ -645,10 +655,8 @@ def attendance_view():
         primary_class_name = ''
         primary_stream_name = ''
         if assignments:
-            primary_class = Class.query.get(assignments[0].class_id)
-            primary_stream = Stream.query.get(assignments[0].stream_id)
-            primary_class_name = primary_class.name if primary_class else f"Class {assignments[0].class_id}"
-            primary_stream_name = primary_stream.name if primary_stream else f"Stream {assignments[0].stream_id}"
+            primary_class_name = assignments[0].class_name or f"Class {assignments[0].class_id}"
+            primary_stream_name = assignments[0].stream_name or f"Stream {assignments[0].stream_id}"
 
         return render_template(
             'teacher/attendance_new.html',
@@ -681,7 +689,7 @@ def attendance_view():
         return (json.dumps({'error': 'Missing required fields: class_id, date, entries'}), 400, {'Content-Type': 'application/json'})
 
     # Validate teacher has permission for this class+stream
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     try:
         stream_id_int = int(stream_id) if stream_id is not None and stream_id != '' else None
     except (ValueError, TypeError):
@@ -834,7 +842,7 @@ def attendance_export():
         return redirect(url_for('teacher_routes.attendance_summary'))
 
     # Permission check
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     if not any(a.class_id == class_id for a in assignments):
         flash('Not authorized to export attendance for this class', 'danger')
         return redirect(url_for('teacher_routes.dashboard'))
@@ -900,8 +908,7 @@ def attendance_export():
 
     # Prepare response
     csv_content = output.getvalue()
-    class_obj = Class.query.get(class_id)
-    class_name = class_obj.name if class_obj else f"Class_{class_id}"
+    class_name = g.teacher_scope.class_name(class_id) or f"Class_{class_id}"
     filename = f"attendance_{class_name}_{start_date.isoformat()}_to_{end_date.isoformat()}.csv"
 
     return (
@@ -952,7 +959,7 @@ def attendance_summary():
         end_date = start_date + timedelta(days=29)
 
     # Permission check
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     if class_id and not any(a.class_id == class_id for a in assignments):
         flash('Not authorized for this class', 'danger')
         return redirect(url_for('teacher_routes.dashboard'))
@@ -974,8 +981,7 @@ def attendance_summary():
         assigned_stream_id = assignments[0].stream_id
 
     if assigned_stream_id:
-        stream_obj = Stream.query.get(assigned_stream_id)
-        assigned_stream_name = stream_obj.name if stream_obj else None
+        assigned_stream_name = g.teacher_scope.stream_name(assigned_stream_id)
 
     # Query pupils for this class and stream
     if assigned_stream_id:
@@ -1051,8 +1057,7 @@ def attendance_summary():
             current += timedelta(days=1)
 
     # Get class info
-    class_obj = Class.query.get(class_id)
-    class_name = class_obj.name if class_obj else f"Class {class_id}"
+    class_name = g.teacher_scope.class_name(class_id) or f"Class {class_id}"
 
     # Check if period is confirmed
     period_confirmed = PeriodConfirmation.query.filter_by(
@@ -1126,7 +1131,7 @@ def attendance_confirm():
         )
 
     # Permission check
-    assignments = TeacherAssignment.query.filter_by(teacher_id=teacher.id).all()
+    assignments = g.teacher_scope.assignments
     if not any(a.class_id == int(class_id) for a in assignments):
         return (
             json.dumps({'error': 'Not authorized for this class'}),
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, redirect, render_template, flash, session, url_for, Response
 from werkzeug.security import check_password_hash
 from models.user_models import db, User, Role, AdminSession
+from utils.admin_sessions import check_admin_session, forget_admin_session, USER_MISSING, MULTI_DEVICE_LOGIN, SESSION_INACTIVE
 from models.salary_models import RoleSalary
 from models.teacher_assignment_models import TeacherAssignment
 from models.register_pupils import Pupil   # ✅ Import pupil model
@@ -70,6 +71,7 @@ def login():
                         old_session.is_active = False
                         db.session.commit()
                         print(f"✅ Invalidated previous admin session: {old_session.session_id[:8]}...")
+                    forget_admin_session(user.active_session_id)
 
                 # Create new admin session
                 new_session_id = secrets.token_urlsafe(32)
@@ -119,8 +121,10 @@ def logout():
                 admin_session.is_active = False
                 db.session.commit()
                 print(f"✅ Admin session deactivated on logout: {admin_session.session_id[:8]}...")
+            ended_session_id = user.active_session_id
             user.active_session_id = None
             db.session.commit()
+            forget_admin_session(ended_session_id)
 
     session.clear()
     flash("You have been logged out.", "info")
@@ -139,14 +143,14 @@ def check_session():
         return {"valid": False, "message": "Not an admin session"}, 401
 
     try:
-        user = User.query.get(user_id)
+        reason = check_admin_session(user_id, client_session_id)
 
         # Check if user exists
-        if not user:
+        if reason == USER_MISSING:
             return {"valid": False, "message": "User account deleted"}, 401
 
         # ✅ KEY CHECK: Compare client session ID with DB's active session ID
-        if user.active_session_id != client_session_id:
+        if reason == MULTI_DEVICE_LOGIN:
             return {
                 "valid": False,
                 "message": "Session conflict - logged in from another device",
@@ -154,12 +158,7 @@ def check_session():
             }, 401
 
         # Check if session is still active in DB
-        admin_session = AdminSession.query.filter_by(
-            session_id=client_session_id,
-            user_id=user_id
-        ).first()
-
-        if not admin_session or not admin_session.is_active:
+        if reason == SESSION_INACTIVE:
             return {
                 "valid": False,
                 "message": "Session inactive - logged in from another device",
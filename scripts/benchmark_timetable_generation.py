@@ -0,0 +1,261 @@
+"""
+Benchmark timetable generation against a local Postgres database.
+
+Seeds a throwaway database with synthetic schools, then measures
+
+  - whole-school generation (admin_routes._solve_whole_school)
+  - single-stream generation (admin_routes._generate_timetable_core)
+
+recording wall time, number of SQL statements and peak Python memory
+(tracemalloc) for each. Results are compared with the stored baseline in
+scripts/benchmark_timetable_baseline.json and the script exits with status 1
+if any metric regresses beyond its tolerance.
+
+The database is WIPED (schema public is dropped and recreated), so it must
+be a dedicated one and is read from BENCHMARK_DATABASE_URL, never from
+DATABASE_URL. Only local hosts are accepted unless --allow-remote is given.
+
+Usage:
+  BENCHMARK_DATABASE_URL=postgresql://postgres@localhost/timetable_bench \\
+      python scripts/benchmark_timetable_generation.py
+  python scripts/benchmark_timetable_generation.py --schools small,medium --repeat 5
+  python scripts/benchmark_timetable_generation.py --update-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_timetable_baseline.json')
+
+# name -> (classes, streams per class, teachers, subjects)
+SCHOOLS = {
+    'small': (4, 2, 14, 8),
+    'medium': (7, 4, 42, 10),
+    'large': (7, 8, 84, 12),
+}
+
+# Allowed growth over the baseline before a run counts as a regression.
+# Statement counts are deterministic, so any increase is reported.
+TOLERANCE = {
+    'seconds': 0.50,
+    'statements': 0.0,
+    'peak_kb': 0.25,
+}
+
+SUBJECTS_PER_TEACHER = 3
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--schools', default='small,medium,large',
+                        help=f"comma-separated school sizes ({', '.join(SCHOOLS)})")
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario; the fastest is kept')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--allow-remote', action='store_true', help='allow a non-local BENCHMARK_DATABASE_URL')
+    return parser.parse_args()
+
+
+def database_url(allow_remote):
+    url = os.getenv('BENCHMARK_DATABASE_URL')
+    if not url:
+        sys.exit('Set BENCHMARK_DATABASE_URL to a dedicated local Postgres database (it will be wiped).')
+    parsed = urlparse(url)
+    if not parsed.scheme.startswith('postgresql'):
+        sys.exit('BENCHMARK_DATABASE_URL must be a postgresql:// URL')
+    host = parsed.hostname or ''
+    if host not in ('', 'localhost', '127.0.0.1', '::1') and not allow_remote:
+        sys.exit(f'Refusing to wipe non-local database host {host!r}; pass --allow-remote to override.')
+    if url == os.getenv('DATABASE_URL'):
+        sys.exit('BENCHMARK_DATABASE_URL must not be the application database.')
+    return url
+
+
+# App imports happen after DATABASE_URL is pointed at the benchmark database
+def load_app(url):
+    os.environ['DATABASE_URL'] = url
+    os.chdir(ROOT)
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+def reset_schema(db):
+    """Drop everything and recreate the tables, generated columns and constraints."""
+    from sqlalchemy import text
+    import models.register_pupils, models.salary_models, models.staff_models  # noqa: F401
+    import models.expenses_model, models.system_settings, models.timetable_model  # noqa: F401
+
+    db.session.execute(text('DROP SCHEMA public CASCADE; CREATE SCHEMA public;'))
+    db.session.commit()
+    db.create_all()
+    # time_range and the exclusion constraints come from Alembic (0010, 0013)
+    db.session.execute(text(
+        "ALTER TABLE timetable_slots ADD COLUMN time_range int4range GENERATED ALWAYS AS (int4range("
+        "CAST(substr(start_time, 1, 2) AS integer) * 60 + CAST(substr(start_time, 4, 2) AS integer), "
+        "CAST(substr(end_time, 1, 2) AS integer) * 60 + CAST(substr(end_time, 4, 2) AS integer))) STORED"
+    ))
+    db.session.commit()
+    try:
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+        db.session.execute(text(
+            'ALTER TABLE timetable_slots ADD CONSTRAINT no_teacher_overlap EXCLUDE USING gist '
+            '(teacher_id WITH =, day_of_week WITH =, time_range WITH &&)'
+        ))
+        db.session.execute(text(
+            "ALTER TABLE timetable_slots ADD CONSTRAINT no_classroom_overlap EXCLUDE USING gist "
+            "(btrim(classroom) WITH =, day_of_week WITH =, time_range WITH &&) "
+            "WHERE (classroom IS NOT NULL AND btrim(classroom) <> '')"
+        ))
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        return False
+
+
+def seed_school(db, classes, streams, teachers, subjects, seed=0):
+    """Insert a school: teachers with three subjects each, one class teacher per stream."""
+    from models.user_models import User, Role
+    from models.class_model import Class
+    from models.stream_model import Stream
+    from models.marks_model import Subject
+    from models.teacher_assignment_models import TeacherAssignment, TeacherSubject
+
+    rng = random.Random(seed)
+    role = Role(role_name='Teacher')
+    db.session.add(role)
+    db.session.flush()
+    teacher_rows = [User(first_name=f'Teacher{i:03d}', last_name='Bench', email=f'teacher{i}@bench.local',
+                         password='x', role_id=role.id) for i in range(teachers)]
+    class_rows = [Class(name=f'P{i + 1}') for i in range(classes)]
+    stream_rows = [Stream(name=chr(ord('A') + i)) for i in range(streams)]
+    subject_rows = [Subject(name=f'Subject {i + 1}') for i in range(subjects)]
+    db.session.add_all(teacher_rows + class_rows + stream_rows + subject_rows)
+    db.session.flush()
+
+    subject_ids = [s.id for s in subject_rows]
+    db.session.bulk_insert_mappings(TeacherSubject, [
+        {'teacher_id': t.id, 'subject_id': s}
+        for t in teacher_rows for s in rng.sample(subject_ids, min(SUBJECTS_PER_TEACHER, len(subject_ids)))
+    ])
+    owners = [(c.id, s.id) for c in class_rows for s in stream_rows]
+    db.session.bulk_insert_mappings(TeacherAssignment, [
+        {'teacher_id': teacher_rows[i % len(teacher_rows)].id, 'class_id': c, 'stream_id': s}
+        for i, (c, s) in enumerate(owners)
+    ])
+    db.session.commit()
+    return owners
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def measure(db, counter, fn, repeat):
+    """Run fn `repeat` times; keep the fastest time and the largest statement count and peak."""
+    best = {'seconds': None, 'statements': 0, 'peak_kb': 0}
+    for _ in range(repeat):
+        db.session.remove()
+        counter.count = 0
+        tracemalloc.start()
+        started = time.perf_counter()
+        ok, payload = fn()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if not ok:
+            raise RuntimeError(f'Generation failed: {payload}')
+        best['seconds'] = elapsed if best['seconds'] is None else min(best['seconds'], elapsed)
+        best['statements'] = max(best['statements'], counter.count)
+        best['peak_kb'] = max(best['peak_kb'], peak // 1024)
+    best['seconds'] = round(best['seconds'], 4)
+    return best
+
+
+def compare(results, baseline):
+    """Return a list of human-readable regressions."""
+    regressions = []
+    for scenario, metrics in results.items():
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        for metric, tolerance in TOLERANCE.items():
+            if metric not in expected:
+                continue
+            limit = expected[metric] * (1 + tolerance)
+            if metrics[metric] > limit:
+                regressions.append(f'{scenario}: {metric} {metrics[metric]} > baseline {expected[metric]} (+{int(tolerance * 100)}%)')
+    return regressions
+
+
+def main():
+    args = parse_args()
+    names = [n.strip() for n in args.schools.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCHOOLS]
+    if unknown:
+        sys.exit(f"Unknown school size(s): {', '.join(unknown)}")
+
+    app = load_app(database_url(args.allow_remote))
+    from models.user_models import db
+    from routes.admin_routes import _solve_whole_school, _generate_timetable_core
+
+    results = {}
+    print(f"{'scenario':<22} {'streams':>7} {'time (ms)':>10} {'statements':>10} {'peak (KiB)':>10}")
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+        for name in names:
+            classes, streams, teachers, subjects = SCHOOLS[name]
+            constraints = reset_schema(db)
+            owners = seed_school(db, classes, streams, teachers, subjects)
+
+            scenarios = [
+                (f'{name}/whole-school', lambda: _solve_whole_school()),
+                (f'{name}/single-stream', lambda: _generate_timetable_core(*owners[len(owners) // 2])),
+            ]
+            for scenario, fn in scenarios:
+                metrics = measure(db, counter, fn, args.repeat)
+                results[scenario] = metrics
+                print(f"{scenario:<22} {len(owners):>7} {metrics['seconds'] * 1000:>10.1f} "
+                      f"{metrics['statements']:>10} {metrics['peak_kb']:>10}")
+            if not constraints:
+                print('  (btree_gist unavailable: exclusion constraints not installed for this run)')
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline written to {BASELINE_PATH}')
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print('No baseline stored yet; run with --update-baseline to create one.')
+        return 0
+    with open(BASELINE_PATH) as f:
+        regressions = compare(results, json.load(f))
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Benchmark the whole-school timetable solver on synthetic schools.
+
+Runs entirely in memory (no database needed) and checks every solution for
+teacher and stream double-booking.
+
+Usage:
+  python scripts/benchmark_timetable_solver.py                # 20, 50 and 100 streams
+  python scripts/benchmark_timetable_solver.py 200 400        # custom stream counts
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.timetable_solver import solve_timetable  # noqa: E402
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+# Mirrors admin_routes._lesson_times(): 40-minute lessons with a 10:00 break and 13:00 lunch
+TIMES = [('08:00', '08:40'), ('08:40', '09:20'), ('09:20', '10:00'), ('10:20', '11:00'),
+         ('11:00', '11:40'), ('11:40', '12:20'), ('12:20', '13:00'), ('13:40', '14:20'),
+         ('14:20', '15:00'), ('15:00', '15:40'), ('15:40', '16:20'), ('16:20', '17:00')]
+SUBJECTS = 8
+STREAMS_PER_CLASS = 4
+
+
+def build_school(stream_count, seed=0):
+    """Return solver inputs for a school with `stream_count` class/streams.
+
+    Teachers outnumber streams by 20% and each is qualified for three
+    random subjects, which is tighter than a real primary school.
+    """
+    rng = random.Random(seed)
+    owners = [(i // STREAMS_PER_CLASS + 1, i % STREAMS_PER_CLASS + 1) for i in range(stream_count)]
+    teachers = list(range(1, int(stream_count * 1.2) + 2))
+    subjects = list(range(1, SUBJECTS + 1))
+    qualifications = {s: set() for s in subjects}
+    for teacher_id in teachers:
+        for subject_id in rng.sample(subjects, 3):
+            qualifications[subject_id].add(teacher_id)
+    class_teachers = {owner: teachers[i] for i, owner in enumerate(owners)}
+    periods = [(day, start, end) for day in DAYS for start, end in TIMES]
+    return owners, teachers, subjects, periods, class_teachers, qualifications
+
+
+def check(slots):
+    """Raise if any teacher or stream is booked twice in one period."""
+    teacher_keys = {(s['teacher_id'], s['day_of_week'], s['start_time']) for s in slots}
+    stream_keys = {(s['class_id'], s['stream_id'], s['day_of_week'], s['start_time']) for s in slots}
+    if len(teacher_keys) != len(slots) or len(stream_keys) != len(slots):
+        raise AssertionError('Solution contains a double booking')
+
+
+def run(stream_count):
+    owners, teachers, subjects, periods, class_teachers, qualifications = build_school(stream_count)
+    started = time.perf_counter()
+    ok, result = solve_timetable(owners, teachers, subjects, periods,
+                                 class_teachers=class_teachers, qualifications=qualifications)
+    elapsed = time.perf_counter() - started
+    if ok:
+        check(result['slots'])
+        stats = result['stats']
+        print(f"{stream_count:>7} {len(teachers):>8} {stats['lessons']:>8} {elapsed * 1000:>10.1f}  ok")
+    else:
+        print(f"{stream_count:>7} {len(teachers):>8} {'-':>8} {elapsed * 1000:>10.1f}  unsatisfiable")
+        for conflict in result['conflicts']:
+            print(f"          - {conflict}")
+    return ok
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [20, 50, 100]
+    print(f"{'streams':>7} {'teachers':>8} {'lessons':>8} {'time (ms)':>10}")
+    results = [run(n) for n in sizes]
+    sys.exit(0 if all(results) else 1)
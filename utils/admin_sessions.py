@@ -0,0 +1,85 @@
+"""
+Cached admin session validation.
+
+Every admin page view used to load the User, load the AdminSession and
+commit a new last_activity: three round trips and a write per request.
+check_admin_session() validates with one query joining the user to the
+session row. When REDIS_URL is set, a successful check is also cached in
+Redis for SESSION_CACHE_TTL seconds. Without Redis nothing is cached: a
+per-process cache could only be cleared in the worker that ended the
+session.
+
+last_activity is written at most once per ACTIVITY_FLUSH_SECONDS per
+session: the first request in each window wins an add-if-absent marker and
+issues a single UPDATE by session_id, so the column is at most that many
+seconds behind.
+
+login and logout call forget_admin_session() for every token they
+deactivate. This drops the shared entry, so a session ended on one device is
+refused on the next request in every worker. Changes made outside those
+paths (deleting the user) take effect once the cached entry expires.
+"""
+import os
+from datetime import datetime
+
+from models.user_models import db, User, AdminSession
+from sqlalchemy import and_
+from utils.cache_utils import cache_get, cache_set, cache_add, cache_delete, get_cache_redis
+
+SESSION_CACHE_TTL = int(os.getenv('ADMIN_SESSION_CACHE_SECONDS', '30'))
+ACTIVITY_FLUSH_SECONDS = int(os.getenv('ADMIN_SESSION_ACTIVITY_SECONDS', '60'))
+
+# Reasons returned by check_admin_session()
+USER_MISSING = 'user_missing'
+MULTI_DEVICE_LOGIN = 'multi_device_login'
+SESSION_INACTIVE = 'session_inactive'
+
+
+def _valid_key(token):
+    return f"admin_session:{token}"
+
+
+def _activity_key(token):
+    return f"admin_session:{token}:activity"
+
+
+def check_admin_session(user_id, token):
+    """None if `token` is the active admin session of `user_id`, else the reason it is not."""
+    shared = get_cache_redis() is not None
+    if shared and cache_get(_valid_key(token)) == user_id:
+        return None
+
+    row = db.session.query(User.active_session_id, AdminSession.is_active)\
+        .outerjoin(AdminSession, and_(AdminSession.session_id == token, AdminSession.user_id == User.id))\
+        .filter(User.id == user_id).first()
+    if row is None:
+        return USER_MISSING
+    active_session_id, is_active = row
+    if active_session_id != token:
+        return MULTI_DEVICE_LOGIN
+    if not is_active:
+        return SESSION_INACTIVE
+    if shared:
+        cache_set(_valid_key(token), user_id, ttl=SESSION_CACHE_TTL)
+    return None
+
+
+def touch_admin_session(token):
+    """Record activity on the session, writing at most once per ACTIVITY_FLUSH_SECONDS."""
+    if not cache_add(_activity_key(token), 1, ttl=ACTIVITY_FLUSH_SECONDS):
+        return False
+    try:
+        AdminSession.query.filter(AdminSession.session_id == token)\
+            .update({AdminSession.last_activity: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        cache_delete(_activity_key(token))
+        raise
+    return True
+
+
+def forget_admin_session(*tokens):
+    """Drop cached validity for sessions that were just deactivated."""
+    tokens = [t for t in tokens if t]
+    cache_delete(*[_valid_key(t) for t in tokens], *[_activity_key(t) for t in tokens])
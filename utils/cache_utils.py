@@ -0,0 +1,192 @@
+"""
+Small JSON cache for read-heavy endpoints.
+
+Uses Redis when REDIS_URL is set, so entries and invalidations are shared by
+every worker. Without Redis it falls back to a process-local dict with the
+same TTLs; invalidations then only reach the current process, so keep TTLs
+short for data that other workers may change.
+
+Version counters (get_version / bump_version) suit data written from many
+places: readers put the current version in their cache key, writers bump
+it, and the old entries are simply never read again and expire.
+track_commits() bumps or invalidates once the ORM writes that matter have
+committed, so no reader caches old rows under a new version.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = int(os.getenv('CACHE_TTL_SECONDS', '300'))
+
+_local = {}  # key -> (expires_at, json string)
+_local_versions = {}  # name -> int
+_local_lock = threading.Lock()
+_redis_client = None
+_redis_checked = False
+
+
+def get_cache_redis():
+    """Return a shared Redis client if REDIS_URL is configured, else None."""
+    global _redis_client, _redis_checked
+    if _redis_checked:
+        return _redis_client
+    _redis_checked = True
+    url = os.getenv('REDIS_URL')
+    if redis is None or not url:
+        return None
+    try:
+        _redis_client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    except Exception as e:
+        logger.warning(f"[CACHE] Could not create Redis client, using in-process cache: {e}")
+        _redis_client = None
+    return _redis_client
+
+
+def cache_get(key):
+    """Return the cached value for key, or None on a miss."""
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            raw = r.get(key)
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis get failed for {key}: {e}")
+            return None
+
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        expires_at, raw = entry
+        if expires_at < time.monotonic():
+            del _local[key]
+            return None
+    return json.loads(raw)
+
+
+def cache_set(key, value, ttl=DEFAULT_TTL):
+    """Store a JSON-serialisable value under key for ttl seconds."""
+    raw = json.dumps(value, default=str)
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            r.set(key, raw, ex=ttl)
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis set failed for {key}: {e}")
+        return
+
+    with _local_lock:
+        _local[key] = (time.monotonic() + ttl, raw)
+
+
+def cache_add(key, value, ttl=DEFAULT_TTL):
+    """Store value only if key is absent or expired. Returns True if it was stored."""
+    raw = json.dumps(value, default=str)
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            return bool(r.set(key, raw, ex=ttl, nx=True))
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis add failed for {key}: {e}")
+            return False
+
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None and entry[0] >= now:
+            return False
+        _local[key] = (now + ttl, raw)
+        return True
+
+
+def cache_delete(*keys):
+    """Remove keys from the cache (missing keys are ignored)."""
+    if not keys:
+        return
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            r.delete(*keys)
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis delete failed for {keys}: {e}")
+        return
+
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+def _version_key(name):
+    return f"version:{name}"
+
+
+def get_version(name):
+    """Current value of a version counter (0 if never bumped)."""
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            raw = r.get(_version_key(name))
+            return int(raw) if raw is not None else 0
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis version read failed for {name}: {e}")
+    with _local_lock:
+        return _local_versions.get(name, 0)
+
+
+def bump_version(name):
+    """Increment a version counter, orphaning every entry keyed on the old value."""
+    r = get_cache_redis()
+    if r is not None:
+        try:
+            return int(r.incr(_version_key(name)))
+        except Exception as e:
+            logger.debug(f"[CACHE] Redis version bump failed for {name}: {e}")
+    with _local_lock:
+        _local_versions[name] = _local_versions.get(name, 0) + 1
+        return _local_versions[name]
+
+
+_tracked = set()  # names already registered with track_commits()
+
+
+def track_commits(session, name, collect, on_commit):
+    """Call on_commit(items) after each commit whose flushes collected anything.
+
+    After every flush, collect(session, objects) gets the flushed objects
+    (new, dirty and deleted) and returns the items to remember, e.g. ids
+    or a single marker. They accumulate in session.info until the
+    transaction commits, when on_commit receives the set, or rolls back,
+    when they are dropped. Registering the same name twice is a no-op.
+    """
+    if name in _tracked:
+        return
+    _tracked.add(name)
+    info_key = f'tracked_commits:{name}'
+
+    def after_flush(sess, flush_context):
+        items = collect(sess, list(sess.new) + list(sess.dirty) + list(sess.deleted))
+        if items:
+            sess.info.setdefault(info_key, set()).update(items)
+
+    def after_commit(sess):
+        items = sess.info.pop(info_key, None)
+        if items:
+            on_commit(items)
+
+    def after_rollback(sess):
+        sess.info.pop(info_key, None)
+
+    event.listen(session, 'after_flush', after_flush)
+    event.listen(session, 'after_commit', after_commit)
+    event.listen(session, 'after_rollback', after_rollback)
@@ -0,0 +1,133 @@
+"""
+Expense listing and totals computed in SQL.
+
+The expenses page used to load every ExpenseRecord and add the amounts up
+in Python, and its date filter wrapped the column in func.date(), which no
+index can serve. Date filters here are half-open timestamp ranges
+(payment_date >= start AND payment_date < end) so they use
+ix_expense_records_date_item (payment_date, item_id); totals and the
+per-category / per-month breakdowns are SUM ... GROUP BY queries; and the
+record list is paged by keyset on (payment_date, id), newest first, so a
+page costs the same however far back it is.
+"""
+from datetime import datetime, timedelta
+
+from models.user_models import db
+from models.expenses_model import ExpenseItem, ExpenseRecord
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+def _day_range(value):
+    start = datetime.fromisoformat(value)
+    start = datetime(start.year, start.month, start.day)
+    return start, start + timedelta(days=1)
+
+
+def _month_range(value):
+    start = datetime.strptime(value, '%Y-%m')
+    end = datetime(start.year + 1, 1, 1) if start.month == 12 else datetime(start.year, start.month + 1, 1)
+    return start, end
+
+
+def expense_filters(term=None, year=None, day=None, month=None, item_id=None):
+    """WHERE conditions for the expense queries.
+
+    `day` is YYYY-MM-DD and `month` YYYY-MM; both become half-open ranges
+    on payment_date. Unparseable values are ignored, as the page always did.
+    """
+    conditions = []
+    if term:
+        conditions.append(ExpenseRecord.term == term)
+    if year:
+        try:
+            conditions.append(ExpenseRecord.year == int(year))
+        except (TypeError, ValueError):
+            pass
+    for value, to_range in ((day, _day_range), (month, _month_range)):
+        if not value:
+            continue
+        try:
+            start, end = to_range(value)
+        except ValueError:
+            continue
+        conditions.append(ExpenseRecord.payment_date >= start)
+        conditions.append(ExpenseRecord.payment_date < end)
+    if item_id:
+        conditions.append(ExpenseRecord.item_id == int(item_id))
+    return conditions
+
+
+def expense_totals(conditions):
+    """(total spent, number of records, number of distinct items) in one query."""
+    total, count, items = db.session.query(
+        func.coalesce(func.sum(ExpenseRecord.amount), 0),
+        func.count(ExpenseRecord.id),
+        func.count(func.distinct(ExpenseRecord.item_id)),
+    ).filter(*conditions).one()
+    return float(total), int(count), int(items)
+
+
+def expenses_by_category(conditions):
+    """Rows of (item_id, name, total, count), largest total first."""
+    name = func.coalesce(ExpenseItem.name, 'Other')
+    return db.session.query(
+        ExpenseRecord.item_id,
+        name.label('name'),
+        func.sum(ExpenseRecord.amount).label('total'),
+        func.count(ExpenseRecord.id).label('count'),
+    ).outerjoin(ExpenseItem, ExpenseItem.id == ExpenseRecord.item_id)\
+     .filter(*conditions)\
+     .group_by(ExpenseRecord.item_id, name)\
+     .order_by(func.sum(ExpenseRecord.amount).desc(), name).all()
+
+
+def expenses_by_month(conditions):
+    """Rows of (month, total, count), newest month first; month is a datetime on the 1st."""
+    month = func.date_trunc('month', ExpenseRecord.payment_date)
+    return db.session.query(
+        month.label('month'),
+        func.sum(ExpenseRecord.amount).label('total'),
+        func.count(ExpenseRecord.id).label('count'),
+    ).filter(*conditions)\
+     .group_by(month).order_by(month.desc()).all()
+
+
+def encode_cursor(record):
+    return f"{record.payment_date.isoformat()}_{record.id}"
+
+
+def decode_cursor(cursor):
+    """(payment_date, id) from a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        stamp, _, record_id = cursor.rpartition('_')
+        return datetime.fromisoformat(stamp), int(record_id)
+    except ValueError:
+        return None
+
+
+def expense_page(conditions, before=None, per_page=DEFAULT_PER_PAGE):
+    """One page of records older than the `before` cursor, newest first.
+
+    Returns (records, next_cursor); next_cursor is None on the last page.
+    """
+    per_page = max(1, min(int(per_page or DEFAULT_PER_PAGE), MAX_PER_PAGE))
+    query = ExpenseRecord.query.options(joinedload(ExpenseRecord.item))\
+        .filter(*conditions)
+    position = decode_cursor(before)
+    if position is not None:
+        # The plain bound lets the planner range-scan the payment_date index
+        query = query.filter(
+            ExpenseRecord.payment_date <= position[0],
+            tuple_(ExpenseRecord.payment_date, ExpenseRecord.id) < position,
+        )
+    records = query.order_by(ExpenseRecord.payment_date.desc(), ExpenseRecord.id.desc())\
+        .limit(per_page + 1).all()
+    if len(records) > per_page:
+        return records[:per_page], encode_cursor(records[per_page - 1])
+    return records, None
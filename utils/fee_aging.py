@@ -0,0 +1,182 @@
+"""
+Fee arrears aging.
+
+The amount owed is the balance the fees pages already show: the pupil's
+overall pupil_balances row (utils.pupil_balances), i.e. the class fee total
+less completed payments, never below zero. The class fee is one obligation,
+due from the term the pupil was admitted in (the earliest started term that
+ends on or after the admission date), and the whole balance is aged from
+there: its age is that term's position counting back from the latest term
+started by `as_of` (ROW_NUMBER() OVER (ORDER BY start_date DESC)), so 0 is
+current, 1 is one term overdue and so on. A pupil admitted after the last
+started term is current. Everything up to the per class/stream buckets
+happens in one statement; nothing is summed in Python.
+
+The XLSX export writes the class/stream summary and then one row per owing
+pupil with xlsxwriter in constant_memory mode, reading the pupil rows in
+batches (yield_per), so memory does not grow with the number of pupils.
+"""
+import os
+import tempfile
+from datetime import date
+
+import xlsxwriter
+
+from models.user_models import db
+from models.class_model import Class
+from models.stream_model import Stream
+from models.term_model import Term
+from models.register_pupils import Pupil, PupilBalance
+from sqlalchemy import select, func, case, and_
+from utils.pupil_balances import ALL_YEARS, ALL_TERMS
+
+BUCKETS = (
+    ('current', 'Current'),
+    ('overdue_1', '1 term'),
+    ('overdue_2', '2 terms'),
+    ('overdue_3_plus', '3+ terms'),
+)
+BATCH_SIZE = 1000
+
+
+def _outstanding_by_pupil(as_of, class_id=None, stream_id=None):
+    """Subquery with one row per pupil: pupil_id, class_id, stream_id, age, outstanding."""
+    billed = select(
+        Term.end_date,
+        (func.row_number().over(order_by=(Term.start_date.desc(), Term.id.desc())) - 1).label('age'),
+    ).where(Term.start_date <= as_of).subquery('billed')
+
+    aging = select(
+        Pupil.id.label('pupil_id'),
+        Pupil.class_id,
+        Pupil.stream_id,
+        # The oldest term the pupil was enrolled for has the highest age
+        func.coalesce(func.max(billed.c.age), 0).label('age'),
+        func.greatest(PupilBalance.balance, 0).label('outstanding'),
+    ).join(PupilBalance, and_(
+        PupilBalance.pupil_id == Pupil.id,
+        PupilBalance.year == ALL_YEARS,
+        PupilBalance.term == ALL_TERMS,
+    )).outerjoin(billed, billed.c.end_date >= Pupil.admission_date)\
+      .group_by(Pupil.id, Pupil.class_id, Pupil.stream_id, PupilBalance.balance)
+    if class_id:
+        aging = aging.where(Pupil.class_id == int(class_id))
+    if stream_id:
+        aging = aging.where(Pupil.stream_id == int(stream_id))
+    return aging.subquery('aging')
+
+
+def _bucket_columns(aging):
+    def bucket(condition):
+        return func.coalesce(func.sum(case((condition, aging.c.outstanding), else_=0)), 0)
+    return (
+        bucket(aging.c.age == 0).label('current'),
+        bucket(aging.c.age == 1).label('overdue_1'),
+        bucket(aging.c.age == 2).label('overdue_2'),
+        bucket(aging.c.age >= 3).label('overdue_3_plus'),
+        func.coalesce(func.sum(aging.c.outstanding), 0).label('total'),
+    )
+
+
+def aging_by_class(as_of=None, class_id=None, stream_id=None):
+    """Arrears buckets per class and stream, ordered by class then stream name.
+
+    Rows carry: class_id, class_name, stream_id, stream_name, pupils (number
+    owing), current, overdue_1, overdue_2, overdue_3_plus and total.
+    """
+    aging = _outstanding_by_pupil(as_of or date.today(), class_id, stream_id)
+    return db.session.query(
+        aging.c.class_id,
+        Class.name.label('class_name'),
+        aging.c.stream_id,
+        Stream.name.label('stream_name'),
+        func.count(func.distinct(case((aging.c.outstanding > 0, aging.c.pupil_id)))).label('pupils'),
+        *_bucket_columns(aging),
+    ).outerjoin(Class, Class.id == aging.c.class_id)\
+     .outerjoin(Stream, Stream.id == aging.c.stream_id)\
+     .group_by(aging.c.class_id, Class.name, aging.c.stream_id, Stream.name)\
+     .having(func.sum(aging.c.outstanding) > 0)\
+     .order_by(Class.name, Stream.name)
+
+
+def aging_by_pupil(as_of=None, class_id=None, stream_id=None):
+    """Arrears buckets per owing pupil, ordered like aging_by_class()."""
+    aging = _outstanding_by_pupil(as_of or date.today(), class_id, stream_id)
+    return db.session.query(
+        Pupil.id,
+        Pupil.admission_number,
+        Pupil.first_name,
+        Pupil.last_name,
+        Class.name.label('class_name'),
+        Stream.name.label('stream_name'),
+        *_bucket_columns(aging),
+    ).join(Pupil, Pupil.id == aging.c.pupil_id)\
+     .outerjoin(Class, Class.id == aging.c.class_id)\
+     .outerjoin(Stream, Stream.id == aging.c.stream_id)\
+     .group_by(Pupil.id, Pupil.admission_number, Pupil.first_name, Pupil.last_name, Class.name, Stream.name)\
+     .having(func.sum(aging.c.outstanding) > 0)\
+     .order_by(Class.name, Stream.name, Pupil.first_name, Pupil.last_name, Pupil.id)
+
+
+def totals(rows):
+    """Column totals for the class/stream summary."""
+    keys = ('pupils',) + tuple(key for key, _ in BUCKETS) + ('total',)
+    return {key: sum(getattr(row, key) or 0 for row in rows) for key in keys}
+
+
+def export_aging_xlsx(as_of=None, class_id=None, stream_id=None):
+    """Write the summary and per-pupil sheets to a temporary XLSX file and return its path.
+
+    Stream it to the client with utils.timetable_export.stream_file(), which
+    deletes the file afterwards.
+    """
+    as_of = as_of or date.today()
+    handle, path = tempfile.mkstemp(suffix='.xlsx', prefix='arrears_')
+    os.close(handle)
+
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        title_fmt = workbook.add_format({'bold': True, 'font_size': 13})
+        header_fmt = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1})
+        money_fmt = workbook.add_format({'num_format': '#,##0', 'border': 1})
+        text_fmt = workbook.add_format({'border': 1})
+        total_fmt = workbook.add_format({'bold': True, 'num_format': '#,##0', 'top': 2})
+        labels = [label for _, label in BUCKETS] + ['Total']
+
+        summary = workbook.add_worksheet('By class')
+        summary.set_column(0, 1, 16)
+        summary.set_column(2, 2, 10)
+        summary.set_column(3, 7, 14)
+        summary.write(0, 0, f'Fee arrears as of {as_of:%d/%m/%Y}', title_fmt)
+        summary.write_row(2, 0, ['Class', 'Stream', 'Pupils'] + labels, header_fmt)
+        rows = aging_by_class(as_of, class_id, stream_id).all()
+        row_index = 3
+        for row in rows:
+            summary.write(row_index, 0, row.class_name or 'N/A', text_fmt)
+            summary.write(row_index, 1, row.stream_name or 'N/A', text_fmt)
+            summary.write(row_index, 2, row.pupils, text_fmt)
+            summary.write_row(row_index, 3, [float(getattr(row, key)) for key, _ in BUCKETS] + [float(row.total)], money_fmt)
+            row_index += 1
+        grand = totals(rows)
+        summary.write(row_index, 0, 'Total', total_fmt)
+        summary.write(row_index, 2, grand['pupils'], total_fmt)
+        summary.write_row(row_index, 3, [float(grand[key]) for key, _ in BUCKETS] + [float(grand['total'])], total_fmt)
+
+        pupils = workbook.add_worksheet('By pupil')
+        pupils.set_column(0, 0, 14)
+        pupils.set_column(1, 3, 18)
+        pupils.set_column(4, 8, 14)
+        pupils.write_row(0, 0, ['Admission No.', 'Name', 'Class', 'Stream'] + labels, header_fmt)
+        row_index = 1
+        for row in aging_by_pupil(as_of, class_id, stream_id).yield_per(BATCH_SIZE):
+            pupils.write_row(row_index, 0, [
+                row.admission_number, f'{row.first_name} {row.last_name}', row.class_name or 'N/A', row.stream_name or 'N/A'
+            ], text_fmt)
+            pupils.write_row(row_index, 4, [float(getattr(row, key)) for key, _ in BUCKETS] + [float(row.total)], money_fmt)
+            row_index += 1
+
+        workbook.close()
+    except Exception:
+        os.remove(path)
+        raise
+    return path
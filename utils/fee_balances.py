@@ -0,0 +1,141 @@
+"""
+Pupil fee balances computed in SQL.
+
+The bursar listings used to load every pupil with all of their payments and
+add up `Pupil.total_required` / `total_paid` in Python, which also ran one
+class_fees_structure query per pupil. Here a single grouped query joins
+pupils to the summed fee structure of their class and to the summed
+completed payments for an optional (year, term), so filtering, sorting by
+balance and pagination all happen in the database.
+"""
+from models.user_models import db
+from models.class_model import Class
+from models.stream_model import Stream
+from models.register_pupils import Pupil, ClassFeeStructure, Payment
+from sqlalchemy import func, case, or_, select
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+SORTS = ('name', 'class', 'balance_desc', 'balance_asc')
+
+
+def _order_by(sort, balance):
+    if sort == 'balance_desc':
+        return (balance.desc(), Pupil.id.asc())
+    if sort == 'balance_asc':
+        return (balance.asc(), Pupil.id.asc())
+    if sort == 'class':
+        return (Class.name.asc(), Stream.name.asc(), Pupil.first_name.asc(), Pupil.id.asc())
+    return (Pupil.first_name.asc(), Pupil.last_name.asc(), Pupil.id.asc())
+
+
+def _period_filters(year=None, term=None):
+    filters = []
+    if year:
+        filters.append(Payment.year == int(year))
+    if term:
+        filters.append(Payment.term == term)
+    return filters
+
+
+def fee_balance_query(year=None, term=None, search=None, class_id=None, stream_id=None,
+                      status=None, with_payments_only=False, sort='name'):
+    """Build the grouped balance query.
+
+    Rows carry: id, first_name, last_name, admission_number, class_id,
+    class_name, stream_name, total_required, total_paid, balance and
+    payment_count. `status` is 'owing' (balance > 0), 'cleared'
+    (balance <= 0) or None for everyone.
+    """
+    required = select(
+        ClassFeeStructure.class_id,
+        func.sum(ClassFeeStructure.amount).label('required')
+    ).group_by(ClassFeeStructure.class_id).subquery('required')
+
+    paid = select(
+        Payment.pupil_id,
+        func.sum(case((Payment.status == 'completed', Payment.amount_paid), else_=0)).label('paid'),
+        func.count(Payment.id).label('payment_count')
+    ).where(*_period_filters(year, term)).group_by(Payment.pupil_id).subquery('paid')
+
+    total_required = func.coalesce(required.c.required, 0)
+    total_paid = func.coalesce(paid.c.paid, 0)
+    balance = total_required - total_paid
+
+    query = db.session.query(
+        Pupil.id,
+        Pupil.first_name,
+        Pupil.last_name,
+        Pupil.admission_number,
+        Pupil.class_id,
+        Class.name.label('class_name'),
+        Stream.name.label('stream_name'),
+        total_required.label('total_required'),
+        total_paid.label('total_paid'),
+        balance.label('balance'),
+        func.coalesce(paid.c.payment_count, 0).label('payment_count'),
+    ).outerjoin(Class, Class.id == Pupil.class_id)\
+     .outerjoin(Stream, Stream.id == Pupil.stream_id)\
+     .outerjoin(required, required.c.class_id == Pupil.class_id)\
+     .outerjoin(paid, paid.c.pupil_id == Pupil.id)
+
+    if with_payments_only:
+        query = query.filter(paid.c.pupil_id.isnot(None))
+    if class_id:
+        query = query.filter(Pupil.class_id == int(class_id))
+    if stream_id:
+        query = query.filter(Pupil.stream_id == int(stream_id))
+    if status == 'owing':
+        query = query.filter(balance > 0)
+    elif status == 'cleared':
+        query = query.filter(balance <= 0)
+    for token in (search or '').split():
+        like = f'%{token}%'
+        query = query.filter(or_(
+            Pupil.first_name.ilike(like),
+            Pupil.last_name.ilike(like),
+            Pupil.admission_number.ilike(like),
+            Class.name.ilike(like),
+            Stream.name.ilike(like),
+        ))
+
+    return query.order_by(*_order_by(sort, balance))
+
+
+def paginate_balances(query, page=1, per_page=DEFAULT_PER_PAGE):
+    """Return (rows, total, page, per_page) for one page of a balance query."""
+    per_page = max(1, min(int(per_page or DEFAULT_PER_PAGE), MAX_PER_PAGE))
+    total = query.order_by(None).count()
+    pages = max(1, -(-total // per_page))
+    page = max(1, min(int(page or 1), pages))
+    rows = query.limit(per_page).offset((page - 1) * per_page).all()
+    return rows, total, page, per_page
+
+
+def fee_item_breakdown(rows, year=None, term=None):
+    """Fee items per class and completed amount paid per (pupil, fee item) for one page.
+
+    Two queries regardless of page size: {class_id: [ClassFeeStructure]} and
+    {(pupil_id, fee_id): amount}.
+    """
+    class_ids = {r.class_id for r in rows if r.class_id}
+    pupil_ids = [r.id for r in rows]
+    fees_by_class = {}
+    if class_ids:
+        items = ClassFeeStructure.query.filter(ClassFeeStructure.class_id.in_(class_ids))\
+            .order_by(ClassFeeStructure.id).all()
+        for item in items:
+            fees_by_class.setdefault(item.class_id, []).append(item)
+
+    paid_by_fee = {}
+    if pupil_ids:
+        paid_rows = db.session.query(
+            Payment.pupil_id, Payment.fee_id, func.sum(Payment.amount_paid)
+        ).filter(
+            Payment.pupil_id.in_(pupil_ids),
+            Payment.status == 'completed',
+            *_period_filters(year, term)
+        ).group_by(Payment.pupil_id, Payment.fee_id).all()
+        paid_by_fee = {(pupil_id, fee_id): float(amount or 0) for pupil_id, fee_id, amount in paid_rows}
+    return fees_by_class, paid_by_fee
@@ -0,0 +1,130 @@
+"""
+Posting pupil fee payments.
+
+Two bursars (or a double-clicked submit) used to be able to pass the
+overpayment check at the same time, because each request summed the
+pupil's payments without holding any lock. post_payment() serializes
+postings per pupil by taking SELECT ... FOR UPDATE on the pupil's overall
+pupil_balances row, then checks the fee item with one SUM over payments
+before inserting.
+
+Clients send an idempotency key (form field / JSON `idempotency_key` or
+the `Idempotency-Key` header). payments.idempotency_key is unique, so a
+retry with the same key returns the payment the first attempt created
+instead of posting it twice. A key that comes back with a different pupil,
+fee item or amount is a client bug, not a retry: post_payment() refuses it
+with KEY_REUSED rather than reporting someone else's payment as a success.
+"""
+from models.user_models import db
+from models.register_pupils import Payment, PupilBalance
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from utils.pupil_balances import refresh_pupil_balances, ALL_YEARS, ALL_TERMS
+from utils.receipts import issue_receipts
+
+MAX_KEY_LENGTH = 64
+KEY_REUSED = 'This idempotency key was already used for a different payment.'
+
+
+def idempotency_key_from(request, data=None):
+    """Client key from the Idempotency-Key header or an `idempotency_key` field."""
+    key = request.headers.get('Idempotency-Key')
+    if not key and data is not None:
+        key = data.get('idempotency_key')
+    key = (key or '').strip()
+    return key[:MAX_KEY_LENGTH] or None
+
+
+def lock_pupil_balances(pupil_ids):
+    """Take row locks on the pupils' overall balance rows for this transaction.
+
+    Rows are created first for pupils that have none yet, so there is always
+    something to lock, and locked in id order so concurrent batches cannot
+    deadlock.
+    """
+    pupil_ids = sorted(set(pupil_ids))
+    if not pupil_ids:
+        return
+    db.session.execute(pg_insert(PupilBalance.__table__).values([
+        {'pupil_id': p, 'year': ALL_YEARS, 'term': ALL_TERMS, 'required': 0, 'paid': 0, 'balance': 0}
+        for p in pupil_ids
+    ]).on_conflict_do_nothing(index_elements=['pupil_id', 'year', 'term']))
+    db.session.execute(
+        select(PupilBalance.pupil_id).where(
+            PupilBalance.pupil_id.in_(pupil_ids),
+            PupilBalance.year == ALL_YEARS,
+            PupilBalance.term == ALL_TERMS,
+        ).order_by(PupilBalance.pupil_id).with_for_update()
+    ).all()
+
+
+def _existing(idempotency_key):
+    if not idempotency_key:
+        return None
+    return Payment.query.filter_by(idempotency_key=idempotency_key).first()
+
+
+def _replay(previous, pupil, fee_item, amount_paid):
+    """post_payment() result for a key that was already used."""
+    if (previous.pupil_id != pupil.id or previous.fee_id != fee_item.id
+            or abs((previous.amount_paid or 0) - amount_paid) > 0.005):
+        return False, KEY_REUSED
+    return True, {'payment': previous, 'duplicate': True}
+
+
+def post_payment(pupil, fee_item, amount_paid, payment_method=None, year=None, term=None,
+                 idempotency_key=None, cashier_id=None):
+    """Record one payment against a fee item, refresh the pupil's balances and issue its receipt.
+
+    Returns (success, payload): on success payload is
+    {'payment': Payment, 'duplicate': bool}, otherwise an error message
+    (KEY_REUSED when the key belongs to a different payment).
+    The transaction is committed on success and rolled back otherwise.
+    """
+    previous = _existing(idempotency_key)
+    if previous is not None:
+        return _replay(previous, pupil, fee_item, amount_paid)
+
+    try:
+        lock_pupil_balances([pupil.id])
+
+        # A concurrent request with the same key may have committed while we waited
+        previous = _existing(idempotency_key)
+        if previous is not None:
+            db.session.rollback()
+            return _replay(previous, pupil, fee_item, amount_paid)
+
+        already_paid = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
+            Payment.pupil_id == pupil.id, Payment.fee_id == fee_item.id, Payment.status == 'completed'
+        ).scalar()
+        if already_paid >= fee_item.amount:
+            db.session.rollback()
+            return False, f"The fee item '{fee_item.item_name}' is already fully paid."
+        if already_paid + amount_paid > fee_item.amount:
+            db.session.rollback()
+            return False, f"Payment exceeds required amount for '{fee_item.item_name}'."
+
+        payment = Payment(
+            pupil_id=pupil.id,
+            fee_id=fee_item.id,
+            amount_paid=amount_paid,
+            payment_method=payment_method,
+            reference=str(fee_item.id),
+            year=int(year) if year else None,
+            term=term if term else None,
+            idempotency_key=idempotency_key,
+        )
+        db.session.add(payment)
+        db.session.flush()
+        refresh_pupil_balances(pupil_ids=[pupil.id])
+        issue_receipts([payment.id], cashier_id)
+        db.session.commit()
+        return True, {'payment': payment, 'duplicate': False}
+    except IntegrityError:
+        # The same key was posted outside the balance lock; hand back that payment
+        db.session.rollback()
+        previous = _existing(idempotency_key)
+        if previous is not None:
+            return _replay(previous, pupil, fee_item, amount_paid)
+        raise
@@ -0,0 +1,266 @@
+"""
+Finance rollup: fee income, expenses and salaries per month and per term.
+
+`finance_rollup` keeps one row per (period_type, year, period) with the
+summed amounts and record counts of the three money tables:
+
+    fee income  payments         status 'completed'
+    expenses    expense_records  every record
+    salaries    salary_payments  status 'paid'
+
+Month rows go by the date the money moved (payment_date). Term rows go by
+the record's own term/year when both are set, otherwise by the latest term
+that had started on that date, so holiday spending lands in the term just
+finished.
+
+The table is kept current by an after_flush listener (track_finance_writes)
+that turns every ORM insert, update and delete of those models into signed
+deltas and applies them with one upsert (col = col + delta) in the same
+transaction. Core INSERTs that bypass the ORM report their rows through
+add_inserted_rows(). rebuild_finance_rollup() recomputes everything from the
+source tables (`flask rebuild-finance-rollup`).
+"""
+from datetime import datetime
+
+from models.user_models import db
+from models.term_model import Term
+from models.register_pupils import Payment
+from models.expenses_model import ExpenseRecord
+from models.salary_models import SalaryPayment
+from models.finance_model import FinanceRollup
+from sqlalchemy import select, func, case, and_, true, literal, union_all, Integer, event, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+MONTH = 'month'
+TERM = 'term'
+PERIOD_TYPES = (MONTH, TERM)
+
+# model: (amount column, rollup amount column, rollup count column, counted status or None)
+SOURCES = {
+    Payment: ('amount_paid', 'fee_income', 'fee_count', 'completed'),
+    ExpenseRecord: ('amount', 'expenses', 'expense_count', None),
+    SalaryPayment: ('amount', 'salaries', 'salary_count', 'paid'),
+}
+_WATCHED = ('payment_date', 'year', 'term', 'status')
+
+
+# ---------------------------------------------------------------- incremental
+
+def _term_lookup(connection):
+    """Resolve a date to (year, term name) with one query per distinct day."""
+    seen = {}
+
+    def lookup(day):
+        if day not in seen:
+            row = connection.execute(
+                select(Term.year, Term.name).where(Term.start_date <= day)
+                .order_by(Term.start_date.desc()).limit(1)
+            ).first()
+            seen[day] = tuple(row) if row else None
+        return seen[day]
+    return lookup
+
+
+def _periods(when, year, term, term_for):
+    """(period_type, year, period) keys a record dated `when` contributes to."""
+    keys = []
+    if when is not None:
+        keys.append((MONTH, when.year, f'{when.month:02d}'))
+    if year and term:
+        keys.append((TERM, int(year), term))
+    elif when is not None:
+        resolved = term_for(when.date())
+        if resolved:
+            keys.append((TERM, resolved[0], resolved[1]))
+    return keys
+
+
+def _values(obj, amount_attr, old):
+    """Current attribute values, or the ones loaded before this flush when `old`."""
+    state = inspect(obj)
+    values = {}
+    for attr in (amount_attr,) + _WATCHED:
+        if attr not in state.attrs:
+            continue
+        value = getattr(obj, attr, None)
+        if old:
+            history = state.attrs[attr].history
+            if history.deleted:
+                value = history.deleted[0]
+        values[attr] = value
+    return values
+
+
+def _add(deltas, values, spec, sign, term_for):
+    amount_attr, amount_col, count_col, counted_status = spec
+    if counted_status is not None and (values.get('status') or counted_status) != counted_status:
+        return
+    amount = float(values.get(amount_attr) or 0)
+    for key in _periods(values.get('payment_date'), values.get('year'), values.get('term'), term_for):
+        row = deltas.setdefault(key, {})
+        row[amount_col] = row.get(amount_col, 0) + sign * amount
+        row[count_col] = row.get(count_col, 0) + sign
+
+
+def _apply(connection, deltas):
+    rows = []
+    now = datetime.utcnow()
+    for (period_type, year, period), changes in deltas.items():
+        if not any(changes.values()):
+            continue
+        row = {'period_type': period_type, 'year': year, 'period': period, 'updated_at': now,
+               'fee_income': 0, 'fee_count': 0, 'expenses': 0, 'expense_count': 0, 'salaries': 0, 'salary_count': 0}
+        row.update(changes)
+        rows.append(row)
+    if not rows:
+        return
+    table = FinanceRollup.__table__
+    upsert = pg_insert(table).values(rows)
+    set_ = {c: table.c[c] + upsert.excluded[c]
+            for c in ('fee_income', 'fee_count', 'expenses', 'expense_count', 'salaries', 'salary_count')}
+    set_['updated_at'] = upsert.excluded.updated_at
+    connection.execute(upsert.on_conflict_do_update(index_elements=['period_type', 'year', 'period'], set_=set_))
+
+
+def _before_flush(session, flush_context, instances):
+    # Rows about to be deleted are read now, while lazy loads still work
+    session.info['finance_rollup_removed'] = [
+        (SOURCES[type(obj)], _values(obj, SOURCES[type(obj)][0], old=True))
+        for obj in session.deleted if type(obj) in SOURCES
+    ]
+
+
+def _after_flush(session, flush_context):
+    removed = session.info.pop('finance_rollup_removed', [])
+    changed = [obj for obj in list(session.new) + list(session.dirty) if type(obj) in SOURCES]
+    if not removed and not changed:
+        return
+    connection = session.connection()
+    term_for = _term_lookup(connection)
+    deltas = {}
+    for spec, values in removed:
+        _add(deltas, values, spec, -1, term_for)
+    for obj in changed:
+        spec = SOURCES[type(obj)]
+        if obj in session.new:
+            values = _values(obj, spec[0], old=False)
+            values['payment_date'] = values.get('payment_date') or datetime.utcnow()
+            _add(deltas, values, spec, 1, term_for)
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or not any(
+                state.attrs[a].history.has_changes() for a in (spec[0],) + _WATCHED if a in state.attrs):
+            continue
+        _add(deltas, _values(obj, spec[0], old=True), spec, -1, term_for)
+        _add(deltas, _values(obj, spec[0], old=False), spec, 1, term_for)
+    _apply(connection, deltas)
+
+
+def track_finance_writes():
+    """Keep finance_rollup in step with ORM writes to payments, expenses and salaries."""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def add_inserted_rows(model, rows):
+    """Count rows of a tracked model inserted with Core, from their RETURNING mappings.
+
+    Each row needs the amount column, payment_date, year, term and status.
+    """
+    deltas = {}
+    term_for = _term_lookup(db.session.connection())
+    for row in rows:
+        _add(deltas, row, SOURCES[model], 1, term_for)
+    _apply(db.session.connection(), deltas)
+
+
+# ---------------------------------------------------------------- rebuild
+
+def _source_rows(model, spec):
+    """SELECT of (period_type, year, period, amount, count) for one source, both period types."""
+    amount_attr, amount_col, count_col, counted_status = spec
+    amount = getattr(model, amount_attr)
+    when = model.payment_date
+    counted = (model.status == counted_status) if counted_status else true()
+
+    month = select(
+        literal(MONTH).label('period_type'),
+        func.extract('year', when).cast(Integer).label('year'),
+        func.to_char(when, 'MM').label('period'),
+        func.sum(amount).label('amount'),
+        func.count().label('count'),
+    ).where(counted, when.isnot(None)).group_by(func.extract('year', when), func.to_char(when, 'MM'))
+
+    # Latest term started on the record's date, for records without their own term
+    resolved = select(Term.year, Term.name).where(Term.start_date <= func.date(when))\
+        .order_by(Term.start_date.desc()).limit(1).lateral('resolved')
+    tagged = and_(model.year.isnot(None), model.term.isnot(None), model.term != '')
+    term_year = case((tagged, model.year), else_=resolved.c.year)
+    term_name = case((tagged, model.term), else_=resolved.c.name)
+    term = select(
+        literal(TERM).label('period_type'),
+        term_year.label('year'),
+        term_name.label('period'),
+        func.sum(amount).label('amount'),
+        func.count().label('count'),
+    ).select_from(model).outerjoin(resolved, true())\
+     .where(counted, term_name.isnot(None)).group_by(term_year, term_name)
+    return month, term
+
+
+def rebuild_finance_rollup():
+    """Recompute the whole table from payments, expense_records and salary_payments.
+
+    Runs inside the caller's transaction.
+    """
+    columns = ('fee_income', 'fee_count', 'expenses', 'expense_count', 'salaries', 'salary_count')
+    parts = []
+    for model, spec in SOURCES.items():
+        _, amount_col, count_col, _ = spec
+        for rows in _source_rows(model, spec):
+            rows = rows.subquery()
+            parts.append(select(
+                rows.c.period_type, rows.c.year, rows.c.period,
+                *[(rows.c.amount if c == amount_col else rows.c['count'] if c == count_col else literal(0)).label(c)
+                  for c in columns]
+            ))
+    combined = union_all(*parts).subquery('combined')
+    totals = select(
+        combined.c.period_type, combined.c.year, combined.c.period,
+        *[func.sum(combined.c[c]).label(c) for c in columns],
+        literal(datetime.utcnow()),
+    ).group_by(combined.c.period_type, combined.c.year, combined.c.period)
+
+    table = FinanceRollup.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['period_type', 'year', 'period', *columns, 'updated_at'], totals
+    ))
+
+
+# ---------------------------------------------------------------- reading
+
+def finance_summary(period_type=MONTH, year_from=None, year_to=None):
+    """Rollup rows of one period type in date order."""
+    query = FinanceRollup.query.filter(FinanceRollup.period_type == period_type)
+    if year_from:
+        query = query.filter(FinanceRollup.year >= int(year_from))
+    if year_to:
+        query = query.filter(FinanceRollup.year <= int(year_to))
+    return query.order_by(FinanceRollup.year, FinanceRollup.period).all()
+
+
+def summary_json(rows):
+    return [{
+        'period_type': r.period_type,
+        'year': r.year,
+        'period': r.period,
+        'fee_income': float(r.fee_income or 0),
+        'fee_count': r.fee_count,
+        'expenses': float(r.expenses or 0),
+        'expense_count': r.expense_count,
+        'salaries': float(r.salaries or 0),
+        'salary_count': r.salary_count,
+        'net': float(r.net),
+    } for r in rows]
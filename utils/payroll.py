@@ -0,0 +1,122 @@
+"""
+Payroll runs: pay every eligible staff member for a month in one statement.
+
+Marking staff paid one request at a time meant a round trip and a duplicate
+check per person. run_payroll() computes each amount in SQL (the user's
+salary_amount override, else the role's RoleSalary), takes bank details
+from StaffProfile, and writes all SalaryPayment rows with one
+INSERT ... SELECT ... ON CONFLICT DO NOTHING against the partial unique
+index uq_salary_payments_user_period_paid (one paid payment per user and
+month). Running the same period again, or alongside a manual mark-paid,
+therefore never pays anyone twice; the payroll_runs row records how many
+were paid, skipped as already paid, or had no salary configured.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from models.user_models import db, User, Role
+from models.salary_models import RoleSalary, SalaryPayment, PayrollRun
+from models.staff_models import StaffProfile
+from sqlalchemy import select, func, case, literal, cast, String, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from utils.finance_rollup import add_inserted_rows
+from utils.salary_status import EXCLUDED_ROLES
+from utils.staff_directory import bump_staff_version
+
+PAID_PERIOD_WHERE = text("status = 'paid' AND period_month IS NOT NULL")
+
+
+def _staff_filter(role_id=None):
+    conditions = [Role.role_name.notin_(EXCLUDED_ROLES)]
+    if role_id:
+        conditions.append(User.role_id == int(role_id))
+    return conditions
+
+
+def run_payroll(period_month, period_year, run_by_user_id=None, role_id=None):
+    """Pay all unpaid staff with a configured salary for (month, year).
+
+    Returns the committed PayrollRun. Raises ValueError for a bad period.
+    """
+    period_month, period_year = int(period_month), int(period_year)
+    if not 1 <= period_month <= 12:
+        raise ValueError('period_month must be between 1 and 12')
+
+    try:
+        run = PayrollRun(period_month=period_month, period_year=period_year,
+                         role_id=int(role_id) if role_id else None, run_by_user_id=run_by_user_id)
+        db.session.add(run)
+        db.session.flush()
+
+        amount = func.coalesce(User.salary_amount, RoleSalary.amount, 0)
+        eligible, no_salary = db.session.query(
+            func.count(User.id),
+            func.count(case((amount <= 0, User.id))),
+        ).select_from(User).join(Role, Role.id == User.role_id)\
+         .outerjoin(RoleSalary, RoleSalary.role_id == User.role_id)\
+         .filter(*_staff_filter(role_id)).one()
+
+        now = datetime.utcnow()
+        rows = select(
+            User.id,
+            User.role_id,
+            amount,
+            literal(run_by_user_id),
+            literal(now),
+            literal(period_month),
+            literal(period_year),
+            literal('paid'),
+            literal(f'PAYROLL-{period_year}{period_month:02d}-{run.id}-') + cast(User.id, String),
+            literal(f'Payroll run #{run.id} for {period_month}/{period_year}'),
+            case((StaffProfile.bank_name.isnot(None), 'BANK'), else_='CASH'),
+            StaffProfile.bank_name,
+            literal(run.id),
+            literal(now),
+            literal(now),
+        ).select_from(User).join(Role, Role.id == User.role_id)\
+         .outerjoin(RoleSalary, RoleSalary.role_id == User.role_id)\
+         .outerjoin(StaffProfile, StaffProfile.staff_id == User.id)\
+         .where(*_staff_filter(role_id), amount > 0)\
+         .order_by(User.id)
+
+        table = SalaryPayment.__table__
+        inserted = db.session.execute(
+            pg_insert(table).from_select(
+                ['user_id', 'role_id', 'amount', 'paid_by_user_id', 'payment_date', 'period_month',
+                 'period_year', 'status', 'reference', 'notes', 'payment_method', 'bank_name',
+                 'payroll_run_id', 'created_at', 'updated_at'],
+                rows
+            ).on_conflict_do_nothing(
+                index_elements=['user_id', 'period_year', 'period_month'], index_where=PAID_PERIOD_WHERE
+            ).returning(table.c.amount, table.c.payment_date, table.c.year, table.c.term, table.c.status)
+        ).mappings().all()
+        add_inserted_rows(SalaryPayment, inserted)
+
+        run.eligible_count = int(eligible)
+        run.no_salary_count = int(no_salary)
+        run.paid_count = len(inserted)
+        run.skipped_count = int(eligible) - int(no_salary) - len(inserted)
+        run.total_amount = sum((Decimal(row['amount']) for row in inserted), Decimal('0.00'))
+        db.session.commit()
+        if inserted:
+            bump_staff_version()
+        return run
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def run_summary(run):
+    return {
+        'id': run.id,
+        'period_month': run.period_month,
+        'period_year': run.period_year,
+        'role_id': run.role_id,
+        'run_by_user_id': run.run_by_user_id,
+        'eligible': run.eligible_count,
+        'paid': run.paid_count,
+        'skipped': run.skipped_count,
+        'no_salary': run.no_salary_count,
+        'total_amount': float(run.total_amount or 0),
+        'created_at': run.created_at.isoformat() if run.created_at else None,
+    }
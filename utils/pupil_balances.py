@@ -0,0 +1,134 @@
+"""
+Materialized pupil fee balances.
+
+`pupil_balances` holds, per pupil, the required fees of their class, the
+completed payments and the resulting balance, overall and per period:
+
+    (pupil_id, 0,    '')        every payment
+    (pupil_id, 2025, '')        payments for 2025
+    (pupil_id, 0,    'Term 1')  payments for Term 1 of any year
+    (pupil_id, 2025, 'Term 1')  one term
+
+Rows are rebuilt by refresh_pupil_balances(), one upserting
+INSERT ... SELECT (GROUPING SETS over payments) plus a DELETE of stale
+periods, inside the caller's transaction. Every code path that writes payments or sets a pupil's class
+calls it before committing, so readers get a primary key lookup instead of
+summing payments. Class fee structures are edited outside the app; run
+`flask rebuild-pupil-balances [--class-id N]` afterwards.
+"""
+from datetime import datetime
+
+from models.user_models import db
+from models.register_pupils import Pupil, ClassFeeStructure, Payment, PupilBalance
+from sqlalchemy import select, func, case, and_, or_, literal, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+ALL_YEARS = 0
+ALL_TERMS = ''
+
+
+def _balance_rows(pupil_filter, stamp):
+    """SELECT producing every pupil_balances row for pupils matching the filter."""
+    required = select(
+        ClassFeeStructure.class_id,
+        func.sum(ClassFeeStructure.amount).label('required')
+    ).group_by(ClassFeeStructure.class_id).subquery('required')
+
+    year_grouped = func.grouping(Payment.year) == 0
+    term_grouped = func.grouping(Payment.term) == 0
+    paid = select(
+        Payment.pupil_id,
+        case((year_grouped, Payment.year), else_=ALL_YEARS).label('year'),
+        case((term_grouped, Payment.term), else_=ALL_TERMS).label('term'),
+        func.sum(case((Payment.status == 'completed', Payment.amount_paid), else_=0)).label('paid'),
+    ).join(Pupil, Pupil.id == Payment.pupil_id).where(*pupil_filter).group_by(
+        func.grouping_sets(
+            tuple_(Payment.pupil_id),
+            tuple_(Payment.pupil_id, Payment.year),
+            tuple_(Payment.pupil_id, Payment.term),
+            tuple_(Payment.pupil_id, Payment.year, Payment.term),
+        )
+    ).having(and_(
+        # Payments without a year/term only count towards the wider totals
+        or_(~year_grouped, Payment.year.isnot(None)),
+        or_(~term_grouped, and_(Payment.term.isnot(None), Payment.term != '')),
+    )).subquery('paid')
+
+    total_required = func.coalesce(required.c.required, 0)
+    total_paid = func.coalesce(paid.c.paid, 0)
+    # Pupils without payments still get their (0, '') row from the outer join
+    return select(
+        Pupil.id,
+        func.coalesce(paid.c.year, ALL_YEARS),
+        func.coalesce(paid.c.term, ALL_TERMS),
+        total_required,
+        total_paid,
+        total_required - total_paid,
+        literal(stamp),
+    ).select_from(Pupil).outerjoin(required, required.c.class_id == Pupil.class_id)\
+     .outerjoin(paid, paid.c.pupil_id == Pupil.id)\
+     .where(*pupil_filter)
+
+
+def refresh_pupil_balances(pupil_ids=None, class_ids=None):
+    """Rebuild balance rows for the given pupils and/or classes (everyone if both are None).
+
+    Runs inside the caller's transaction; commit together with the payment
+    or fee change.
+    """
+    pupil_filter = []
+    if pupil_ids is not None or class_ids is not None:
+        pupil_ids = sorted({int(p) for p in pupil_ids or () if p is not None})
+        class_ids = sorted({int(c) for c in class_ids or () if c is not None})
+        if not pupil_ids and not class_ids:
+            return
+        pupil_filter.append(or_(Pupil.id.in_(pupil_ids), Pupil.class_id.in_(class_ids)))
+
+    # Upsert rather than delete + insert: the overall row is what payment
+    # posting locks (utils.fee_payments), so it must survive a refresh.
+    table = PupilBalance.__table__
+    stamp = datetime.utcnow()
+    upsert = pg_insert(table).from_select(
+        ['pupil_id', 'year', 'term', 'required', 'paid', 'balance', 'updated_at'],
+        _balance_rows(pupil_filter, stamp)
+    )
+    db.session.execute(upsert.on_conflict_do_update(
+        index_elements=['pupil_id', 'year', 'term'],
+        set_={c: upsert.excluded[c] for c in ('required', 'paid', 'balance', 'updated_at')}
+    ))
+    # Periods whose payments were all removed
+    stale = table.delete().where(table.c.updated_at != stamp)
+    if pupil_filter:
+        stale = stale.where(table.c.pupil_id.in_(select(Pupil.id).where(*pupil_filter)))
+    db.session.execute(stale)
+
+
+def pupil_balance(pupil_id, year=None, term=None):
+    """Return the PupilBalance for a pupil and optional period.
+
+    A period with no payments has no row of its own, so its figures come
+    from the overall row with nothing paid. A pupil with no rows at all
+    (registered before the table existed) is computed with the same SELECT
+    the refresh uses, without writing: this is a read and must not commit
+    or flush anything for the caller.
+    """
+    year = int(year) if year else ALL_YEARS
+    term = term or ALL_TERMS
+    row = db.session.get(PupilBalance, (pupil_id, year, term))
+    if row is not None:
+        return row
+
+    overall = db.session.get(PupilBalance, (pupil_id, ALL_YEARS, ALL_TERMS))
+    if overall is None:
+        computed = {
+            (r[1], r[2]): PupilBalance(pupil_id=r[0], year=r[1], term=r[2], required=r[3],
+                                       paid=r[4], balance=r[5], updated_at=r[6])
+            for r in db.session.execute(_balance_rows([Pupil.id == pupil_id], datetime.utcnow()))
+        }
+        if (year, term) in computed:
+            return computed[(year, term)]
+        overall = computed.get((ALL_YEARS, ALL_TERMS))
+        if overall is None:
+            return None
+    return PupilBalance(pupil_id=pupil_id, year=year, term=term, required=overall.required,
+                        paid=0, balance=overall.required, updated_at=overall.updated_at)
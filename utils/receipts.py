@@ -0,0 +1,132 @@
+"""
+Payment receipts.
+
+A `receipts` row is written in the same transaction as each payment, with
+its number taken from the receipt_number_seq sequence (column default), so
+numbering is gap-tolerant but never duplicated, however many bursars post
+at once. The row snapshots the amounts and the pupil's totals right after
+the payment, so rendering a receipt is one primary key lookup.
+
+Rendered HTML is cached under (receipt_id, version). Editing or deleting
+the payment bumps the version, so stale renders are simply never read
+again and no invalidation is needed.
+"""
+from datetime import datetime
+
+from flask import render_template
+
+from models.user_models import db, User, Role
+from models.register_pupils import Payment, ClassFeeStructure, PupilBalance, Receipt, PUPIL_RECEIPT_NUMBER_SEQ
+from sqlalchemy import select, literal, and_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from utils.cache_utils import cache_get, cache_set
+from utils.pupil_balances import ALL_YEARS, ALL_TERMS
+
+RENDER_TTL = 3600
+
+
+def next_pupil_receipt_number():
+    """Next registration receipt number for a new pupil (RCT-001, RCT-002, ...)."""
+    return f"RCT-{str(db.session.execute(select(PUPIL_RECEIPT_NUMBER_SEQ.next_value())).scalar()).zfill(3)}"
+
+
+def _cashier(cashier_id):
+    """(name, role name) of the user posting the payment, or (None, None)."""
+    if not cashier_id:
+        return None, None
+    row = db.session.query(User.first_name, User.last_name, Role.role_name)\
+        .outerjoin(Role, Role.id == User.role_id).filter(User.id == cashier_id).first()
+    if row is None:
+        return None, None
+    return f"{row[0] or ''} {row[1] or ''}".strip() or None, row[2]
+
+
+def issue_receipts(payment_ids, cashier_id=None):
+    """Create the receipts for newly inserted payments with one INSERT ... SELECT.
+
+    Call after refresh_pupil_balances() so the snapshot carries the new
+    totals. Payments that already have a receipt are left alone.
+    """
+    payment_ids = sorted(set(payment_ids))
+    if not payment_ids:
+        return
+    cashier_name, cashier_role = _cashier(cashier_id)
+    now = datetime.utcnow()
+    rows = select(
+        Payment.id,
+        Payment.pupil_id,
+        Payment.amount_paid,
+        ClassFeeStructure.item_name,
+        Payment.payment_method,
+        Payment.reference,
+        Payment.year,
+        Payment.term,
+        PupilBalance.required,
+        PupilBalance.paid,
+        PupilBalance.balance,
+        literal(cashier_id),
+        literal(cashier_name),
+        literal(cashier_role),
+        literal('issued'),
+        literal(1),
+        literal(now),
+        literal(now),
+    ).select_from(Payment)\
+     .outerjoin(ClassFeeStructure, ClassFeeStructure.id == Payment.fee_id)\
+     .outerjoin(PupilBalance, and_(PupilBalance.pupil_id == Payment.pupil_id,
+                                   PupilBalance.year == ALL_YEARS, PupilBalance.term == ALL_TERMS))\
+     .where(Payment.id.in_(payment_ids))
+    db.session.execute(pg_insert(Receipt.__table__).from_select(
+        ['payment_id', 'pupil_id', 'amount', 'fee_item_name', 'payment_method', 'reference', 'year', 'term',
+         'total_required', 'total_paid', 'balance', 'cashier_id', 'cashier_name', 'cashier_role',
+         'status', 'version', 'issued_at', 'updated_at'],
+        rows
+    ).on_conflict_do_nothing(index_elements=['payment_id']))
+
+
+def revise_receipt(payment_id, void=False):
+    """Bump the receipt version after its payment was edited, or void it before deletion.
+
+    Re-reads the amount, method and the pupil's current totals.
+    """
+    table = Receipt.__table__
+    values = {'version': table.c.version + 1, 'updated_at': datetime.utcnow()}
+    if void:
+        values['status'] = 'void'
+    else:
+        balance = PupilBalance.__table__
+        overall = and_(balance.c.pupil_id == table.c.pupil_id,
+                       balance.c.year == ALL_YEARS, balance.c.term == ALL_TERMS)
+        values.update({
+            'amount': select(Payment.amount_paid).where(Payment.id == payment_id).scalar_subquery(),
+            'payment_method': select(Payment.payment_method).where(Payment.id == payment_id).scalar_subquery(),
+            'total_required': select(balance.c.required).where(overall).scalar_subquery(),
+            'total_paid': select(balance.c.paid).where(overall).scalar_subquery(),
+            'balance': select(balance.c.balance).where(overall).scalar_subquery(),
+        })
+    db.session.execute(update(table).where(table.c.payment_id == payment_id).values(**values))
+
+
+def render_receipt(receipt):
+    """Printable HTML for one receipt, cached by (receipt_id, version)."""
+    key = f"receipt:{receipt.id}:v{receipt.version}"
+    html = cache_get(key)
+    if html is not None:
+        return html
+    pupil = receipt.pupil
+    html = render_template(
+        "bursar/receipt.html",
+        pupil=pupil,
+        receipt=receipt,
+        pupil_fees=[],
+        paid_lookup={},
+        payments=[],
+        total_required=receipt.total_required,
+        total_paid=receipt.total_paid,
+        balance=receipt.balance,
+        receipt_date=receipt.issued_at.strftime('%d/%m/%Y %H:%M'),
+        cashier_name=receipt.cashier_name or '',
+        bursar_role_name=receipt.cashier_role or '',
+    )
+    cache_set(key, html, ttl=RENDER_TTL)
+    return html
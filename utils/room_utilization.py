@@ -0,0 +1,114 @@
+"""
+Room x day x period utilization grid.
+
+`room_utilization` holds one row per classroom in use and per teaching
+period, with the occupying class/stream/slot or NULLs when the room is free.
+The grid is rebuilt with one INSERT ... SELECT per write: every distinct
+classroom named in timetable_slots, crossed with every distinct
+(day, start, end) period, left-joined to the slot that occupies it.
+
+Call refresh_room_utilization() inside the transaction that changes slots,
+passing the rooms that were touched (old and new names) so only their rows
+are rebuilt; with no argument the whole grid is rebuilt. Every room has a
+cell for every period, so a write that adds or removes a period (a new
+(day, start, end) or the last slot of one) rebuilds the whole grid even when
+rooms are passed; the DELETE detects that itself, so it costs no extra
+statement. The INSERT then fills in every room that has no rows left.
+"""
+from models.user_models import db
+from models.class_model import Class
+from models.stream_model import Stream
+from models.timetable_model import TimeTableSlot, RoomUtilization
+from sqlalchemy import select, func, and_, or_, true
+from sqlalchemy.orm import aliased
+from utils.timetable_occupancy import room_key
+from utils.timetable_cache import DAY_ORDER
+
+
+def refresh_room_utilization(rooms=None):
+    """Rebuild grid rows for the given classroom names (all rooms if None)."""
+    if rooms is not None:
+        rooms = sorted({room_key(r) for r in rooms} - {None})
+        if not rooms:
+            return
+
+    grid_table = RoomUtilization.__table__
+    room_name = func.trim(TimeTableSlot.classroom)
+    room_rows = select(room_name.label('classroom')).where(
+        TimeTableSlot.classroom.isnot(None), room_name != '',
+        # Rooms whose rows were just deleted, or never built
+        room_name.notin_(select(grid_table.c.classroom))
+    ).distinct().subquery('rooms')
+
+    slot_periods = select(TimeTableSlot.day_of_week, TimeTableSlot.start_time, TimeTableSlot.end_time)
+    periods = slot_periods.distinct().subquery('periods')
+
+    slot = aliased(TimeTableSlot)
+    grid = select(
+        room_rows.c.classroom,
+        periods.c.day_of_week,
+        periods.c.start_time,
+        periods.c.end_time,
+        slot.class_id,
+        slot.stream_id,
+        slot.id,
+    ).select_from(
+        room_rows.join(periods, true()).outerjoin(slot, and_(
+            func.trim(slot.classroom) == room_rows.c.classroom,
+            slot.day_of_week == periods.c.day_of_week,
+            slot.start_time == periods.c.start_time,
+            slot.end_time == periods.c.end_time,
+        ))
+    )
+
+    delete = grid_table.delete()
+    if rooms is not None:
+        grid_periods = select(grid_table.c.day_of_week, grid_table.c.start_time, grid_table.c.end_time)
+        periods_changed = or_(
+            slot_periods.except_(grid_periods).exists(),
+            grid_periods.except_(slot_periods).exists(),
+        )
+        delete = delete.where(or_(grid_table.c.classroom.in_(rooms), periods_changed))
+    db.session.execute(delete)
+    db.session.execute(grid_table.insert().from_select(
+        ['classroom', 'day_of_week', 'start_time', 'end_time', 'class_id', 'stream_id', 'slot_id'],
+        grid
+    ))
+
+
+def room_grid(day_of_week=None, start_time=None, free_only=False):
+    """Read the grid (optionally one day/period, optionally free cells only) in one query."""
+    query = db.session.query(
+        RoomUtilization.classroom,
+        RoomUtilization.day_of_week,
+        RoomUtilization.start_time,
+        RoomUtilization.end_time,
+        RoomUtilization.slot_id,
+        RoomUtilization.class_id,
+        Class.name,
+        RoomUtilization.stream_id,
+        Stream.name,
+    ).outerjoin(Class, Class.id == RoomUtilization.class_id)\
+     .outerjoin(Stream, Stream.id == RoomUtilization.stream_id)
+
+    if day_of_week:
+        query = query.filter(RoomUtilization.day_of_week == day_of_week)
+    if start_time:
+        query = query.filter(RoomUtilization.start_time == start_time)
+    if free_only:
+        query = query.filter(RoomUtilization.slot_id.is_(None))
+
+    cells = [{
+        'classroom': r[0],
+        'day_of_week': r[1],
+        'start_time': r[2],
+        'end_time': r[3],
+        'free': r[4] is None,
+        'slot_id': r[4],
+        'class_id': r[5],
+        'class_name': r[6],
+        'stream_id': r[7],
+        'stream_name': r[8],
+    } for r in query.all()]
+    cells.sort(key=lambda c: (DAY_ORDER.get(c['day_of_week'], len(DAY_ORDER)), c['start_time'], c['classroom']))
+    return cells
@@ -0,0 +1,132 @@
+"""
+Salary payment listing: keyset pages and streamed full exports.
+
+The headteacher API returned every salary payment in one JSON array, so the
+response grew with the school's history. Pages here are keyset-paged on
+(payment_date, id), newest first, like the expense list (utils.expense_totals),
+so page 500 costs the same as page 1 and ix_salary_payments_date serves the
+unfiltered order. Full exports (NDJSON or CSV) read the same filtered query
+through a server-side cursor in batches (yield_per), on a connection of
+their own, and are written out row by row, so memory stays flat however many
+payments there are.
+"""
+import csv
+import io
+import json
+
+from models.user_models import db
+from models.salary_models import SalaryPayment
+from sqlalchemy import select, tuple_
+from utils.expense_totals import encode_cursor, decode_cursor
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = ('id', 'user_id', 'role_id', 'amount', 'paid_by_user_id', 'payment_date', 'period_month',
+           'period_year', 'term', 'year', 'status', 'reference', 'notes', 'payment_method', 'bank_name')
+
+
+def _int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def salary_payment_filters(period_month=None, period_year=None, term=None, year=None,
+                           role_id=None, user_id=None, status=None):
+    """WHERE conditions for the payment queries; unparseable numbers are ignored."""
+    conditions = []
+    for column, value in ((SalaryPayment.period_month, _int(period_month)),
+                          (SalaryPayment.period_year, _int(period_year)),
+                          (SalaryPayment.year, _int(year)),
+                          (SalaryPayment.role_id, _int(role_id)),
+                          (SalaryPayment.user_id, _int(user_id))):
+        if value is not None:
+            conditions.append(column == value)
+    if term:
+        conditions.append(SalaryPayment.term == term)
+    if status:
+        conditions.append(SalaryPayment.status == status)
+    return conditions
+
+
+def salary_payment_page(conditions, before=None, per_page=DEFAULT_PER_PAGE):
+    """One page of payments older than the `before` cursor, newest first.
+
+    Returns (payments, next_cursor); next_cursor is None on the last page.
+    """
+    per_page = max(1, min(int(per_page or DEFAULT_PER_PAGE), MAX_PER_PAGE))
+    query = SalaryPayment.query.filter(*conditions)
+    position = decode_cursor(before)
+    if position is not None:
+        query = query.filter(
+            SalaryPayment.payment_date <= position[0],
+            tuple_(SalaryPayment.payment_date, SalaryPayment.id) < position,
+        )
+    payments = query.order_by(SalaryPayment.payment_date.desc(), SalaryPayment.id.desc())\
+        .limit(per_page + 1).all()
+    if len(payments) > per_page:
+        return payments[:per_page], encode_cursor(payments[per_page - 1])
+    return payments, None
+
+
+def iter_salary_payments(conditions):
+    """Every matching payment as a plain row, newest first, fetched in batches.
+
+    A generator: the query runs when the response body is first read, after
+    the request's session has been removed, so it uses its own connection
+    and closes it when the export ends or the client goes away.
+    """
+    table = SalaryPayment.__table__
+    query = select(*[table.c[c] for c in COLUMNS])\
+        .where(*conditions)\
+        .order_by(SalaryPayment.payment_date.desc(), SalaryPayment.id.desc())
+    connection = db.engine.connect()
+    try:
+        result = connection.execution_options(stream_results=True, yield_per=BATCH_SIZE).execute(query)
+        yield from result
+    finally:
+        connection.close()
+
+
+def _chunked(lines):
+    """Join lines into ~CHUNK_SIZE pieces so the server is not handed one write per row."""
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def ndjson_lines(rows, to_json):
+    """One JSON document per line."""
+    return _chunked(json.dumps(to_json(row), default=str) + '\n' for row in rows)
+
+
+def csv_lines(rows):
+    """A header line, then one CSV line per row in COLUMNS order."""
+    return _chunked(_csv_rows(rows))
+
+
+def _csv_rows(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    writer.writerow(COLUMNS)
+    yield flush()
+    for row in rows:
+        writer.writerow([row._mapping[c] for c in COLUMNS])
+        yield flush()
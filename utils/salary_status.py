@@ -0,0 +1,82 @@
+"""
+Staff salary status per pay period in one query.
+
+The salary page used to look up each user's role salary and then run two
+salary_payments queries per user (one for the list, one for the paid /
+unpaid counts). Here users are left-joined to their role salary and, with
+LEFT JOIN LATERAL (... ORDER BY payment_date DESC LIMIT 1), to their paid
+salary payment for the period, which ix_salary_payments_user_period
+answers with one index probe per user. The payment comes back as a
+SalaryPayment entity with its recorder (paid_by) eager-loaded, so the
+template does not lazy-load anything.
+"""
+from models.user_models import db, User, Role
+from models.salary_models import RoleSalary, SalaryPayment
+from sqlalchemy import select, func, true
+from sqlalchemy.orm import aliased, joinedload, contains_eager
+
+EXCLUDED_ROLES = ('Parent',)
+
+
+def _period_payment(month, year):
+    """LATERAL subquery: the user's latest paid payment for (month, year)."""
+    return select(SalaryPayment).where(
+        SalaryPayment.user_id == User.id,
+        SalaryPayment.period_month == month,
+        SalaryPayment.period_year == year,
+        SalaryPayment.status == 'paid',
+    ).order_by(SalaryPayment.payment_date.desc(), SalaryPayment.id.desc()).limit(1).lateral('period_payment')
+
+
+def salary_status(month, year, role_id=None, status=None):
+    """Staff rows for the period: (user, role_name, salary_amount, payment or None).
+
+    salary_amount is the user's override, else the role default. `status`
+    'paid' / 'unpaid' filters on whether a payment exists.
+    """
+    payment_rows = _period_payment(month, year)
+    payment = aliased(SalaryPayment, payment_rows)
+    query = db.session.query(
+        User,
+        Role.role_name,
+        func.coalesce(User.salary_amount, RoleSalary.amount).label('salary_amount'),
+        payment,
+    ).join(Role, Role.id == User.role_id)\
+     .outerjoin(RoleSalary, RoleSalary.role_id == User.role_id)\
+     .outerjoin(payment_rows, true())\
+     .options(contains_eager(User.role), joinedload(payment.paid_by))\
+     .filter(Role.role_name.notin_(EXCLUDED_ROLES))
+    if role_id:
+        query = query.filter(User.role_id == role_id)
+    if status == 'paid':
+        query = query.filter(payment_rows.c.id.isnot(None))
+    elif status == 'unpaid':
+        query = query.filter(payment_rows.c.id.is_(None))
+    return query.order_by(User.first_name, User.last_name, User.id).all()
+
+
+def salary_counts(month, year):
+    """(staff, paid) for the period across every staff role, ignoring page filters."""
+    payment_rows = _period_payment(month, year)
+    total, paid = db.session.query(
+        func.count(User.id),
+        func.count(payment_rows.c.id),
+    ).join(Role, Role.id == User.role_id)\
+     .outerjoin(payment_rows, true())\
+     .filter(Role.role_name.notin_(EXCLUDED_ROLES)).one()
+    return int(total), int(paid)
+
+
+def staff_roles():
+    """Roles that have at least one staff user, by name."""
+    return db.session.query(Role).filter(
+        Role.role_name.notin_(EXCLUDED_ROLES),
+        select(User.id).where(User.role_id == Role.id).exists(),
+    ).order_by(Role.role_name).all()
+
+
+def salary_history(user_id):
+    """A user's salary payments, newest first, with the recorder eager-loaded."""
+    return SalaryPayment.query.options(joinedload(SalaryPayment.paid_by))\
+        .filter(SalaryPayment.user_id == user_id)\
+        .order_by(SalaryPayment.payment_date.desc(), SalaryPayment.id.desc()).all()
@@ -0,0 +1,184 @@
+"""
+Process-local cache of the system settings row.
+
+inject_system_settings (every template render) and enforce_maintenance_mode
+(every request) used to call SystemSettings.get_settings(), which loaded
+every settings row and could delete duplicates from inside a read.
+current_settings() instead returns a detached snapshot held in this
+process. A request only queries when the snapshot is missing or was
+invalidated.
+
+Invalidation reaches every worker:
+- Any commit that writes a SystemSettings row (track_settings_writes)
+  drops the local snapshot and announces the change.
+- With REDIS_URL set, the change is published on the
+  "system_settings_changed" channel.
+- On Postgres, pg_notify() is sent on the same channel inside the writing
+  transaction, so it is only delivered if the transaction commits.
+- Each process runs one daemon thread subscribed to Redis, or LISTENing
+  on a dedicated Postgres connection, and drops its snapshot on every
+  message.
+
+While that listener is connected a snapshot lives up to MAX_AGE_LISTENING
+seconds, as a backstop for lost messages. Otherwise it lives up to
+MAX_AGE_UNLISTENED seconds. Poolers in transaction mode (pgbouncer, Neon's
+-pooler host) do not deliver LISTEN notifications. Behind one, set
+REDIS_URL or accept the shorter age.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from types import SimpleNamespace
+
+from models.user_models import db
+from models.system_settings import SystemSettings
+from sqlalchemy import text
+from utils import cache_utils
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'system_settings_changed'
+MAX_AGE_LISTENING = int(os.getenv('SETTINGS_CACHE_MAX_AGE', '300'))
+MAX_AGE_UNLISTENED = int(os.getenv('SETTINGS_CACHE_UNLISTENED_AGE', '30'))
+RECONNECT_SECONDS = 5
+
+_lock = threading.Lock()
+_state = {
+    'snapshot': None,
+    'loaded_at': 0.0,
+    'generation': 0,      # bumped by every invalidation; a load started earlier is discarded
+    'listening': False,
+    'listener': None,     # pid of the process whose listener thread is running
+}
+
+
+def _snapshot(row):
+    return SimpleNamespace(**{c.name: getattr(row, c.name) for c in SystemSettings.__table__.columns})
+
+
+def invalidate_settings():
+    """Drop this process's snapshot; the next current_settings() reloads it."""
+    with _lock:
+        _state['snapshot'] = None
+        _state['generation'] += 1
+
+
+def current_settings():
+    """Read-only snapshot of the settings row (attribute access like the model)."""
+    _ensure_listener()
+    now = time.monotonic()
+    with _lock:
+        snapshot = _state['snapshot']
+        max_age = MAX_AGE_LISTENING if _state['listening'] else MAX_AGE_UNLISTENED
+        if snapshot is not None and now - _state['loaded_at'] < max_age:
+            return snapshot
+        generation = _state['generation']
+
+    row = SystemSettings.get_settings()
+    snapshot = _snapshot(row)
+    if row.id is None:
+        # get_settings() fell back to in-memory defaults; do not keep them
+        return snapshot
+    with _lock:
+        if _state['generation'] == generation:
+            _state['snapshot'] = snapshot
+            _state['loaded_at'] = now
+    return snapshot
+
+
+# ---------------------------------------------------------------- announcing
+
+def _settings_changes(session, objects):
+    if not any(isinstance(obj, SystemSettings) for obj in objects):
+        return None
+    if session.get_bind().dialect.name == 'postgresql':
+        # Queued by the server and delivered only if this transaction commits
+        session.connection().execute(text("SELECT pg_notify(:channel, '')"), {'channel': CHANNEL})
+    return {True}
+
+
+def _announce(_):
+    invalidate_settings()
+    r = cache_utils.get_cache_redis()
+    if r is not None:
+        try:
+            r.publish(CHANNEL, '1')
+        except Exception as e:
+            logger.warning(f"[SETTINGS] Redis publish failed: {e}")
+
+
+def track_settings_writes():
+    """Invalidate cached settings in every process after a commit that writes them."""
+    cache_utils.track_commits(db.session, 'settings', _settings_changes, _announce)
+
+
+# ---------------------------------------------------------------- listening
+
+def _set_listening(value):
+    with _lock:
+        _state['listening'] = value
+    # Anything may have changed while we were not listening
+    invalidate_settings()
+
+
+def _listen_redis(url):
+    client = cache_utils.redis.Redis.from_url(url, health_check_interval=30)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    _set_listening(True)
+    for _ in pubsub.listen():
+        invalidate_settings()
+
+
+def _listen_postgres(engine):
+    raw = engine.raw_connection()
+    conn = raw.driver_connection
+    raw.detach()  # keep this connection out of the pool for good
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {CHANNEL}')
+        _set_listening(True)
+        while True:
+            if select.select([conn], [], [], 60) == ([], [], []):
+                # Idle: a cheap round trip notices a dropped connection
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                continue
+            conn.poll()
+            if conn.notifies:
+                conn.notifies.clear()
+                invalidate_settings()
+    finally:
+        conn.close()
+
+
+def _listen_forever(engine):
+    url = os.getenv('REDIS_URL')
+    use_redis = bool(url) and cache_utils.redis is not None
+    if not use_redis and engine.dialect.name != 'postgresql':
+        logger.info(f"[SETTINGS] No Redis or Postgres to listen on; snapshots expire after {MAX_AGE_UNLISTENED}s")
+        return
+    while True:
+        try:
+            if use_redis:
+                _listen_redis(url)
+            else:
+                _listen_postgres(engine)
+        except Exception as e:
+            logger.warning(f"[SETTINGS] Settings listener disconnected, retrying in {RECONNECT_SECONDS}s: {e}")
+        _set_listening(False)
+        time.sleep(RECONNECT_SECONDS)
+
+
+def _ensure_listener():
+    """Start this process's listener thread once (after any fork, on first use)."""
+    if _state['listener'] == os.getpid():
+        return
+    with _lock:
+        if _state['listener'] == os.getpid():
+            return
+        _state['listener'] = os.getpid()
+    threading.Thread(target=_listen_forever, args=(db.engine,), name='settings-listener', daemon=True).start()
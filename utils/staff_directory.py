@@ -0,0 +1,96 @@
+"""
+Headteacher staff directory in one query, cached per staff/salary version.
+
+api_staff used to load each user's StaffProfile, latest SalaryPayment and
+RoleSalary separately: three queries per staff member on every dashboard
+load. staff_directory() left-joins the profile and role salary and, with
+LEFT JOIN LATERAL (... ORDER BY payment_date DESC LIMIT 1), the latest
+payment (one probe of ix_salary_payments_user_date per user). The total for
+pagination comes from count(*) OVER () on the same query.
+
+Responses are cached under the "staff" version counter. track_staff_writes()
+bumps it after any commit that inserted, changed or deleted a user, role,
+staff profile, role salary or salary payment; Core writes that bypass the
+ORM (payroll runs) call bump_staff_version() themselves.
+"""
+from models.user_models import db, User, Role
+from models.salary_models import RoleSalary, SalaryPayment
+from models.staff_models import StaffProfile
+from sqlalchemy import select, func, or_, true
+from utils.cache_utils import get_version, bump_version, track_commits
+
+EXCLUDED_ROLES = ('Pupil', 'Parent')
+VERSION = 'staff'
+CACHE_TTL = 300
+MAX_PER_PAGE = 200
+
+_WATCHED = (User, Role, StaffProfile, RoleSalary, SalaryPayment)
+
+
+def staff_cache_key(*parts):
+    """Cache key for a staff listing under the current staff version."""
+    return ':'.join(['staff', f'v{get_version(VERSION)}'] + [str(p) for p in parts])
+
+
+def staff_directory(q=None, page=None, per_page=None):
+    """(rows, total) of staff with role, profile, expected salary and latest payment.
+
+    `q` matches first/last/full name, email or role. Without `page` every
+    matching row is returned.
+    """
+    latest = select(
+        SalaryPayment.id, SalaryPayment.amount, SalaryPayment.payment_date, SalaryPayment.status
+    ).where(SalaryPayment.user_id == User.id)\
+     .order_by(SalaryPayment.payment_date.desc(), SalaryPayment.id.desc())\
+     .limit(1).lateral('latest_payment')
+
+    query = db.session.query(
+        User.id, User.first_name, User.last_name, User.email, User.salary_amount,
+        Role.role_name,
+        StaffProfile.bank_name, StaffProfile.bank_account, StaffProfile.tax_id, StaffProfile.pay_grade,
+        func.coalesce(User.salary_amount, RoleSalary.amount).label('expected_salary'),
+        latest.c.id.label('payment_id'),
+        latest.c.amount.label('payment_amount'),
+        latest.c.payment_date,
+        latest.c.status.label('payment_status'),
+        func.count().over().label('total'),
+    ).select_from(User)\
+     .outerjoin(Role, Role.id == User.role_id)\
+     .outerjoin(StaffProfile, StaffProfile.staff_id == User.id)\
+     .outerjoin(RoleSalary, RoleSalary.role_id == User.role_id)\
+     .outerjoin(latest, true())\
+     .filter(or_(Role.role_name.is_(None), Role.role_name.notin_(EXCLUDED_ROLES)))
+
+    if q:
+        like = f"%{q.strip()}%"
+        query = query.filter(or_(
+            User.first_name.ilike(like),
+            User.last_name.ilike(like),
+            (User.first_name + ' ' + User.last_name).ilike(like),
+            User.email.ilike(like),
+            Role.role_name.ilike(like),
+        ))
+
+    query = query.order_by(User.first_name, User.last_name, User.id)
+    if page:
+        per_page = max(1, min(int(per_page or 50), MAX_PER_PAGE))
+        query = query.limit(per_page).offset((max(1, int(page)) - 1) * per_page)
+    rows = query.all()
+    total = rows[0].total if rows else 0
+    if page and not rows and int(page) > 1:
+        # Past the last page: the window count is lost with the rows
+        total = staff_directory(q, 1, 1)[1]
+    return rows, total
+
+
+def bump_staff_version():
+    bump_version(VERSION)
+
+
+def _staff_changes(session, objects):
+    return {True} if any(isinstance(obj, _WATCHED) for obj in objects) else None
+
+
+def track_staff_writes():
+    """Bump the staff version after commits that touch staff or salary rows."""
+    track_commits(db.session, 'staff', _staff_changes, lambda _: bump_staff_version())
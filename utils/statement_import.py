@@ -0,0 +1,334 @@
+"""
+Bulk import of bank / mobile-money statement CSVs.
+
+The file is read row by row (csv over the upload stream, never loaded
+whole). Each credit line is matched to a pupil by an admission number
+(HPF001) or receipt number (RCT-001) found in its reference or narration,
+using dict indexes built from one query over pupils. The amount is then
+spread over the pupil's outstanding fee items.
+
+Posting mirrors utils.fee_payments.post_payment for many pupils at once:
+the overall pupil_balances rows of every matched pupil are locked in one
+statement, outstanding amounts come from two grouped queries, all payments
+go in with one multi-row INSERT and the balances are refreshed once.
+Each line gets an idempotency key derived from its reference, so importing
+the same statement twice posts nothing the second time.
+
+Lines that cannot be posted (no pupil, several pupils, more than the pupil
+owes, unreadable amount) go to payment_import_review for the bursar.
+"""
+import csv
+import hashlib
+import io
+import re
+import uuid
+from datetime import datetime
+
+from models.user_models import db
+from models.register_pupils import Pupil, ClassFeeStructure, Payment, PaymentImportReview
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from utils.pupil_balances import refresh_pupil_balances
+from utils.fee_payments import lock_pupil_balances
+from utils.receipts import issue_receipts
+from utils.finance_rollup import add_inserted_rows
+
+# Accepted header names (lower-cased) for each field
+COLUMNS = {
+    'date': ('date', 'transaction date', 'txn date', 'value date', 'posting date', 'completion time'),
+    'reference': ('reference', 'ref', 'transaction id', 'transaction ref', 'txn id', 'receipt no', 'receipt no.',
+                  'bank reference'),
+    'narration': ('narration', 'description', 'details', 'particulars', 'remarks', 'bill ref number',
+                  'account'),
+    'amount': ('amount', 'credit', 'credit amount', 'paid in', 'deposit'),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d/%m/%Y', '%d/%m/%Y %H:%M',
+                '%d-%m-%Y', '%d.%m.%Y', '%d %b %Y', '%d-%b-%Y')
+TOKEN = re.compile(r'[A-Za-z0-9][A-Za-z0-9/-]*')
+
+
+def _normalise(value):
+    """Key for number lookups: upper case, letters and digits only (RCT-001 -> RCT001)."""
+    return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+
+def _parse_amount(value):
+    """'1,250,000' / 'UGX 50000' / '(2,000)' -> float; None for an empty cell.
+
+    Raises ValueError for anything else.
+    """
+    text = re.sub(r'(?i)ugx', '', (value or '').replace(',', '')).strip()
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')')
+    amount = float(text.strip('()'))
+    return -amount if negative else amount
+
+
+def _parse_date(value):
+    value = (value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _field_map(fieldnames):
+    """Map our field names to the CSV's actual headers."""
+    headers = {(name or '').strip().lower(): name for name in fieldnames or ()}
+    return {field: next((headers[a] for a in aliases if a in headers), None)
+            for field, aliases in COLUMNS.items()}
+
+
+def build_pupil_index():
+    """One pupil query -> ({normalised number: pupil_id}, {pupil_id: class_id}).
+
+    Numbers that more than one pupil claims map to None (ambiguous).
+    """
+    numbers, classes = {}, {}
+    rows = db.session.query(Pupil.id, Pupil.class_id, Pupil.admission_number, Pupil.receipt_number).all()
+    for pupil_id, class_id, admission_number, receipt_number in rows:
+        classes[pupil_id] = class_id
+        for number in (admission_number, receipt_number):
+            key = _normalise(number)
+            if key:
+                numbers[key] = pupil_id if numbers.get(key, pupil_id) == pupil_id else None
+    return numbers, classes
+
+
+def _match(text, numbers):
+    """Return (pupil_id, reason): the one pupil whose number appears in the text."""
+    found = set()
+    for token in TOKEN.findall(text or ''):
+        key = _normalise(token)
+        if key in numbers:
+            found.add(numbers[key])
+    if None in found:
+        return None, 'Number is shared by several pupils'
+    if len(found) > 1:
+        return None, 'Several pupils referenced'
+    if not found:
+        return None, 'No admission or receipt number found'
+    return found.pop(), None
+
+
+def _line_key(reference, when, amount, narration, row_number):
+    """Idempotency key for a statement line; stable across re-imports of the same file."""
+    if reference:
+        basis = f'ref|{reference.strip().upper()}'
+    else:
+        basis = f'row|{when}|{amount}|{(narration or "").strip()}|{row_number}'
+    return 'stmt:' + hashlib.sha1(basis.encode('utf-8')).hexdigest()
+
+
+def read_statement(stream, numbers):
+    """Yield one dict per data row of a statement CSV, matched against the pupil index."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline=''))
+    columns = _field_map(reader.fieldnames)
+    if not columns['amount']:
+        raise ValueError('The statement needs an Amount (or Credit / Paid In) column.')
+
+    for row_number, row in enumerate(reader, start=2):
+        cells = {field: (row.get(header) or '').strip() if header else '' for field, header in columns.items()}
+        line = {
+            'row_number': row_number,
+            'transaction_date': _parse_date(cells['date']),
+            'reference': cells['reference'][:100] or None,
+            'narration': cells['narration'][:255] or None,
+            'amount': 0.0,
+            'pupil_id': None,
+            'reason': None,
+        }
+        try:
+            amount = _parse_amount(cells['amount'])
+        except ValueError:
+            amount = None
+        if amount is None:
+            line['reason'] = f"Unreadable amount '{cells['amount']}'" if cells['amount'] else 'Missing amount'
+            yield line
+            continue
+        line['amount'] = amount
+        line['pupil_id'], line['reason'] = _match(f"{cells['reference']} {cells['narration']}", numbers)
+        yield line
+
+
+def post_statement_lines(lines, classes, payment_method=None, year=None, term=None, cashier_id=None):
+    """Post matched lines (dicts with pupil_id, amount, key, ...) in one INSERT.
+
+    Spreads each amount over the pupil's fee items in order and issues a
+    receipt per payment. Lines already
+    posted (same key) are skipped; lines worth more than the pupil owes get
+    a `reason` and are returned for review. Returns (posted, duplicates,
+    rejected). Runs inside the caller's transaction.
+    """
+    if not lines:
+        return [], [], []
+    pupil_ids = {line['pupil_id'] for line in lines}
+    lock_pupil_balances(pupil_ids)
+
+    keys = [line['key'] for line in lines]
+    done = {k for (k,) in db.session.query(Payment.idempotency_key).filter(Payment.idempotency_key.in_(keys))}
+
+    class_ids = {classes.get(p) for p in pupil_ids} - {None}
+    fees_by_class = {}
+    for fee in ClassFeeStructure.query.filter(ClassFeeStructure.class_id.in_(class_ids)).order_by(ClassFeeStructure.id):
+        fees_by_class.setdefault(fee.class_id, []).append(fee)
+    paid = {(p, f): float(total or 0) for p, f, total in db.session.query(
+        Payment.pupil_id, Payment.fee_id, func.sum(Payment.amount_paid)
+    ).filter(Payment.pupil_id.in_(pupil_ids)).group_by(Payment.pupil_id, Payment.fee_id)}
+
+    posted, duplicates, rejected, rows, seen = [], [], [], [], set()
+    for line in lines:
+        if line['key'] in done or line['key'] in seen:
+            duplicates.append(line)
+            continue
+        pupil_id = line['pupil_id']
+        fees = fees_by_class.get(classes.get(pupil_id), [])
+        outstanding = [(fee, fee.amount - paid.get((pupil_id, fee.id), 0)) for fee in fees]
+        outstanding = [(fee, owed) for fee, owed in outstanding if owed > 0]
+        if line['amount'] > sum(owed for _, owed in outstanding) + 0.005:
+            line['reason'] = 'Amount is more than the pupil owes' if outstanding else 'Pupil has nothing outstanding'
+            rejected.append(line)
+            continue
+
+        remaining, part = line['amount'], 0
+        for fee, owed in outstanding:
+            if remaining <= 0.005:
+                break
+            share = min(owed, remaining)
+            rows.append({
+                'pupil_id': pupil_id,
+                'fee_id': fee.id,
+                'amount_paid': share,
+                'payment_date': line['transaction_date'] or datetime.utcnow(),
+                'payment_method': payment_method,
+                'reference': line['reference'] or str(fee.id),
+                'status': 'completed',
+                'description': (line['narration'] or 'Statement import')[:255],
+                'year': int(year) if year else None,
+                'term': term or None,
+                'idempotency_key': line['key'] if part == 0 else f"{line['key']}:{part}",
+            })
+            paid[(pupil_id, fee.id)] = paid.get((pupil_id, fee.id), 0) + share
+            remaining -= share
+            part += 1
+        seen.add(line['key'])
+        posted.append(line)
+
+    if rows:
+        table = Payment.__table__
+        inserted = db.session.execute(pg_insert(table).values(rows)
+                                      .on_conflict_do_nothing(index_elements=['idempotency_key'])
+                                      .returning(table.c.id, table.c.amount_paid, table.c.payment_date,
+                                                 table.c.year, table.c.term, table.c.status)).mappings().all()
+        refresh_pupil_balances(pupil_ids={line['pupil_id'] for line in posted})
+        issue_receipts([row['id'] for row in inserted], cashier_id)
+        add_inserted_rows(Payment, inserted)
+    return posted, duplicates, rejected
+
+
+def queue_for_review(lines, batch_id, filename=None, payment_method=None, year=None, term=None):
+    """Insert unposted lines into payment_import_review with one statement.
+
+    Lines whose reference and amount are already queued (from an earlier
+    import of the same statement) are left out; returns how many were queued.
+    """
+    references = {line['reference'] for line in lines if line['reference']}
+    if references:
+        queued = set(db.session.query(PaymentImportReview.reference, PaymentImportReview.amount)
+                     .filter(PaymentImportReview.reference.in_(references)))
+        lines = [line for line in lines if (line['reference'], line['amount']) not in queued]
+    if not lines:
+        return 0
+    now = datetime.utcnow()
+    db.session.execute(PaymentImportReview.__table__.insert(), [{
+        'batch_id': batch_id,
+        'filename': (filename or '')[:255] or None,
+        'row_number': line['row_number'],
+        'transaction_date': line['transaction_date'],
+        'reference': line['reference'],
+        'narration': line['narration'],
+        'amount': line['amount'],
+        'reason': line['reason'][:255],
+        'pupil_id': line['pupil_id'],
+        'payment_method': payment_method,
+        'year': int(year) if year else None,
+        'term': term or None,
+        'status': 'pending',
+        'created_at': now,
+    } for line in lines])
+    return len(lines)
+
+
+def import_statement(stream, filename=None, payment_method=None, year=None, term=None, cashier_id=None):
+    """Import one statement CSV and commit. Returns a summary dict.
+
+    Raises ValueError when the file has no amount column.
+    """
+    batch_id = str(uuid.uuid4())
+    numbers, classes = build_pupil_index()
+
+    matched, review = [], []
+    rows = skipped = 0
+    for line in read_statement(stream, numbers):
+        rows += 1
+        if line['reason'] is None and line['amount'] <= 0:
+            skipped += 1  # debits and zero lines are not fee payments
+            continue
+        if line['pupil_id'] is None or line['reason']:
+            review.append(line)
+            continue
+        line['key'] = _line_key(line['reference'], line['transaction_date'], line['amount'],
+                                line['narration'], line['row_number'])
+        matched.append(line)
+
+    try:
+        posted, duplicates, rejected = post_statement_lines(matched, classes, payment_method, year, term, cashier_id)
+        review.extend(rejected)
+        queued = queue_for_review(review, batch_id, filename, payment_method, year, term)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'batch_id': batch_id,
+        'rows': rows,
+        'posted': len(posted),
+        'posted_amount': sum(line['amount'] for line in posted),
+        'duplicates': len(duplicates),
+        'review': queued,
+        'skipped': skipped,
+    }
+
+
+def resolve_review_item(item, pupil, cashier_id=None):
+    """Post a queued line to the given pupil; returns (success, message). Commits on success."""
+    key = 'review:' + str(item.id)
+    line = {
+        'row_number': item.row_number,
+        'transaction_date': item.transaction_date,
+        'reference': item.reference,
+        'narration': item.narration,
+        'amount': item.amount,
+        'pupil_id': pupil.id,
+        'key': key,
+        'reason': None,
+    }
+    try:
+        posted, duplicates, rejected = post_statement_lines(
+            [line], {pupil.id: pupil.class_id}, item.payment_method, item.year, item.term, cashier_id
+        )
+        if rejected:
+            db.session.rollback()
+            return False, rejected[0]['reason']
+        item.status = 'resolved'
+        item.pupil_id = pupil.id
+        item.resolved_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True, f"UGX {item.amount:,.0f} posted to {pupil.first_name} {pupil.last_name}."
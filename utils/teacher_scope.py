@@ -0,0 +1,132 @@
+"""
+Request-scoped teacher identity and assignment scope.
+
+Teacher pages used to look the user up twice in _require_teacher (user, then
+role). Handlers then re-read the teacher's TeacherAssignment rows and
+fetched Class and Stream objects one at a time, often several times per
+request. load_teacher_scope() runs once per request as a before_request hook
+on the teacher blueprints:
+
+    g.current_user   the logged-in User with its role eager-loaded (one query)
+    g.teacher_scope  for teachers, a TeacherScope of their assignments with
+                     class and stream names
+
+The scope authorises attendance and marks writes, so it is only cached when
+REDIS_URL gives every worker the same cache and version counters. It is then
+kept for SCOPE_TTL seconds under a per-teacher assignments version plus a
+global class/stream version. track_assignment_writes() bumps the teacher's
+version after any commit that adds, changes or removes a TeacherAssignment,
+and the global version after a Class or Stream change, so an assignment takes
+effect on the teacher's next request in every worker. Without Redis a bump
+would only reach the worker that made it, so the scope is read from the
+database (one query) on every request instead.
+"""
+from collections import namedtuple
+
+from flask import g, session
+from models.user_models import db, User
+from models.class_model import Class
+from models.stream_model import Stream
+from models.teacher_assignment_models import TeacherAssignment
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload
+from utils.cache_utils import cache_get, cache_set, get_version, bump_version, get_cache_redis, track_commits
+
+SCOPE_TTL = 120
+TEACHER_ROLE = 'Teacher'
+CLASSES_VERSION = 'classes'
+
+Assignment = namedtuple('Assignment', 'id class_id stream_id class_name stream_name')
+
+
+def _assignments_version(teacher_id):
+    return f"assignments:{teacher_id}"
+
+
+class TeacherScope:
+    """A teacher's class/stream assignments, in assignment order."""
+
+    def __init__(self, teacher_id, assignments):
+        self.teacher_id = teacher_id
+        self.assignments = assignments
+
+    def __bool__(self):
+        return bool(self.assignments)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def __iter__(self):
+        return iter(self.assignments)
+
+    def covers(self, class_id, stream_id=None):
+        """True if the teacher is assigned to the class (and stream, when given)."""
+        return any(a.class_id == class_id and (stream_id is None or a.stream_id == stream_id)
+                   for a in self.assignments)
+
+    def class_name(self, class_id):
+        return next((a.class_name for a in self.assignments if a.class_id == class_id), None)
+
+    def stream_name(self, stream_id):
+        return next((a.stream_name for a in self.assignments if a.stream_id == stream_id), None)
+
+
+def _load_assignments(teacher_id):
+    rows = db.session.query(
+        TeacherAssignment.id, TeacherAssignment.class_id, TeacherAssignment.stream_id,
+        Class.name, Stream.name,
+    ).outerjoin(Class, Class.id == TeacherAssignment.class_id)\
+     .outerjoin(Stream, Stream.id == TeacherAssignment.stream_id)\
+     .filter(TeacherAssignment.teacher_id == teacher_id)\
+     .order_by(TeacherAssignment.id).all()
+    return [list(r) for r in rows]
+
+
+def teacher_scope(teacher_id):
+    """The teacher's scope; from the shared cache when the assignment versions are unchanged."""
+    if get_cache_redis() is None:
+        return TeacherScope(teacher_id, [Assignment(*r) for r in _load_assignments(teacher_id)])
+    key = (f"teacher_scope:{teacher_id}:v{get_version(_assignments_version(teacher_id))}"
+           f":c{get_version(CLASSES_VERSION)}")
+    cached = cache_get(key)
+    if cached is None:
+        cached = _load_assignments(teacher_id)
+        cache_set(key, cached, ttl=SCOPE_TTL)
+    return TeacherScope(teacher_id, [Assignment(*r) for r in cached])
+
+
+def load_teacher_scope():
+    """before_request: resolve the session user, and a teacher's scope, into flask.g."""
+    g.current_user = None
+    g.teacher_scope = None
+    user_id = session.get('user_id')
+    if not user_id:
+        return
+    g.current_user = User.query.options(joinedload(User.role)).filter(User.id == user_id).first()
+    if g.current_user is not None and g.current_user.role and g.current_user.role.role_name == TEACHER_ROLE:
+        g.teacher_scope = teacher_scope(g.current_user.id)
+
+
+# ---------------------------------------------------------------- invalidation
+
+def _assignment_changes(session, objects):
+    """Teacher ids whose assignments changed, plus CLASSES_VERSION for a class/stream change."""
+    changed = set()
+    for obj in objects:
+        if isinstance(obj, TeacherAssignment):
+            # Moving an assignment to another teacher changes the previous teacher too
+            history = inspect(obj).attrs.teacher_id.history
+            changed.update(int(t) for t in [obj.teacher_id, *(history.deleted or ())] if t is not None)
+        elif isinstance(obj, (Class, Stream)):
+            changed.add(CLASSES_VERSION)
+    return changed
+
+
+def _bump_scopes(changed):
+    for item in changed:
+        bump_version(CLASSES_VERSION if item == CLASSES_VERSION else _assignments_version(item))
+
+
+def track_assignment_writes():
+    """Bump the scope versions after commits that touch assignments, classes or streams."""
+    track_commits(db.session, 'assignments', _assignment_changes, _bump_scopes)
@@ -0,0 +1,126 @@
+"""
+Cached timetable reads.
+
+Each class/stream timetable has a row in timetable_versions that is bumped
+in the same transaction as any generate or edit. Read endpoints turn it into
+an ETag, so a client revalidating an unchanged timetable costs one primary
+key lookup and never touches timetable_slots.
+
+A teacher's week spans every class/stream they teach, so it is built from a
+single query on timetable_slots filtered by teacher_id (served by
+ix_timetable_slots_teacher_day_start) with the subject, class and stream
+names joined in. With REDIS_URL set the result is cached per teacher in
+Redis; every code path that regenerates or edits slots calls
+invalidate_teacher_timetables() with the teachers it touched, which reaches
+every worker. Without Redis a delete would only reach the worker that made
+the edit, so the week is queried on every request instead.
+"""
+from models.user_models import db
+from models.class_model import Class
+from models.stream_model import Stream
+from models.marks_model import Subject
+from models.timetable_model import TimeTableSlot, TimeTableVersion
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime
+from utils.cache_utils import cache_get, cache_set, cache_delete, get_cache_redis
+
+DAY_ORDER = {day: i for i, day in enumerate(TimeTableSlot.get_days())}
+
+
+def _teacher_key(teacher_id):
+    return f"timetable:teacher:{teacher_id}"
+
+
+def teacher_timetable(teacher_id):
+    """Return {'teacher_id': ..., 'slots': [...]} for every slot the teacher holds."""
+    key = _teacher_key(teacher_id)
+    shared = get_cache_redis() is not None
+    cached = cache_get(key) if shared else None
+    if cached is not None:
+        return cached
+
+    rows = db.session.query(
+        TimeTableSlot.id,
+        TimeTableSlot.day_of_week,
+        TimeTableSlot.start_time,
+        TimeTableSlot.end_time,
+        TimeTableSlot.classroom,
+        TimeTableSlot.class_id,
+        Class.name,
+        TimeTableSlot.stream_id,
+        Stream.name,
+        TimeTableSlot.subject_id,
+        Subject.name,
+    ).join(Class, Class.id == TimeTableSlot.class_id)\
+     .join(Stream, Stream.id == TimeTableSlot.stream_id)\
+     .join(Subject, Subject.id == TimeTableSlot.subject_id)\
+     .filter(TimeTableSlot.teacher_id == teacher_id)\
+     .order_by(TimeTableSlot.day_of_week, TimeTableSlot.start_time).all()
+
+    slots = [{
+        'id': r[0],
+        'day_of_week': r[1],
+        'start_time': r[2],
+        'end_time': r[3],
+        'classroom': r[4] or '',
+        'class_id': r[5],
+        'class_name': r[6],
+        'stream_id': r[7],
+        'stream_name': r[8],
+        'subject_id': r[9],
+        'subject_name': r[10],
+    } for r in rows]
+    slots.sort(key=lambda s: (DAY_ORDER.get(s['day_of_week'], len(DAY_ORDER)), s['start_time']))
+
+    data = {'teacher_id': teacher_id, 'slots': slots}
+    if shared:
+        cache_set(key, data)
+    return data
+
+
+def invalidate_teacher_timetables(teacher_ids):
+    """Drop cached weeks for the given teachers."""
+    cache_delete(*[_teacher_key(t) for t in set(teacher_ids) if t is not None])
+
+
+def timetable_version(class_id, stream_id):
+    """Return the change counter for a class/stream (0 if never generated)."""
+    row = db.session.get(TimeTableVersion, (class_id, stream_id))
+    return row.version if row else 0
+
+
+def timetable_etag(class_id, stream_id):
+    """ETag value for a class/stream timetable."""
+    return f"tt-{class_id}-{stream_id}-{timetable_version(class_id, stream_id)}"
+
+
+def timetables_etag():
+    """ETag value covering every class/stream timetable (any bump changes it)."""
+    count, total = db.session.query(
+        func.count(TimeTableVersion.class_id),
+        func.coalesce(func.sum(TimeTableVersion.version), 0)
+    ).one()
+    return f"tt-all-{count}-{total}"
+
+
+def bump_timetable_versions(owners):
+    """Increment the counter of each (class_id, stream_id) in owners.
+
+    Runs inside the caller's transaction; commit together with the slot
+    changes so readers never see new slots under an old ETag.
+    """
+    owners = sorted(set(owners))
+    if not owners:
+        return
+    now = datetime.utcnow()
+    stmt = pg_insert(TimeTableVersion.__table__).values([
+        {'class_id': c, 'stream_id': s, 'version': 1, 'updated_at': now} for c, s in owners
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['class_id', 'stream_id'],
+        set_={
+            'version': TimeTableVersion.__table__.c.version + 1,
+            'updated_at': now
+        }
+    ))
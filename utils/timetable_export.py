@@ -0,0 +1,279 @@
+"""
+Whole-school timetable export to XLSX and iCalendar.
+
+Both exports read timetable_slots once, joined to teacher, subject, class
+and stream names, in a single ordered query fetched in batches (yield_per),
+so memory stays bounded by one batch plus one row per open sheet or one
+teacher's events, however large the school is.
+
+XLSX: xlsxwriter in constant_memory mode writes each sheet row by row to a
+temporary file. Rows arrive ordered by (start_time, day), so every stream
+and every teacher sheet can be filled in the same pass: a sheet's current
+row is the period being read, and the day picks the column.
+
+iCalendar: one VEVENT per slot with a weekly RRULE, starting on the first
+matching weekday of the term and repeating until the term ends.
+"""
+import os
+import tempfile
+import zipfile
+from datetime import datetime, date, timedelta
+
+import xlsxwriter
+
+from models.user_models import db, User
+from models.class_model import Class
+from models.stream_model import Stream
+from models.marks_model import Subject
+from models.term_model import Term
+from models.timetable_model import TimeTableSlot
+from sqlalchemy import case
+
+DAYS = TimeTableSlot.get_days()
+ICAL_DAYS = {'Monday': 'MO', 'Tuesday': 'TU', 'Wednesday': 'WE', 'Thursday': 'TH',
+             'Friday': 'FR', 'Saturday': 'SA', 'Sunday': 'SU'}
+TIMEZONE = 'Africa/Kampala'  # East African Time, UTC+3 all year
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+_day_order = case({day: i for i, day in enumerate(DAYS)}, value=TimeTableSlot.day_of_week, else_=len(DAYS))
+
+
+def _slot_rows(order_by, teacher_id=None):
+    """The one ordered query both exports stream from."""
+    query = db.session.query(
+        TimeTableSlot.id,
+        TimeTableSlot.day_of_week,
+        TimeTableSlot.start_time,
+        TimeTableSlot.end_time,
+        TimeTableSlot.classroom,
+        TimeTableSlot.class_id,
+        Class.name,
+        TimeTableSlot.stream_id,
+        Stream.name,
+        TimeTableSlot.teacher_id,
+        User.first_name,
+        User.last_name,
+        Subject.name,
+    ).join(Class, Class.id == TimeTableSlot.class_id)\
+     .join(Stream, Stream.id == TimeTableSlot.stream_id)\
+     .join(User, User.id == TimeTableSlot.teacher_id)\
+     .join(Subject, Subject.id == TimeTableSlot.subject_id)
+    if teacher_id is not None:
+        query = query.filter(TimeTableSlot.teacher_id == teacher_id)
+    return query.order_by(*order_by).yield_per(BATCH_SIZE)
+
+
+def stream_file(path):
+    """Yield a file in chunks, then delete it."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _temp_path(suffix):
+    handle, path = tempfile.mkstemp(suffix=suffix, prefix='timetable_')
+    os.close(handle)
+    return path
+
+
+# ---------------------------------------------------------------- XLSX
+
+def _sheet_name(name, used):
+    """Excel sheet names: at most 31 chars, unique, none of []:*?/\\."""
+    for ch in '[]:*?/\\':
+        name = name.replace(ch, ' ')
+    name = name.strip()[:31] or 'Sheet'
+    candidate, n = name, 2
+    while candidate.lower() in used:
+        suffix = f' ({n})'
+        candidate = name[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def export_timetables_xlsx():
+    """Write every stream's and every teacher's timetable to a temporary XLSX file.
+
+    Returns the file path; the caller streams it with stream_file().
+    """
+    path = _temp_path('.xlsx')
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_fmt = workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'border': 1})
+    time_fmt = workbook.add_format({'bold': True, 'border': 1})
+    cell_fmt = workbook.add_format({'text_wrap': True, 'valign': 'top', 'border': 1})
+
+    # Sheet order is alphabetical; names come from the small lookup tables
+    used = set()
+    sheets = {}
+
+    def add_sheet(key, title):
+        ws = workbook.add_worksheet(_sheet_name(title, used))
+        ws.set_column(0, 0, 13)
+        ws.set_column(1, len(DAYS), 24)
+        ws.write_row(0, 0, ['Time'] + DAYS, header_fmt)
+        sheets[key] = {'ws': ws, 'row': 0, 'start': None}
+
+    owners = db.session.query(Class.id, Class.name, Stream.id, Stream.name)\
+        .join(TimeTableSlot, TimeTableSlot.class_id == Class.id)\
+        .join(Stream, Stream.id == TimeTableSlot.stream_id)\
+        .distinct().order_by(Class.name, Stream.name).all()
+    for class_id, class_name, stream_id, stream_name in owners:
+        add_sheet(('stream', class_id, stream_id), f'{class_name} {stream_name}')
+
+    teachers = db.session.query(User.id, User.first_name, User.last_name)\
+        .join(TimeTableSlot, TimeTableSlot.teacher_id == User.id)\
+        .distinct().order_by(User.first_name, User.last_name).all()
+    for teacher_id, first_name, last_name in teachers:
+        add_sheet(('teacher', teacher_id), f'T - {first_name} {last_name}')
+
+    def put(key, day, start, end, text):
+        sheet = sheets.get(key)
+        if sheet is None or day not in DAYS:
+            return
+        if sheet['start'] != start:
+            sheet['row'] += 1
+            sheet['start'] = start
+            sheet['ws'].write(sheet['row'], 0, f'{start}-{end}', time_fmt)
+        sheet['ws'].write(sheet['row'], DAYS.index(day) + 1, text, cell_fmt)
+
+    for (slot_id, day, start, end, room, class_id, class_name, stream_id, stream_name,
+         teacher_id, first_name, last_name, subject_name) in _slot_rows([TimeTableSlot.start_time, _day_order]):
+        room_text = f' ({room})' if room else ''
+        put(('stream', class_id, stream_id), day, start, end,
+            f'{subject_name}\n{first_name} {last_name}{room_text}')
+        put(('teacher', teacher_id), day, start, end,
+            f'{subject_name}\n{class_name} {stream_name}{room_text}')
+
+    workbook.close()
+    return path
+
+
+# ---------------------------------------------------------------- iCalendar
+
+def _ical_escape(value):
+    return (str(value or '').replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Fold a content line at 75 octets as RFC 5545 requires."""
+    raw = line.encode('utf-8')
+    if len(raw) <= 75:
+        return line + '\r\n'
+    parts, chunk = [], b''
+    for ch in line:
+        encoded = ch.encode('utf-8')
+        if len(chunk) + len(encoded) > (75 if not parts else 74):
+            parts.append(chunk.decode('utf-8'))
+            chunk = b''
+        chunk += encoded
+    parts.append(chunk.decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def term_bounds(start=None, until=None):
+    """First and last teaching date for recurring events.
+
+    Defaults to the term containing today (or the next one), falling back to
+    the Monday of the current week with no end date.
+    """
+    if start is None:
+        today = date.today()
+        term = Term.query.filter(Term.end_date >= today).order_by(Term.start_date.asc()).first()
+        if term is not None:
+            start = term.start_date
+            until = until or term.end_date
+        else:
+            start = today - timedelta(days=today.weekday())
+    return start, until
+
+
+def _calendar_header(name):
+    return ''.join(_fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//School Management System//Timetable//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_ical_escape(name)}',
+        f'X-WR-TIMEZONE:{TIMEZONE}',
+        'BEGIN:VTIMEZONE',
+        f'TZID:{TIMEZONE}',
+        'BEGIN:STANDARD',
+        'DTSTART:19700101T000000',
+        'TZOFFSETFROM:+0300',
+        'TZOFFSETTO:+0300',
+        'TZNAME:EAT',
+        'END:STANDARD',
+        'END:VTIMEZONE',
+    ])
+
+
+def _event(row, start_date, until, stamp):
+    (slot_id, day, start, end, room, _class_id, class_name, _stream_id, stream_name,
+     _teacher_id, _first_name, _last_name, subject_name) = row
+    if day not in ICAL_DAYS:
+        return ''
+    first = start_date + timedelta(days=(DAYS.index(day) - start_date.weekday()) % 7)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:timetable-slot-{slot_id}@school-management-system',
+        f'DTSTAMP:{stamp}',
+        f"DTSTART;TZID={TIMEZONE}:{first:%Y%m%d}T{start.replace(':', '')}00",
+        f"DTEND;TZID={TIMEZONE}:{first:%Y%m%d}T{end.replace(':', '')}00",
+        'RRULE:FREQ=WEEKLY;BYDAY=' + ICAL_DAYS[day] + (f';UNTIL={until:%Y%m%d}T235959Z' if until else ''),
+        f'SUMMARY:{_ical_escape(f"{subject_name} - {class_name} {stream_name}")}',
+    ]
+    if room:
+        lines.append(f'LOCATION:{_ical_escape(room)}')
+    lines.append('END:VEVENT')
+    return ''.join(_fold(line) for line in lines)
+
+
+def teacher_ics(teacher_id, teacher_name, start=None, until=None):
+    """Yield one teacher's calendar as text chunks."""
+    start, until = term_bounds(start, until)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    yield _calendar_header(f'Timetable - {teacher_name}')
+    for row in _slot_rows([_day_order, TimeTableSlot.start_time], teacher_id=teacher_id):
+        yield _event(row, start, until, stamp)
+    yield 'END:VCALENDAR\r\n'
+
+
+def export_teacher_ics_zip(start=None, until=None):
+    """Write one .ics per teacher into a temporary zip file and return its path.
+
+    Rows are ordered by teacher, so each calendar is finished and written to
+    the archive before the next teacher's rows are read.
+    """
+    start, until = term_bounds(start, until)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    path = _temp_path('.zip')
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        current, handle = None, None
+        rows = _slot_rows([User.first_name, User.last_name, TimeTableSlot.teacher_id, _day_order, TimeTableSlot.start_time])
+        for row in rows:
+            teacher_id, first_name, last_name = row[9], row[10], row[11]
+            if teacher_id != current:
+                if handle is not None:
+                    handle.write(b'END:VCALENDAR\r\n')
+                    handle.close()
+                current = teacher_id
+                filename = f"{first_name}_{last_name}_{teacher_id}.ics".replace(' ', '_').replace('/', '_')
+                handle = archive.open(filename, 'w')
+                handle.write(_calendar_header(f'Timetable - {first_name} {last_name}').encode('utf-8'))
+            handle.write(_event(row, start, until, stamp).encode('utf-8'))
+        if handle is not None:
+            handle.write(b'END:VCALENDAR\r\n')
+            handle.close()
+    return path
@@ -0,0 +1,164 @@
+"""
+In-memory occupancy index for timetable generation.
+
+Availability checks used to be one `timetable_slots` query per candidate
+teacher per lesson. The index below loads every slot once and answers the
+same question with bit operations: for each (resource, day) it keeps one
+minute bitmap per owning class/stream, where bit N set means "busy during
+minute N after midnight". The resource is the teacher by default, or the
+classroom for an index built with `OccupancyIndex.load('classroom')`.
+"""
+from models.user_models import db
+from models.timetable_model import TimeTableSlot
+
+
+def time_to_minutes(value):
+    """Convert an 'HH:MM' string to minutes since midnight."""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def minutes_to_time(value):
+    """Convert minutes since midnight back to an 'HH:MM' string."""
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+
+def room_key(classroom):
+    """Normalised classroom name, or None when the slot has no room."""
+    room = (classroom or '').strip()
+    return room or None
+
+
+def _interval_mask(start_minute, end_minute):
+    """Bitmap with bits [start_minute, end_minute) set."""
+    if end_minute <= start_minute:
+        return 0
+    return ((1 << (end_minute - start_minute)) - 1) << start_minute
+
+
+class OccupancyIndex:
+    """Resource -> day -> minute bitmap, partitioned by owning (class_id, stream_id).
+
+    Keeping the bitmaps per owner lets the generator ignore the slots of the
+    stream it is about to replace without touching the database, and lets a
+    freshly persisted stream swap its old bookings for the new ones.
+    """
+
+    def __init__(self):
+        # (resource, day) -> {(class_id, stream_id): bitmap}
+        self._busy = {}
+        # (class_id, stream_id) -> set of (resource, day) keys it occupies
+        self._owner_keys = {}
+
+    @classmethod
+    def load(cls, resource='teacher'):
+        """Build the index from every existing timetable slot in one query.
+
+        `resource` is 'teacher' (keyed by teacher_id) or 'classroom' (keyed
+        by room_key(); slots without a room are skipped).
+        """
+        index = cls()
+        column = TimeTableSlot.classroom if resource == 'classroom' else TimeTableSlot.teacher_id
+        rows = db.session.query(
+            column,
+            TimeTableSlot.class_id,
+            TimeTableSlot.stream_id,
+            TimeTableSlot.day_of_week,
+            TimeTableSlot.start_time,
+            TimeTableSlot.end_time,
+        ).all()
+        for key, class_id, stream_id, day, start, end in rows:
+            if resource == 'classroom':
+                key = room_key(key)
+                if key is None:
+                    continue
+            index.book(key, day, start, end, owner=(class_id, stream_id))
+        return index
+
+    def book(self, resource, day, start_time, end_time, owner=None):
+        """Mark the resource busy on `day` during [start_time, end_time)."""
+        mask = _interval_mask(time_to_minutes(start_time), time_to_minutes(end_time))
+        key = (resource, day)
+        owners = self._busy.setdefault(key, {})
+        owners[owner] = owners.get(owner, 0) | mask
+        self._owner_keys.setdefault(owner, set()).add(key)
+
+    def is_free(self, resource, day, start_time, end_time, exclude_owner=None):
+        """Return True if the resource has no booking overlapping [start_time, end_time).
+
+        Bookings belonging to `exclude_owner` (a (class_id, stream_id) tuple)
+        are ignored, mirroring `teacher_has_overlap(exclude_class_id=...,
+        exclude_stream_id=...)`.
+        """
+        owners = self._busy.get((resource, day))
+        if not owners:
+            return True
+        mask = _interval_mask(time_to_minutes(start_time), time_to_minutes(end_time))
+        for owner, bits in owners.items():
+            if owner != exclude_owner and bits & mask:
+                return False
+        return True
+
+    def resources_of(self, owner):
+        """Return the resources (teachers or rooms) the owner currently books."""
+        return {resource for resource, _day in self._owner_keys.get(owner, ())}
+
+    def release_owner(self, owner):
+        """Drop every booking held by the given (class_id, stream_id)."""
+        for key in self._owner_keys.pop(owner, ()):
+            owners = self._busy.get(key)
+            if owners is None:
+                continue
+            owners.pop(owner, None)
+            if not owners:
+                del self._busy[key]
+
+    def replace_owner(self, owner, slots, resource='teacher'):
+        """Swap an owner's bookings for the given TimeTableSlot-like objects."""
+        self.release_owner(owner)
+        for slot in slots:
+            key = room_key(slot.classroom) if resource == 'classroom' else slot.teacher_id
+            if key is not None:
+                self.book(key, slot.day_of_week, slot.start_time, slot.end_time, owner=owner)
+
+
+def find_conflicts(slots, changed_ids=None):
+    """Return every double booking in a set of slot dicts.
+
+    `slots` is the complete proposed state: dicts with id, teacher_id,
+    class_id, stream_id, day_of_week, start_time, end_time and classroom.
+    A teacher, a class/stream and a classroom (when set) may each hold only
+    one slot at a time. When `changed_ids` is given, only conflicts that
+    involve at least one of those slots are reported, so pre-existing
+    problems elsewhere do not block an edit.
+    """
+    resources = {}
+    for slot in slots:
+        start = time_to_minutes(slot['start_time'])
+        end = time_to_minutes(slot['end_time'])
+        day = slot['day_of_week']
+        entry = (start, end, slot['id'])
+        resources.setdefault(('teacher', slot['teacher_id'], day), []).append(entry)
+        resources.setdefault(('stream', (slot['class_id'], slot['stream_id']), day), []).append(entry)
+        room = room_key(slot.get('classroom'))
+        if room:
+            resources.setdefault(('classroom', room, day), []).append(entry)
+
+    conflicts = []
+    for (kind, resource, day), entries in resources.items():
+        if len(entries) < 2:
+            continue
+        entries.sort()
+        # Sweep in start order, remembering the booking that ends last
+        last_end, last_id = entries[0][1], entries[0][2]
+        for start, end, slot_id in entries[1:]:
+            if start < last_end and (changed_ids is None or slot_id in changed_ids or last_id in changed_ids):
+                conflicts.append({
+                    'type': kind,
+                    'resource': resource if kind != 'stream' else list(resource),
+                    'day_of_week': day,
+                    'slot_ids': sorted([last_id, slot_id]),
+                })
+            if end > last_end:
+                last_end, last_id = end, slot_id
+    return conflicts
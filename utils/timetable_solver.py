@@ -0,0 +1,479 @@
+"""
+Whole-school timetable solver.
+
+The greedy generator fills one stream at a time, so early streams take the
+free teachers and later streams run out. This module solves every stream in
+one pass, entirely in memory, in two phases:
+
+1. Teacher allocation (constraint search). Each stream needs a fixed number
+   of lessons per subject per week. Every (stream, subject) demand gets one
+   qualified teacher, subject to each teacher's weekly capacity. Demands are
+   searched most-constrained-first with forward checking and backtracking.
+
+2. Period allocation (graph coloring). Lessons become edges of a bipartite
+   stream/teacher multigraph and periods become colors. No vertex has more
+   lessons than there are periods, so a proper edge coloring always exists
+   (König's theorem) and is found with alternating-path recoloring. A proper
+   coloring is exactly a conflict-free timetable: no stream and no teacher is
+   in two places in the same period.
+
+Lessons of streams outside the run that stay in place are passed in as
+bookings: their teachers and rooms are unavailable in the periods they
+overlap. Those blocked periods are fixed colors the recoloring may not move,
+so the König guarantee no longer holds and phase 2 can fail; the solver then
+reports the conflict instead of returning a double-booked timetable.
+
+Nothing here touches the database; callers load the inputs and persist the
+returned slots.
+"""
+from collections import defaultdict
+
+DEFAULT_SEARCH_LIMIT = 200000
+BOOKED_RETRIES = 3
+
+# at_vertex marker for a period blocked by a booking outside the run
+_BOOKED = -1
+
+
+def _minutes(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def _booked_periods(booked, periods):
+    """Map each booked teacher and room to the period indexes its bookings overlap.
+
+    `booked` is an iterable of (teacher_id, classroom, day_of_week, start, end).
+    Returns ({teacher_id: set(period indexes)}, {classroom: set(period indexes)}).
+    """
+    spans = [(day, _minutes(start), _minutes(end)) for day, start, end in periods]
+    teacher_busy = defaultdict(set)
+    room_busy = defaultdict(set)
+    for teacher_id, classroom, day, start, end in booked:
+        start, end = _minutes(start), _minutes(end)
+        hit = {i for i, (p_day, p_start, p_end) in enumerate(spans)
+               if p_day == day and p_start < end and start < p_end}
+        if teacher_id is not None:
+            teacher_busy[teacher_id] |= hit
+        room = (classroom or '').strip()
+        if room:
+            room_busy[room] |= hit
+    return teacher_busy, room_busy
+
+
+def subject_lesson_counts(subject_ids, periods_per_week):
+    """Spread a week's periods as evenly as possible across subjects.
+
+    Returns {subject_id: lessons_per_week}; the first `periods % subjects`
+    subjects get one extra lesson.
+    """
+    subject_ids = list(subject_ids)
+    if not subject_ids:
+        return {}
+    base, extra = divmod(periods_per_week, len(subject_ids))
+    counts = {}
+    for i, subject_id in enumerate(subject_ids):
+        count = base + (1 if i < extra else 0)
+        if count:
+            counts[subject_id] = count
+    return counts
+
+
+def _allocate_teachers(demands, qualified, capacity, search_limit):
+    """Phase 1: give every demand a teacher without exceeding any capacity.
+
+    `demands` is a list of dicts with 'owner', 'subject_id', 'count' and an
+    optional 'teacher_id' (pre-assigned). Returns (True, {index: teacher_id})
+    or (False, reason).
+    """
+    remaining = dict(capacity)
+    assignment = {}
+
+    # Pre-assigned demands (class teachers) are forced moves
+    for i, demand in enumerate(demands):
+        teacher_id = demand.get('teacher_id')
+        if teacher_id is None:
+            continue
+        if remaining.get(teacher_id, 0) < demand['count']:
+            return False, f"Teacher {teacher_id} does not have capacity for {demand['count']} lessons"
+        remaining[teacher_id] -= demand['count']
+        assignment[i] = teacher_id
+
+    # Demands with the same subject and lesson count are interchangeable, so
+    # the search works on groups of them rather than on individual demands.
+    groups = defaultdict(list)
+    for i, demand in enumerate(demands):
+        if i not in assignment:
+            groups[(demand['subject_id'], demand['count'])].append(i)
+
+    def domain(key):
+        subject_id, count = key
+        return [t for t in qualified[subject_id] if remaining[t] >= count]
+
+    def most_constrained():
+        best_key, best_domain = None, None
+        for key, members in groups.items():
+            if not members:
+                continue
+            values = domain(key)
+            if not values:
+                return key, values
+            # Fewest candidate teachers first, then the biggest lessons
+            if best_domain is None or (len(values), -key[1]) < (len(best_domain), -best_key[1]):
+                best_key, best_domain = key, values
+        return best_key, best_domain
+
+    def advance(frame):
+        """Assign the frame's next candidate that still has capacity."""
+        key, index, values, pos = frame
+        while pos < len(values):
+            teacher_id = values[pos]
+            if remaining[teacher_id] >= key[1]:
+                frame[3] = pos
+                assignment[index] = teacher_id
+                remaining[teacher_id] -= key[1]
+                return True
+            pos += 1
+        frame[3] = pos
+        return False
+
+    stack = []  # frames: [group key, demand index, candidate teachers, position]
+    nodes = 0
+    while True:
+        key, values = most_constrained()
+        if key is None:
+            break
+        if values:
+            nodes += 1
+            if nodes > search_limit:
+                return False, f"Search limit of {search_limit} steps reached before a teacher allocation was found"
+            # Least-loaded teacher first keeps capacity spread out
+            values.sort(key=lambda t: (-remaining[t], t))
+            frame = [key, groups[key].pop(), values, 0]
+            advance(frame)
+            stack.append(frame)
+            continue
+
+        # Dead end: some subject has no teacher left with enough capacity
+        stuck_subject = key[0]
+        while True:
+            if not stack:
+                return False, f"No teacher allocation satisfies every subject (ran out of teachers for subject {stuck_subject})"
+            frame = stack[-1]
+            frame_key, index = frame[0], frame[1]
+            teacher_id = assignment.pop(index)
+            remaining[teacher_id] += frame_key[1]
+            frame[3] += 1
+            nodes += 1
+            if nodes > search_limit:
+                return False, f"Search limit of {search_limit} steps reached before a teacher allocation was found"
+            if advance(frame):
+                break
+            stack.pop()
+            groups[frame_key].append(index)
+
+    return True, assignment
+
+
+def _color_lessons(lessons, periods, teacher_busy=None):
+    """Phase 2: assign a period index to every lesson.
+
+    `lessons` is a list of (owner, teacher_id, subject_id). Uses alternating
+    path recoloring for bipartite edge coloring. `teacher_busy` maps teacher
+    ids to period indexes they cannot use. Returns a list of period indexes
+    aligned with `lessons`, or None if a lesson could not be placed around
+    those periods.
+    """
+    period_count = len(periods)
+    period_days = [p[0] for p in periods]
+    # vertex -> {period index: lesson index, or _BOOKED}
+    at_vertex = defaultdict(dict)
+    for teacher_id, busy in (teacher_busy or {}).items():
+        at_vertex[('t', teacher_id)].update((c, _BOOKED) for c in busy)
+    colors = [None] * len(lessons)
+    # (owner, subject_id) -> {day: lessons placed}, used to spread a subject over the week
+    subject_days = defaultdict(lambda: defaultdict(int))
+
+    for i, (owner, teacher_id, subject_id) in enumerate(lessons):
+        s_vertex = ('s', owner)
+        t_vertex = ('t', teacher_id)
+        s_used = at_vertex[s_vertex]
+        t_used = at_vertex[t_vertex]
+
+        spread = subject_days[(owner, subject_id)]
+        best = None
+        for c in range(period_count):
+            if c in s_used or c in t_used:
+                continue
+            score = spread[period_days[c]]
+            if best is None or score < best[0]:
+                best = (score, c)
+                if score == 0:
+                    break
+
+        if best is not None:
+            color = best[1]
+        else:
+            color = _recolor(lessons, colors, at_vertex, s_vertex, t_vertex, period_count)
+            if color is None:
+                return None
+
+        colors[i] = color
+        at_vertex[s_vertex][color] = i
+        at_vertex[t_vertex][color] = i
+        spread[period_days[color]] += 1
+
+    return colors
+
+
+def _recolor(lessons, colors, at_vertex, s_vertex, t_vertex, period_count):
+    """Free a period for a new lesson between s_vertex and t_vertex.
+
+    For a color `a` free at the stream and `b` free at the teacher, swap a
+    and b along the alternating path starting at the teacher (freeing `a`
+    there) or at the stream (freeing `b` there). In a bipartite graph neither
+    path reaches the other end, so the freed color is free at both. Paths
+    through a booked period cannot be swapped; the next option is tried.
+    Returns the freed color, or None if every path is blocked.
+    """
+    s_free = [c for c in range(period_count) if c not in at_vertex[s_vertex]]
+    t_free = [c for c in range(period_count) if c not in at_vertex[t_vertex]]
+    for a in s_free:
+        for b in t_free:
+            for start, first, other in ((t_vertex, a, b), (s_vertex, b, a)):
+                path = _alternating_path(lessons, at_vertex, start, first, other)
+                if path is None:
+                    continue
+                for edge in path:
+                    e_owner, e_teacher, _ = lessons[edge]
+                    old = colors[edge]
+                    del at_vertex[('s', e_owner)][old]
+                    del at_vertex[('t', e_teacher)][old]
+                for edge in path:
+                    e_owner, e_teacher, _ = lessons[edge]
+                    new = b if colors[edge] == a else a
+                    colors[edge] = new
+                    at_vertex[('s', e_owner)][new] = edge
+                    at_vertex[('t', e_teacher)][new] = edge
+                return first
+    return None
+
+
+def _alternating_path(lessons, at_vertex, vertex, first, other):
+    """Lessons on the first/other alternating path from `vertex`, or None if it hits a booking."""
+    path = []
+    c = first
+    while c in at_vertex[vertex]:
+        edge = at_vertex[vertex][c]
+        if edge == _BOOKED:
+            return None
+        path.append(edge)
+        e_owner, e_teacher, _ = lessons[edge]
+        vertex = ('s', e_owner) if vertex[0] == 't' else ('t', e_teacher)
+        c = other if c == first else first
+    return path
+
+
+def _place_lessons(owners, demands, allocation, periods, teacher_busy):
+    """Expand allocated demands into lessons and color them.
+
+    Returns (lessons, colors); colors is None when phase 2 fails.
+    """
+    # Interleave each stream's subjects so none is left with only the
+    # periods the others did not want when it comes to spreading over days.
+    by_owner = defaultdict(list)
+    for i, demand in enumerate(demands):
+        by_owner[demand['owner']].append((demand['count'], allocation[i], demand['subject_id']))
+    lessons = []
+    for owner in owners:
+        pending = by_owner[owner]
+        for round_no in range(max(count for count, _, _ in pending)):
+            for count, teacher_id, subject_id in pending:
+                if round_no < count:
+                    lessons.append((owner, teacher_id, subject_id))
+    # Teachers with booked periods have the fewest choices; place their lessons first
+    lessons.sort(key=lambda lesson: -len(teacher_busy.get(lesson[1], ())))
+    return lessons, _color_lessons(lessons, periods, teacher_busy)
+
+
+def solve_timetable(owners, teacher_ids, subject_ids, periods, class_teachers=None,
+                    qualifications=None, max_lessons_per_teacher=None,
+                    home_rooms=None, booked=None, search_limit=DEFAULT_SEARCH_LIMIT):
+    """Solve a whole-school timetable in memory.
+
+    Args:
+        owners: list of (class_id, stream_id) tuples to timetable.
+        teacher_ids: the teacher pool.
+        subject_ids: subjects taught to every stream.
+        periods: list of (day_of_week, 'HH:MM' start, 'HH:MM' end), shared by every stream.
+        class_teachers: optional {owner: teacher_id}; the class teacher always
+            teaches at least one subject to their own stream.
+        qualifications: optional {subject_id: set(teacher_ids)}. Subjects
+            missing from the mapping can be taught by any teacher.
+        max_lessons_per_teacher: optional weekly cap (never more than the
+            number of periods).
+        home_rooms: optional {owner: classroom}; every lesson of a stream is
+            held in its home room. A stream is taught in every period, so two
+            streams can never share one.
+        booked: optional iterable of (teacher_id, classroom, day_of_week,
+            'HH:MM' start, 'HH:MM' end) for lessons of streams outside
+            `owners` that stay in place. Their teachers and rooms are not
+            used in the periods they overlap.
+
+    Returns:
+        (True, {'slots': [...], 'stats': {...}}) with one slot dict per lesson, or
+        (False, {'conflicts': [...]}) listing the constraints that cannot be met.
+    """
+    class_teachers = class_teachers or {}
+    qualifications = qualifications or {}
+    teacher_ids = list(dict.fromkeys(teacher_ids))
+    for teacher_id in class_teachers.values():
+        if teacher_id not in teacher_ids:
+            teacher_ids.append(teacher_id)
+
+    conflicts = []
+    if not owners:
+        conflicts.append('No class/streams to timetable')
+    if not teacher_ids:
+        conflicts.append('No teachers available')
+    if not subject_ids:
+        conflicts.append('No subjects available')
+    if not periods:
+        conflicts.append('No teaching periods defined')
+    if conflicts:
+        return False, {'conflicts': conflicts}
+
+    home_rooms = home_rooms or {}
+    room_owners = defaultdict(list)
+    for owner in owners:
+        if home_rooms.get(owner):
+            room_owners[home_rooms[owner]].append(owner)
+    for room, sharing in sorted(room_owners.items()):
+        if len(sharing) > 1:
+            conflicts.append(f'Classroom {room} is the home room of class/streams {sharing}; each needs it every period')
+
+    teacher_busy, room_busy = _booked_periods(booked or (), periods)
+    for room, sharing in sorted(room_owners.items()):
+        if room_busy.get(room):
+            conflicts.append(f'Classroom {room} is the home room of class/streams {sharing} but is booked '
+                             f'by other class/streams in {len(room_busy[room])} period(s)')
+
+    period_count = len(periods)
+    cap = period_count if max_lessons_per_teacher is None else min(period_count, max_lessons_per_teacher)
+    capacity = {t: max(0, min(cap, period_count - len(teacher_busy.get(t, ())))) for t in teacher_ids}
+    counts = subject_lesson_counts(subject_ids, period_count)
+
+    teacher_set = set(teacher_ids)
+    qualified = {}
+    for subject_id in counts:
+        allowed = qualifications.get(subject_id)
+        qualified[subject_id] = sorted(teacher_set if not allowed else set(allowed) & teacher_set)
+        if not qualified[subject_id]:
+            conflicts.append(f'Subject {subject_id} has no qualified teacher')
+
+    # Demands: one per (stream, subject); the class teacher takes the largest
+    # subject they are qualified for in their own stream.
+    demands = []
+    for owner in owners:
+        class_teacher = class_teachers.get(owner)
+        pinned = False
+        for subject_id, count in sorted(counts.items(), key=lambda kv: -kv[1]):
+            demand = {'owner': owner, 'subject_id': subject_id, 'count': count}
+            if class_teacher is not None and not pinned and class_teacher in qualified.get(subject_id, ()):
+                demand['teacher_id'] = class_teacher
+                pinned = True
+            demands.append(demand)
+        if class_teacher is not None and not pinned:
+            conflicts.append(f'Class teacher {class_teacher} of class/stream {owner} is not qualified for any subject')
+
+    # Capacity checks that pinpoint an impossible subject before searching
+    for subject_id, count in counts.items():
+        if not qualified[subject_id]:
+            continue
+        needed = count * len(owners)
+        usable = [t for t in qualified[subject_id] if capacity[t] >= count]
+        available = sum((capacity[t] // count) * count for t in usable)
+        if needed > available:
+            conflicts.append(
+                f'Subject {subject_id} needs {needed} lessons/week but its qualified teachers with room '
+                f'for {count} lessons ({len(usable)} of {len(qualified[subject_id])}) can cover at most {available}'
+            )
+    # Subjects restricted to the same pool of teachers compete for its
+    # capacity: every subject whose qualified teachers all sit inside a pool
+    # must fit into that pool together.
+    pools = {frozenset(q) for q in qualified.values() if q}
+    for pool in pools:
+        sharing = [sid for sid, q in qualified.items() if q and set(q) <= pool]
+        if len(sharing) < 2 or len(pool) == len(teacher_set):
+            continue
+        needed = sum(counts[sid] for sid in sharing) * len(owners)
+        available = sum(capacity[t] for t in pool)
+        if needed > available:
+            conflicts.append(
+                f'Subjects {sorted(sharing)} need {needed} lessons/week between them but can only be '
+                f'taught by teacher(s) {sorted(pool)} with capacity {available}'
+            )
+    needed_total = period_count * len(owners)
+    available_total = sum(capacity.values())
+    if needed_total > available_total:
+        conflicts.append(
+            f'{len(owners)} class/streams need {needed_total} lessons/week but {len(teacher_ids)} '
+            f'teacher(s) can teach at most {available_total}'
+        )
+    pinned_load = defaultdict(int)
+    for demand in demands:
+        if 'teacher_id' in demand:
+            pinned_load[demand['teacher_id']] += demand['count']
+    for teacher_id, load in pinned_load.items():
+        if load > capacity[teacher_id]:
+            conflicts.append(f'Teacher {teacher_id} needs {load} lessons/week as class teacher but can teach at most {capacity[teacher_id]}')
+    if conflicts:
+        return False, {'conflicts': conflicts}
+
+    ok, result = _allocate_teachers(demands, qualified, capacity, search_limit)
+    if not ok:
+        return False, {'conflicts': [result]}
+    busy = {t: teacher_busy[t] for t in teacher_ids if teacher_busy.get(t)}
+    lessons, colors = _place_lessons(owners, demands, result, periods, busy)
+
+    # A teacher filled up to their free periods may be left with no way
+    # around their bookings. Retry with those teachers given fewer lessons.
+    for slack in range(1, BOOKED_RETRIES + 1):
+        if colors is not None:
+            break
+        reduced = {t: max(0, c - slack * len(busy.get(t, ()))) for t, c in capacity.items()}
+        ok, retry = _allocate_teachers(demands, qualified, reduced, search_limit)
+        if not ok:
+            break
+        lessons, colors = _place_lessons(owners, demands, retry, periods, busy)
+    if colors is None:
+        return False, {'conflicts': [
+            'No period assignment fits every lesson around the bookings of class/streams outside this run'
+        ]}
+
+    slots = []
+    for (owner, teacher_id, subject_id), color in zip(lessons, colors):
+        day, start, end = periods[color]
+        slots.append({
+            'teacher_id': teacher_id,
+            'class_id': owner[0],
+            'stream_id': owner[1],
+            'subject_id': subject_id,
+            'day_of_week': day,
+            'start_time': start,
+            'end_time': end,
+            'classroom': home_rooms.get(owner),
+        })
+
+    load = defaultdict(int)
+    for _, teacher_id, _ in lessons:
+        load[teacher_id] += 1
+    return True, {
+        'slots': slots,
+        'stats': {
+            'streams': len(owners),
+            'lessons': len(lessons),
+            'teachers_used': len(load),
+            'max_teacher_load': max(load.values()) if load else 0,
+        },
+    }